@@ -3,14 +3,19 @@
 """
 Moffi Auto-reservation main program
 """
+import signal
 import sys
 
 from moffi_sdk.auth import get_auth_token
+from moffi_sdk.cache import METADATA_CACHE
 from moffi_sdk.auto_reservation import auto_reservation
+from moffi_sdk.booking_window import book_at_opening
+from moffi_sdk.scheduler import AutoReservationDaemon
 from utils import (  # pylint: disable=R0801
     DEFAULT_CONFIG_RESERVATION_TEMPLATE,
     ConfigError,
     parse_config,
+    profile_run,
     setup_logging,
     setup_reservation_parser,
     format_working_days,
@@ -19,6 +24,31 @@ from utils import (  # pylint: disable=R0801
 if __name__ == "__main__":
     PARSER = setup_reservation_parser()
     PARSER.add_argument("--workingdays", nargs="+", help="Days on week to book", required=False)
+    PARSER.add_argument(
+        "--scan",
+        action="store_true",
+        default=None,
+        help="Fetch availabilities of all bookable dates at once instead of day by day",
+    )
+    PARSER.add_argument(
+        "--window-open",
+        dest="window_open",
+        action="store_true",
+        default=None,
+        help="Then wait for next date to open for reservation, and book it at this exact instant",
+    )
+    PARSER.add_argument(
+        "--daemon",
+        action="store_true",
+        default=None,
+        help="Keep running, book each date as soon as it enters the booking range",
+    )
+    PARSER.add_argument(
+        "--max-wait",
+        dest="max_wait",
+        type=float,
+        help="With --window-open, max seconds to wait for opening (default 3600)",
+    )
     CONFIG_TEMPLATE = DEFAULT_CONFIG_RESERVATION_TEMPLATE
     CONFIG_TEMPLATE["workingdays"] = {
         "section": "Reservation",
@@ -27,6 +57,10 @@ if __name__ == "__main__":
         "default_value": None,
         "formatter": format_working_days,
     }
+    CONFIG_TEMPLATE["scan"] = {"mandatory": False, "default_value": False}
+    CONFIG_TEMPLATE["window_open"] = {"mandatory": False, "default_value": False}
+    CONFIG_TEMPLATE["max_wait"] = {"mandatory": False, "default_value": 3600}
+    CONFIG_TEMPLATE["daemon"] = {"mandatory": False, "default_value": False}
     try:  # pylint: disable=R0801
         CONF = parse_config(argv=PARSER.parse_args(), config_template=CONFIG_TEMPLATE)
     except ConfigError as ex:
@@ -35,12 +69,45 @@ if __name__ == "__main__":
         sys.exit(2)
     setup_logging(CONF)
 
-    TOKEN = get_auth_token(username=CONF.get("user"), password=CONF.get("password"))
-    auto_reservation(
-        desk=CONF.get("desk"),
-        city=CONF.get("city"),
-        workspace=CONF.get("workspace"),
-        parking=CONF.get("parking"),
-        auth_token=TOKEN,
-        work_days=CONF.get("workingdays"),
-    )
+    if CONF.get("refresh_metadata"):
+        METADATA_CACHE.invalidate()
+
+    if CONF.get("daemon"):
+        DAEMON = AutoReservationDaemon(
+            username=CONF.get("user"),
+            password=CONF.get("password"),
+            desk=CONF.get("desk"),
+            city=CONF.get("city"),
+            workspace=CONF.get("workspace"),
+            parking=CONF.get("parking"),
+            work_days=CONF.get("workingdays"),
+            scan=CONF.get("scan"),
+            window_open=CONF.get("window_open"),
+        )
+        signal.signal(signal.SIGTERM, lambda signum, frame: DAEMON.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: DAEMON.stop())
+        DAEMON.run()
+        sys.exit(0)
+
+    with profile_run(CONF):
+        TOKEN = get_auth_token(username=CONF.get("user"), password=CONF.get("password"))
+        auto_reservation(
+            desk=CONF.get("desk"),
+            city=CONF.get("city"),
+            workspace=CONF.get("workspace"),
+            parking=CONF.get("parking"),
+            auth_token=TOKEN,
+            work_days=CONF.get("workingdays"),
+            scan=CONF.get("scan"),
+        )
+
+        if CONF.get("window_open"):
+            book_at_opening(
+                desk=CONF.get("desk"),
+                city=CONF.get("city"),
+                workspace=CONF.get("workspace"),
+                auth_token=TOKEN,
+                username=CONF.get("user"),
+                work_days=CONF.get("workingdays"),
+                max_wait=CONF.get("max_wait"),
+            )
@@ -0,0 +1,3 @@
+"""
+Moffi SDK benchmarks
+"""
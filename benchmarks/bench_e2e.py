@@ -0,0 +1,194 @@
+"""
+End-to-end benchmark against the local mock of Moffi API
+
+Runs main flows (auto reservation, desk order, reservations listing, moffics routes) on a MockServer,
+and reports wall time, number of API requests and bytes exchanged for each one
+
+Run with python -m benchmarks.bench_e2e [--latency 0.02] [--jitter 0.01] [--error-rate 0] [--repeat 3]
+"""
+
+import argparse
+import base64
+import itertools
+import logging
+import os
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from benchmarks.mock_server import MockMoffi, MockServer
+from moffi_sdk.auth import TOKEN_CACHE, get_auth_token
+from moffi_sdk.auto_reservation import auto_reservation
+from moffi_sdk.cache import METADATA_CACHE
+from moffi_sdk.exceptions import MoffiSdkException
+from moffi_sdk.order import order_desk
+from moffi_sdk.ratelimit import configure_rate_limit
+from moffi_sdk.reservations import get_reservations_by_date
+from moffi_sdk.utils import set_api_url
+
+CITY = "Paris"
+WORKSPACE = "Open space 1-0"
+DESK = "Desk 1-0-5"
+PARKING = "Parking"
+PASSWORD = "secret"
+USERS = itertools.count()
+
+
+def new_user() -> str:
+    """A user never seen by mock, with fresh reservations"""
+    return f"bench-{next(USERS)}@example.com"
+
+
+def next_open_day(offset: int) -> str:
+    """First week day after offset days"""
+    day = date.today() + timedelta(days=offset)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day.isoformat()
+
+
+def scenario_auto_reservation(cold: bool, scan: bool = False) -> Callable[[], None]:
+    """Auto reservation of desk and parking for a new user"""
+
+    def run_scenario() -> None:
+        if cold:
+            METADATA_CACHE.invalidate()
+        token = get_auth_token(username=new_user(), password=PASSWORD)
+        auto_reservation(desk=DESK, city=CITY, workspace=WORKSPACE, parking=PARKING, auth_token=token, scan=scan)
+
+    return run_scenario
+
+
+def scenario_order_desk(cold: bool) -> Callable[[], None]:
+    """Order a desk, on a day without reservation"""
+
+    def run_scenario() -> None:
+        if cold:
+            METADATA_CACHE.invalidate()
+        token = get_auth_token(username=new_user(), password=PASSWORD)
+        order_desk(city=CITY, workspace=WORKSPACE, desk=DESK, order_date=next_open_day(2), auth_token=token)
+
+    return run_scenario
+
+
+def scenario_reservations_by_date() -> Callable[[], None]:
+    """List all reservations of a user"""
+    username = new_user()
+
+    def run_scenario() -> None:
+        get_reservations_by_date(auth_token=get_auth_token(username=username, password=PASSWORD))
+
+    return run_scenario
+
+
+def scenario_moffics(route: str) -> Callable[[], None]:
+    """Call a moffics route through flask test client, calendars are fetched for a new user on each run"""
+    import moffics  # pylint: disable=import-outside-toplevel
+
+    moffics.APP.config["secret_key"] = b"0123456789abcdef"
+    client = moffics.APP.test_client()
+
+    def basic_auth(username: str) -> Dict[str, str]:
+        return {"Authorization": "Basic " + base64.b64encode(f"{username}:{PASSWORD}".encode()).decode()}
+
+    # calendar already in moffics cache, client sends its ETag
+    known_user = basic_auth(new_user())
+    known_etag = client.get("/", headers=known_user).headers.get("ETag", "")
+
+    def run_scenario() -> None:
+        if route == "/":
+            response = client.get("/", headers=basic_auth(new_user()))
+        elif route == "/ (304)":
+            response = client.get("/", headers=dict(known_user, **{"If-None-Match": known_etag}))
+        elif route == "/token":
+            token = client.get("/getToken", headers=basic_auth(new_user())).get_json()["token"]
+            response = client.get(f"/token/{token}")
+        else:
+            response = client.get(route)
+        if response.status_code >= 400:
+            raise MoffiSdkException(f"moffics {route} answered {response.status_code}")
+
+    return run_scenario
+
+
+def measure(mock: MockMoffi, func: Callable[[], None], repeat: int) -> Dict[str, float]:
+    """Run a scenario, return median wall time and mean API usage per run"""
+    durations = []
+    errors = 0
+    mock.reset_stats()
+    for _ in range(repeat):
+        TOKEN_CACHE.invalidate()
+        start = time.perf_counter()
+        try:
+            func()
+        except MoffiSdkException:
+            errors += 1
+        durations.append(time.perf_counter() - start)
+    return {
+        "wall_ms": statistics.median(durations) * 1000,
+        "requests": mock.stats["requests"] / repeat,
+        "bytes_out": mock.stats["bytes_received"] / repeat,
+        "bytes_in": mock.stats["bytes_sent"] / repeat,
+        "errors": errors,
+    }
+
+
+def run(mock: MockMoffi, repeat: int, moffics_routes: bool = True) -> List[str]:
+    """Run all scenarios, return report lines"""
+    scenarios = [
+        ("auto_reservation cold", scenario_auto_reservation(cold=True)),
+        ("auto_reservation warm", scenario_auto_reservation(cold=False)),
+        ("auto_reservation scan", scenario_auto_reservation(cold=False, scan=True)),
+        ("order_desk cold", scenario_order_desk(cold=True)),
+        ("order_desk warm", scenario_order_desk(cold=False)),
+        ("get_reservations_by_date", scenario_reservations_by_date()),
+    ]
+    if moffics_routes:
+        for route in ["/", "/ (304)", "/token", "/cache/stats"]:
+            scenarios.append((f"moffics {route}", scenario_moffics(route)))
+
+    lines = [f"{'scenario':<28} {'wall ms':>9} {'requests':>9} {'KB sent':>9} {'KB recv':>9} {'errors':>7}"]
+    for name, func in scenarios:
+        result = measure(mock, func, repeat)
+        lines.append(
+            f"{name:<28} {result['wall_ms']:>9.1f} {result['requests']:>9.1f}"
+            f" {result['bytes_out'] / 1024:>9.1f} {result['bytes_in'] / 1024:>9.1f} {result['errors']:>7}"
+        )
+    return lines
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="End-to-end benchmark on mock Moffi API")
+    PARSER.add_argument("--latency", type=float, default=0.02, help="Seconds added to every request")
+    PARSER.add_argument("--jitter", type=float, default=0.0, help="Max random seconds added to latency")
+    PARSER.add_argument("--error-rate", dest="error_rate", type=float, default=0.0, help="Probability of a 503")
+    PARSER.add_argument("--error-paths", dest="error_paths", help="Regex of paths subject to errors")
+    PARSER.add_argument("--orders", type=int, default=40, help="Upcoming orders per user")
+    PARSER.add_argument("--repeat", type=int, default=3, help="Runs per scenario")
+    PARSER.add_argument("--no-moffics", dest="moffics", action="store_false", help="Skip moffics routes")
+    PARSER.add_argument(
+        "--no-rate-limit", dest="rate_limit", action="store_false", help="Disable client side rate limiter"
+    )
+    ARGS = PARSER.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    configure_rate_limit(enabled=ARGS.rate_limit)
+    # keep user metadata cache untouched
+    METADATA_CACHE.path = os.path.join(tempfile.mkdtemp(prefix="moffi-bench"), "metadata.json")
+    with MockServer(
+        MockMoffi(
+            latency=ARGS.latency,
+            jitter=ARGS.jitter,
+            error_rate=ARGS.error_rate,
+            error_paths=ARGS.error_paths,
+            orders=ARGS.orders,
+        )
+    ) as SERVER:
+        set_api_url(SERVER.url)
+        print(
+            f"Mock API latency {ARGS.latency * 1000:.0f}ms, error rate {ARGS.error_rate:.0%},"
+            f" median of {ARGS.repeat} runs"
+        )
+        print("\n".join(run(SERVER.mock, repeat=ARGS.repeat, moffics_routes=ARGS.moffics)))
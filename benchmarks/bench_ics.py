@@ -0,0 +1,71 @@
+"""
+Benchmark of calendar serialization
+
+Compare ics library (object graph, then serialize) with the streaming ICS writer
+
+Run with python -m benchmarks.bench_ics [--events 1000 10000] [--repeat 5]
+"""
+
+import argparse
+import timeit
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from moffi_sdk.ics_writer import serialize_calendar
+from moffi_sdk.reservations import ReservationItem
+
+
+def synthetic_reservations(events: int) -> List[ReservationItem]:
+    """One reservation per day, one parking every 5 reservations"""
+    first_day = datetime(2024, 1, 1, 8, tzinfo=timezone.utc)
+    reservations = []
+    for index in range(events):
+        start = first_day + timedelta(days=index)
+        parking = index % 5 == 0
+        reservations.append(
+            ReservationItem(
+                "Parking" if parking else "Framework 3",
+                "1 rue de la Paix, Marseille",
+                "parking" if parking else "desk",
+                "Marseille",
+                None if parking else f"Desk4_{index % 60}",
+                start,
+                start + timedelta(hours=10),
+                "WAITING",
+                "PAID",
+            )
+        )
+    return reservations
+
+
+def ics_library(reservations: List[ReservationItem]) -> str:
+    """Previous path of moffics"""
+    from moffics import generate_calendar  # pylint: disable=import-outside-toplevel
+
+    return generate_calendar(reservations).serialize()
+
+
+def run(events_counts: List[int], repeat: int) -> None:
+    """Run and print benchmark"""
+    try:
+        import ics  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        ics = None
+
+    for events in events_counts:
+        reservations = synthetic_reservations(events)
+        cases = [("stream writer", lambda items=reservations: serialize_calendar(items))]
+        if ics is not None:
+            cases.insert(0, ("ics library", lambda items=reservations: ics_library(items)))
+        print(f"{events} events, best of {repeat}")
+        for name, func in cases:
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            print(f"{name:<20} {best * 1000:>9.1f} ms {events / best:>12,.0f} events/s")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Calendar serialization benchmark")
+    PARSER.add_argument("--events", type=int, nargs="+", default=[1000, 10000], help="Number of events in calendar")
+    PARSER.add_argument("--repeat", type=int, default=5, help="Number of runs, best is kept")
+    ARGS = PARSER.parse_args()
+    run(events_counts=ARGS.events, repeat=ARGS.repeat)
@@ -0,0 +1,74 @@
+"""
+Import time benchmark of SDK and entry points
+
+Each module is imported in a fresh interpreter with python -X importtime, best cumulative time is kept.
+Budgets of benchmarks/import_budget.json are checked : max import time, and heavy modules that must
+not be loaded at import. Exit code is 1 if a budget is exceeded
+
+Run with python -m benchmarks.bench_import_time [--repeat 5] [--budget benchmarks/import_budget.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET = os.path.join(ROOT, "benchmarks", "import_budget.json")
+
+
+def measure(module: str) -> Tuple[float, List[str]]:
+    """
+    Import a module in a fresh interpreter
+
+    :return: cumulative import time in ms, and imported top level packages
+    """
+    code = f"import sys, {module}; print(' '.join(sorted({{name.split('.')[0] for name in sys.modules}})))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative = 0.0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1]) / 1000
+    return cumulative, result.stdout.split()
+
+
+def run(budget: Dict[str, Dict], repeat: int) -> bool:
+    """Run and print benchmark, return True if all budgets are met"""
+    success = True
+    print(f"{'module':<30} {'best ms':>9} {'budget':>8}  status")
+    for module, limits in budget.items():
+        best = None
+        loaded = []
+        for _ in range(repeat):
+            duration, loaded = measure(module)
+            best = duration if best is None else min(best, duration)
+
+        errors = []
+        if limits.get("max_ms") is not None and best > limits.get("max_ms"):
+            errors.append("too slow")
+        heavy = [name for name in limits.get("forbidden", []) if name in loaded]
+        if heavy:
+            errors.append(f"loads {', '.join(heavy)}")
+        success = success and not errors
+        print(f"{module:<30} {best:>9.1f} {limits.get('max_ms', '-'):>8}  {'; '.join(errors) or 'ok'}")
+    return success
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Import time benchmark")
+    PARSER.add_argument("--repeat", type=int, default=5, help="Number of runs per module, best is kept")
+    PARSER.add_argument("--budget", default=DEFAULT_BUDGET, help="Budget file")
+    ARGS = PARSER.parse_args()
+    with open(ARGS.budget, "r", encoding="utf-8") as budget_file:
+        BUDGET = json.load(budget_file)
+    sys.exit(0 if run(budget=BUDGET, repeat=ARGS.repeat) else 1)
@@ -0,0 +1,138 @@
+"""
+Micro-benchmark of reservations parsing and mapping
+
+Compare the previous implementation (dateutil parsing, regular dataclass)
+with the current one on a synthetic payload
+
+Run with python -m benchmarks.bench_map_reservations [--bookings 10000] [--repeat 5]
+"""
+
+import argparse
+import timeit
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from dateutil import parser as dateparser
+
+from moffi_sdk.reservations import map_reservations
+from moffi_sdk.utils import parse_datetime
+
+
+@dataclass
+class LegacyReservationItem:  # pylint: disable=too-many-instance-attributes
+    """Reservation item, as before slots"""
+
+    workspace_name: str
+    workspace_address: str
+    workspace_type: str
+    workspace_city: str
+    desk_name: str
+    start: datetime
+    end: datetime
+    step: str
+    status: str
+
+
+def legacy_map_reservations(reservations: dict) -> List[LegacyReservationItem]:
+    """map_reservations, as before fast parsing"""
+
+    content = reservations.get("content", [])
+    cleaned = []
+    for reservation in content:
+        step = reservation.get("step")
+        status = reservation.get("status")
+
+        for booking in reservation.get("bookings", []):
+            workspace = booking.get("workspace", {}).get("title")
+            workspace_type = booking.get("workspace", {}).get("type")
+            address = booking.get("workspace", {}).get("address")
+            city = booking.get("workspace", {}).get("building", {}).get("name")
+            start = dateparser.parse(booking.get("start"))
+            end = dateparser.parse(booking.get("end"))
+
+            for seat in booking.get("bookedSeats", []):
+                cleaned.append(
+                    LegacyReservationItem(
+                        workspace_name=workspace,
+                        workspace_address=address,
+                        workspace_type=workspace_type,
+                        workspace_city=city,
+                        desk_name=seat.get("seat", {}).get("fullname"),
+                        start=start,
+                        end=end,
+                        step=step,
+                        status=status,
+                    )
+                )
+            if not booking.get("bookedSeats"):
+                cleaned.append(
+                    LegacyReservationItem(
+                        workspace_name=workspace,
+                        workspace_address=address,
+                        workspace_type=workspace_type,
+                        workspace_city=city,
+                        desk_name=None,
+                        start=start,
+                        end=end,
+                        step=step,
+                        status=status,
+                    )
+                )
+
+    return cleaned
+
+
+def synthetic_payload(bookings: int) -> Dict[str, Any]:
+    """Orders payload as returned by /orders, one booking per order, one parking every 5 bookings"""
+    first_day = datetime(2024, 1, 1, 8, tzinfo=timezone.utc)
+    content = []
+    for index in range(bookings):
+        start = first_day + timedelta(days=index)
+        parking = index % 5 == 0
+        content.append(
+            {
+                "step": "WAITING",
+                "status": "PAID",
+                "bookings": [
+                    {
+                        "workspace": {
+                            "title": "Parking" if parking else "Framework 3",
+                            "type": "parking" if parking else "desk",
+                            "address": "1 rue de la Paix, Marseille",
+                            "building": {"name": "Marseille"},
+                        },
+                        "start": start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                        "end": (start + timedelta(hours=10)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                        "bookedSeats": [] if parking else [{"seat": {"fullname": f"Desk4_{index % 60}"}}],
+                    }
+                ],
+            }
+        )
+    return {"content": content}
+
+
+def run(bookings: int, repeat: int) -> None:
+    """Run and print benchmark"""
+    payload = synthetic_payload(bookings)
+    dates = [booking["start"] for order in payload["content"] for booking in order["bookings"]]
+
+    cases = [
+        ("parse dateutil", lambda: [dateparser.parse(value) for value in dates]),
+        ("parse fast", lambda: [parse_datetime(value) for value in dates]),
+        ("map before", lambda: legacy_map_reservations(payload)),
+        ("map after", lambda: map_reservations(payload)),
+        ("map after, frozen", lambda: map_reservations(payload, frozen=True)),
+    ]
+    print(f"{bookings} bookings, best of {repeat}")
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:<20} {best * 1000:>9.1f} ms {bookings / best:>12,.0f} items/s")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Reservations mapping micro-benchmark")
+    PARSER.add_argument("--bookings", type=int, default=10000, help="Number of bookings in payload")
+    PARSER.add_argument("--repeat", type=int, default=5, help="Number of runs, best is kept")
+    ARGS = PARSER.parse_args()
+    run(bookings=ARGS.bookings, repeat=ARGS.repeat)
@@ -0,0 +1,457 @@
+"""
+Local mock of Moffi API
+
+Implements the endpoints used by the SDK, on generated buildings, workspaces, seats and orders,
+with injectable latency and errors. Requests and bytes are counted per endpoint.
+
+Run standalone with python -m benchmarks.mock_server [--port 8900] [--latency 0.05] [--error-rate 0.01],
+then point SDK to it with MOFFI_API=http://127.0.0.1:8900/api
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/api"
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+STEPS = {
+    "VALIDATION": "validation",
+    "INVITATION": "invitation",
+    "WAITING": "waiting",
+    "IN_PROGRESS": "inProgress",
+    "FINISHED": "finished",
+}
+# largest page size accepted on /orders, like the real API
+MAX_PAGE_SIZE = 50
+
+
+class MockMoffi:  # pylint: disable=too-many-instance-attributes
+    """
+    In-memory Moffi data and request handling
+
+    :param latency: seconds added to every request
+    :param jitter: max random seconds added to latency
+    :param error_rate: probability of answering 503 to a request
+    :param error_paths: regex of paths subject to errors, all paths by default
+    :param rate_limit: requests per second accepted, with a burst of one second, others get a 429 with Retry-After
+    :param orders: number of upcoming orders of each user
+    :param floors: floors per building
+    :param workspaces_per_floor: workspaces per floor
+    :param seats: seats per workspace
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_paths: Optional[str] = None,
+        rate_limit: float = 0.0,
+        orders: int = 40,
+        floors: int = 4,
+        workspaces_per_floor: int = 3,
+        seats: int = 40,
+        seed: int = 42,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_paths = re.compile(error_paths) if error_paths else None
+        self.rate_limit = rate_limit
+        self._allowance = rate_limit
+        self._allowance_at = time.monotonic()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.stats = Counter()
+        self.requests = Counter()
+        self.tokens: Dict[str, str] = {}
+        self.orders: Dict[str, List[Dict[str, Any]]] = {}
+        self.pending_orders: Dict[int, Dict[str, Any]] = {}
+        self.next_order_id = 1000
+
+        self.buildings = []
+        self.workspaces = {}
+        for building_id, city in enumerate(["Paris", "Marseille"], start=1):
+            building = {
+                "id": building_id,
+                "name": city,
+                "timezone": "Europe/Paris",
+                "address": f"1 rue de la Paix, {city}",
+                "floors": [{"level": level, "name": f"Floor {level}"} for level in range(floors)],
+            }
+            self.buildings.append(building)
+            for level in range(floors):
+                for index in range(workspaces_per_floor):
+                    workspace_id = building_id * 1000 + level * 10 + index
+                    title = "Parking" if level == 0 and index == 0 else f"Open space {level}-{index}"
+                    self.workspaces[workspace_id] = {
+                        "id": workspace_id,
+                        "title": title,
+                        "type": "parking" if title == "Parking" else "desk",
+                        "url": f"coworking/{workspace_id}-{city}-{title.replace(' ', '-')}",
+                        "address": building["address"],
+                        "building": {"id": building_id, "name": city},
+                        "company": {"id": 7},
+                        "floor": {"level": level},
+                        "seats": [
+                            {"id": workspace_id * 100 + seat, "fullname": f"Desk {level}-{index}-{seat}"}
+                            for seat in range(0 if title == "Parking" else seats)
+                        ],
+                    }
+        self.orders_per_user = orders
+
+    def reset_stats(self) -> None:
+        """Reset requests and bytes counters"""
+        with self._lock:
+            self.stats.clear()
+            self.requests.clear()
+
+    def _user_orders(self, user: str) -> List[Dict[str, Any]]:
+        """Orders of a user, generated on first use, every other day from tomorrow"""
+        if user not in self.orders:
+            desk = self.workspaces[1010]
+            today = date.today()
+            self.orders[user] = [
+                self._build_order(
+                    desk, desk["seats"][index % len(desk["seats"])], today + timedelta(days=2 * index + 1)
+                )
+                for index in range(self.orders_per_user)
+            ]
+        return self.orders[user]
+
+    def _build_order(self, workspace: Dict[str, Any], seat: Optional[Dict[str, Any]], day: date) -> Dict[str, Any]:
+        self.next_order_id += 1
+        start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc) + timedelta(hours=7)
+        return {
+            "id": self.next_order_id,
+            "status": "PAID",
+            "step": "WAITING",
+            "kind": "BOOKING",
+            "bookings": [
+                {
+                    "id": self.next_order_id * 10,
+                    "workspace": {
+                        "id": workspace["id"],
+                        "title": workspace["title"],
+                        "type": workspace["type"],
+                        "address": workspace["address"],
+                        "building": workspace["building"],
+                    },
+                    "start": start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    "end": (start + timedelta(hours=11)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    "bookedSeats": [{"seat": seat}] if seat else [],
+                }
+            ],
+        }
+
+    def _workspace_details(self, workspace: Dict[str, Any]) -> Dict[str, Any]:
+        details = {key: value for key, value in workspace.items() if key != "seats"}
+        details["plageMini"] = {"minutes": 0}
+        details["plageMaxi"] = {"minutes": 14 * 1440}
+        details["schedule"] = {
+            day: {"isOpen": day not in ("saturday", "sunday"), "beginningMorning": "08:00", "endingAfternoon": "19:00"}
+            for day in DAYS
+        }
+        return details
+
+    def _availability(self, workspace: Dict[str, Any], user: str, day: Optional[str]) -> Dict[str, Any]:
+        booked = set()
+        if day:
+            for order in self._user_orders(user):
+                for booking in order["bookings"]:
+                    if booking["start"].startswith(day[:10]):
+                        booked.update(seat["seat"]["id"] for seat in booking["bookedSeats"])
+        return {
+            "workspace": {key: value for key, value in workspace.items() if key != "seats"},
+            "seats": [
+                {"status": "UNAVAILABLE" if seat["id"] in booked else "AVAILABLE", "seat": seat}
+                for seat in workspace["seats"]
+            ],
+        }
+
+    def handle(  # pylint: disable=too-many-return-statements,too-many-branches,too-many-locals
+        self, method: str, path: str, query: Dict[str, List[str]], body: Any, token: Optional[str]
+    ) -> Tuple[int, Any]:
+        """
+        Answer an API request
+
+        :return: HTTP status and JSON body
+        """
+        if path == "/signin" and method == "POST":
+            if not body or not body.get("email") or not body.get("password"):
+                return 401, {"message": "Bad credentials"}
+            token = f"token-{body['email']}-{self._random.getrandbits(32):x}"
+            with self._lock:
+                self.tokens[token] = body["email"]
+            return 200, {"email": body["email"], "token": token}
+
+        user = self.tokens.get(token)
+        if user is None:
+            return 401, {"message": "Unauthorized"}
+
+        def arg(name: str, default: Any = None) -> Any:
+            return query.get(name, [default])[0]
+
+        if path == "/users/buildings":
+            return 200, [{"id": building["id"], "name": building["name"]} for building in self.buildings]
+
+        match = re.fullmatch(r"/buildings/(\d+)", path)
+        if match:
+            for building in self.buildings:
+                if building["id"] == int(match.group(1)):
+                    return 200, building
+            return 404, {"message": "Building not found"}
+
+        if path == "/workspaces/availabilities":
+            building_id = int(arg("buildingId", 0))
+            floor = int(arg("floor", 0))
+            workspace_id = arg("workspaceId")
+            return 200, [
+                self._availability(workspace, user, arg("startDate"))
+                for workspace in self.workspaces.values()
+                if workspace["building"]["id"] == building_id
+                and workspace["floor"]["level"] == floor
+                and (workspace_id is None or workspace["id"] == int(workspace_id))
+            ]
+
+        if path.startswith("/workspaces/url/"):
+            url = path[len("/workspaces/url/") :]
+            for workspace in self.workspaces.values():
+                if workspace["url"] == url:
+                    return 200, self._workspace_details(workspace)
+            return 404, {"message": "Workspace not found"}
+
+        if path == "/orders/count":
+            counts = {step: 0 for step in STEPS.values()}
+            for order in self._user_orders(user):
+                counts[STEPS[order["step"]]] += 1
+            return 200, counts
+
+        if path == "/orders" and method == "GET":
+            size = int(arg("size", 10))
+            page = int(arg("page", 0))
+            if size > MAX_PAGE_SIZE:
+                return 400, {"message": f"Page size must not be greater than {MAX_PAGE_SIZE}"}
+            if query.get("status") == ["CANCELLED"]:
+                orders = []
+            else:
+                orders = [order for order in self._user_orders(user) if order["step"] == arg("step")]
+            content = orders[page * size : (page + 1) * size]
+            return 200, {
+                "content": content,
+                "size": size,
+                "number": page,
+                "totalElements": len(orders),
+                "last": (page + 1) * size >= len(orders),
+            }
+
+        if path == "/planning/unavailabilities":
+            return 200, {}
+
+        if path == "/bookings/estimate" and method == "POST":
+            return 200, {"totalBookings": 0, "errorCode": None}
+
+        if path == "/orders/add" and method == "POST":
+            booking = body["bookings"][0]
+            workspace = self.workspaces.get(booking["workspaceId"])
+            if workspace is None:
+                return 404, {"message": "Workspace not found"}
+            seats = booking.get("bookedSeats") or []
+            with self._lock:
+                order = self._build_order(workspace, seats[0]["seat"] if seats else None, date.today())
+                order["bookings"][0]["start"] = booking["start"]
+                order["bookings"][0]["end"] = booking["end"]
+                order.update({"status": "CREATED", "totalBookings": 0, "author": {"id": 1}})
+                self.pending_orders[order["id"]] = order
+            return 200, order
+
+        match = re.fullmatch(r"/orders/(\d+)/pay", path)
+        if match and method == "POST":
+            with self._lock:
+                order = self.pending_orders.pop(int(match.group(1)), None)
+                if order is None:
+                    return 404, {"message": "Order not found"}
+                order["status"] = "PAID"
+                self._user_orders(user).append(order)
+            return 200, order
+
+        return 404, {"message": f"Unknown endpoint {method} {path}"}
+
+    def delay(self) -> None:
+        """Simulated network and server latency"""
+        duration = self.latency + (self._random.random() * self.jitter if self.jitter else 0.0)
+        if duration > 0:
+            time.sleep(duration)
+
+    def failing(self, path: str) -> bool:
+        """Randomly fail a request"""
+        if not self.error_rate or (self.error_paths is not None and not self.error_paths.search(path)):
+            return False
+        return self._random.random() < self.error_rate
+
+    def throttled(self) -> Optional[int]:
+        """Server side rate limit, return seconds to wait if request is over limit"""
+        if not self.rate_limit:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate_limit, self._allowance + (now - self._allowance_at) * self.rate_limit)
+            self._allowance_at = now
+            if self._allowance < 1:
+                return max(1, math.ceil((1 - self._allowance) / self.rate_limit))
+            self._allowance -= 1
+            return None
+
+    def count(self, endpoint: str, received: int, sent: int, status: int) -> None:
+        """Count a request"""
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.stats["requests"] += 1
+            self.stats["bytes_received"] += received
+            self.stats["bytes_sent"] += sent
+            self.stats[f"status_{status}"] += 1
+
+
+def endpoint_template(path: str) -> str:
+    """Endpoint of a path, without ids"""
+    path = re.sub(r"/\d+", "/{id}", path)
+    if path.startswith("/workspaces/url/"):
+        return "/workspaces/url/{url}"
+    return path
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """HTTP handler of mock server"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MockMoffi/1.0"
+    # headers and body are sent in separate writes, avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def _answer(self, method: str) -> None:
+        mock = self.server.mock
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        received = len(self.raw_requestline) + len(str(self.headers)) + len(raw_body)
+
+        path = (url.path[len(API_PREFIX) :] if url.path.startswith(API_PREFIX) else url.path) or "/"
+        mock.delay()
+        retry_after = mock.throttled()
+        if method == "HEAD":
+            status, body = 200, None
+        elif retry_after is not None:
+            status, body = 429, {"message": "Too many requests"}
+        elif mock.failing(path):
+            status, body = 503, {"message": "Injected error"}
+        else:
+            authorization = self.headers.get("Authorization", "")
+            token = authorization[len("Bearer ") :] if authorization.startswith("Bearer ") else None
+            try:
+                status, body = mock.handle(
+                    method, path, parse_qs(url.query), json.loads(raw_body) if raw_body else None, token
+                )
+            except (KeyError, TypeError, ValueError) as ex:
+                status, body = 400, {"message": repr(ex)}
+
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", str(retry_after))
+        # count before answering, headers included, so a client always sees its request counted
+        sent = sum(len(line) for line in self._headers_buffer) + len(b"\r\n") + (len(data) if method != "HEAD" else 0)
+        mock.count(endpoint_template(path), received=received, sent=sent, status=status)
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(data)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """GET request"""
+        self._answer("GET")
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """POST request"""
+        self._answer("POST")
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        """HEAD request, used to read server date"""
+        self._answer("HEAD")
+
+
+class MockServer:
+    """Mock Moffi API served in a background thread"""
+
+    def __init__(self, mock: MockMoffi = None, host: str = "127.0.0.1", port: int = 0):
+        self.mock = mock or MockMoffi()
+        self._server = ThreadingHTTPServer((host, port), MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self.mock
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """API root URL"""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self) -> "MockServer":
+        """Serve in background"""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-moffi", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser(description="Mock Moffi API")
+    PARSER.add_argument("--host", default="127.0.0.1", help="Listen address")
+    PARSER.add_argument("--port", type=int, default=8900, help="Listen port")
+    PARSER.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    PARSER.add_argument("--jitter", type=float, default=0.0, help="Max random seconds added to latency")
+    PARSER.add_argument("--error-rate", dest="error_rate", type=float, default=0.0, help="Probability of a 503")
+    PARSER.add_argument("--error-paths", dest="error_paths", help="Regex of paths subject to errors")
+    PARSER.add_argument("--rate-limit", dest="rate_limit", type=float, default=0.0, help="Requests per second")
+    PARSER.add_argument("--orders", type=int, default=40, help="Upcoming orders per user")
+    ARGS = PARSER.parse_args()
+    SERVER = MockServer(
+        MockMoffi(
+            latency=ARGS.latency,
+            jitter=ARGS.jitter,
+            error_rate=ARGS.error_rate,
+            error_paths=ARGS.error_paths,
+            rate_limit=ARGS.rate_limit,
+            orders=ARGS.orders,
+        ),
+        host=ARGS.host,
+        port=ARGS.port,
+    )
+    print(f"Mock Moffi API on {SERVER.url}")
+    try:
+        SERVER.start()._thread.join()  # pylint: disable=protected-access
+    except KeyboardInterrupt:
+        SERVER.stop()
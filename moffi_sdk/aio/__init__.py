@@ -0,0 +1,5 @@
+"""
+MOFFI asyncio SDK
+
+Same API as moffi_sdk, as coroutines, on a pooled httpx client (optional dependency, HTTP/2 with h2)
+"""
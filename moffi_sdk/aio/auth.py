@@ -0,0 +1,128 @@
+"""
+MOFFI asyncio authentication
+
+Tokens are shared with the sync SDK, see moffi_sdk.auth.TokenCache
+"""
+
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from moffi_sdk.aio.utils import get_client, httpx
+from moffi_sdk.auth import get_token_cache
+from moffi_sdk.exceptions import AuthenticationException
+from moffi_sdk.utils import get_api_url
+
+# one signin at a time per user, asyncio locks are bound to their event loop : locks and tasks using them, by loop
+_USER_LOCKS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Tuple[asyncio.Lock, int]]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+@asynccontextmanager
+async def _user_lock(username: str) -> AsyncIterator[None]:
+    """Hold the signin lock of a user on the running loop, forgotten once no task uses it"""
+    locks = _USER_LOCKS.setdefault(asyncio.get_running_loop(), {})
+    lock, users = locks.get(username, (None, 0))
+    if lock is None:
+        lock = asyncio.Lock()
+    locks[username] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = locks[username]
+        if users > 1:
+            locks[username] = (lock, users - 1)
+        else:
+            del locks[username]
+
+
+async def signin(username: str, password: str) -> Dict[str, Any]:
+    """
+    Authenticate to Moffi API and return all profile informations
+
+    Raise AuthenticationException in case of error
+    """
+
+    data = {"captcha": "NOT_PROVIDED", "email": username, "password": password}
+    client = get_client()
+    try:
+        response = await client.post(url=f"{get_api_url()}/signin", json=data)
+    except httpx.HTTPError as ex:
+        raise AuthenticationException from ex
+
+    if response.status_code != 200:
+        raise AuthenticationException(f"Signing error {response.status_code} {response.text}")
+
+    return response.json()
+
+
+async def _signin_token(username: str, password: str) -> str:
+    """Signin and extract token from profile"""
+
+    profile = await signin(username=username, password=password)
+    auth_token = profile.get("token")
+
+    if not auth_token:
+        raise AuthenticationException("No token found on profile")
+
+    return auth_token
+
+
+async def get_auth_token(username: str, password: str, use_cache: bool = True) -> str:
+    """
+    Authenticate to Moffi API and return API authentication token
+
+    Token is served from cache while valid, unless use_cache is False
+
+    Raise AuthenticationException in case of error
+    """
+
+    if not use_cache:
+        return await _signin_token(username=username, password=password)
+
+    token_cache = get_token_cache()
+    async with _user_lock(username):
+        auth_token = token_cache.lookup(username, password)
+        if auth_token is not None:
+            return auth_token
+
+        logging.debug(f"No valid token in cache for {username}, signin")
+        try:
+            auth_token = await _signin_token(username=username, password=password)
+        except AuthenticationException:
+            # forget cached credentials once they are rejected, never on a failed attempt with other ones
+            token_cache.invalidate_credentials(username, password)
+            raise
+        return token_cache.store(username, password, auth_token).token
+
+
+async def renew_token(auth_token: str) -> Optional[str]:
+    """
+    Renew a rejected token with cached credentials
+
+    Return new token, or None if token is unknown or renewal failed
+    """
+    token_cache = get_token_cache()
+    credentials = token_cache.credentials_for(auth_token)
+    if credentials is None:
+        return None
+    username, password = credentials
+
+    async with _user_lock(username):
+        current_token = token_cache.lookup(username, password)
+        if current_token is not None and current_token != auth_token:
+            # already renewed by another task
+            return current_token
+
+        logging.debug(f"Token rejected for {username}, renew it")
+        try:
+            new_token = await _signin_token(username=username, password=password)
+        except AuthenticationException as ex:
+            logging.warning(f"Unable to renew token for {username} : {repr(ex)}")
+            token_cache.invalidate(username)
+            return None
+        return token_cache.store(username, password, new_token, previous_token=auth_token).token
@@ -0,0 +1,196 @@
+"""
+Moffi asyncio orders, see moffi_sdk.order
+"""
+
+import logging
+from datetime import date, datetime
+from time import perf_counter
+from typing import Any, Dict
+
+from moffi_sdk.aio.spaces import get_desk_for_date, get_workspace_details
+from moffi_sdk.aio.utils import query
+from moffi_sdk.exceptions import OrderException, RequestException, UnavailableException
+from moffi_sdk.order import PreparedOrder
+from moffi_sdk.order import prepare_order as _prepare_order
+from moffi_sdk.utils import format_rfc3339
+
+
+async def get_unavailabilities(company_id: str, start_date: date, end_date: date, auth_token: str) -> Dict[str, Any]:
+    """
+    Get user unavailabilities between two dates, included
+
+    :return: unavailabilities by date in isoformat
+    """
+    params = {
+        "companyId": company_id,
+        "start": format_rfc3339(datetime.combine(start_date, datetime.min.time())),
+        "end": format_rfc3339(datetime.combine(end_date, datetime.max.time())),
+    }
+    return await query(method="GET", url="/planning/unavailabilities", params=params, auth_token=auth_token)
+
+
+async def prepare_order(
+    order_date: date,
+    workspace_details: Dict[str, Any],
+    desk_details: Dict[str, Any],
+    auth_token: str,
+    unavailabilities: Dict[str, Any] = None,
+) -> PreparedOrder:
+    """
+    Check a desk can be ordered on date, and build estimate and order bodies
+
+    See moffi_sdk.order.prepare_order
+    """
+    if unavailabilities is None:
+        unavailabilities = await get_unavailabilities(
+            company_id=workspace_details.get("company", {}).get("id"),
+            start_date=order_date,
+            end_date=order_date,
+            auth_token=auth_token,
+        )
+    return _prepare_order(
+        order_date=order_date,
+        workspace_details=workspace_details,
+        desk_details=desk_details,
+        auth_token=auth_token,
+        unavailabilities=unavailabilities,
+    )
+
+
+async def submit_order(prepared: PreparedOrder, auth_token: str, timings: Dict[str, float] = None) -> Dict[str, Any]:
+    """
+    Send a prepared order : estimate, order and pay
+
+    See moffi_sdk.order.submit_order
+    """
+    if timings is None:
+        timings = {}
+    order_date = prepared.order_date
+    desk_fullname = prepared.desk_fullname
+
+    step_start = perf_counter()
+    estimate = await query(method="POST", url="/bookings/estimate", data=prepared.body_estimate, auth_token=auth_token)
+    timings["estimate"] = perf_counter() - step_start
+
+    # verify desk is available on estimate
+    if estimate.get("errorCode"):
+        raise UnavailableException(
+            f"Error during estimate for desk {desk_fullname} on {order_date.isoformat()} : {estimate.get('errorCode')}"
+        )
+
+    step_start = perf_counter()
+    try:
+        order = await query(method="POST", url="/orders/add", data=prepared.body_order, auth_token=auth_token)
+    finally:
+        # once sent, order may exist on server even if request failed, it must never be sent again
+        timings["order"] = perf_counter() - step_start
+
+    # verify price is 0
+    try:
+        price = int(order.get("totalBookings", -1))
+        if price != 0:
+            raise OrderException(f"Price for desk {desk_fullname} is {price}, we also work on free orders")
+    except ValueError:
+        logging.warning(f"Unable to check price on order {order.get('totalBookings')}")
+
+    order_id = order.get("id")
+    if not order_id:
+        raise OrderException("Unable to find order id in generated order")
+
+    # pay order
+    body_pay = {
+        "orderId": order_id,
+        "customer": {"id": order.get("author", {}).get("id")},
+        "method": "FREE",
+        "methodId": None,
+        "target": {"kind": "ORDER", "order": order},
+    }
+    step_start = perf_counter()
+    paid_order = await query(method="POST", url=f"/orders/{order_id}/pay", data=body_pay, auth_token=auth_token)
+    timings["pay"] = perf_counter() - step_start
+
+    if paid_order.get("status") != "PAID":
+        raise OrderException(f"Paid order is not on status PAID : {paid_order.get('status')}")
+
+    return paid_order
+
+
+async def order_desk_from_details(
+    order_date: date,
+    workspace_details: Dict[str, Any],
+    desk_details: Dict[str, Any],
+    auth_token: str,
+    unavailabilities: Dict[str, Any] = None,
+) -> Dict[str, Any]:
+    """
+    Order a desk in a workspace
+
+    See moffi_sdk.order.order_desk_from_details
+    """
+    prepared = await prepare_order(
+        order_date=order_date,
+        workspace_details=workspace_details,
+        desk_details=desk_details,
+        auth_token=auth_token,
+        unavailabilities=unavailabilities,
+    )
+    return await submit_order(prepared=prepared, auth_token=auth_token)
+
+
+async def order_desk(city: str, workspace: str, desk: str, order_date: str, auth_token: str) -> Dict[str, Any]:
+    """
+    Order a desk from basic details
+
+    See moffi_sdk.order.order_desk
+    """
+    try:
+        target_date = date.fromisoformat(order_date)
+    except ValueError as ex:
+        raise OrderException from ex
+
+    try:
+        workspace_details = await get_workspace_details(city=city, workspace=workspace, auth_token=auth_token)
+        desk_details = await get_desk_for_date(
+            desk_name=desk,
+            building_id=workspace_details.get("building", {}).get("id"),
+            workspace_id=workspace_details.get("id"),
+            target_date=target_date,
+            auth_token=auth_token,
+            floor=workspace_details.get("floor", {}).get("level"),
+        )
+    except RequestException as ex:
+        raise OrderException from ex
+
+    if desk_details.get("status") != "AVAILABLE":
+        raise UnavailableException(f"Desk {desk} is not available for reservation")
+
+    logging.info(f"Order desk {desk} for date {order_date}")
+    order_details = await order_desk_from_details(
+        order_date=target_date, workspace_details=workspace_details, desk_details=desk_details, auth_token=auth_token
+    )
+    logging.info("Order successful")
+    return order_details
+
+
+async def order_parking(city: str, parking: str, order_date: str, auth_token: str) -> Dict[str, Any]:
+    """
+    Order a parking from basic details
+
+    See moffi_sdk.order.order_parking
+    """
+    try:
+        target_date = date.fromisoformat(order_date)
+    except ValueError as ex:
+        raise OrderException from ex
+
+    try:
+        workspace_details = await get_workspace_details(city=city, workspace=parking, auth_token=auth_token)
+    except RequestException as ex:
+        raise OrderException from ex
+
+    logging.info(f"Order parking {parking} for date {order_date}")
+    order_details = await order_desk_from_details(
+        order_date=target_date, workspace_details=workspace_details, desk_details=None, auth_token=auth_token
+    )
+    logging.info("Order successful")
+    return order_details
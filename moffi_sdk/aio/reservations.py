@@ -0,0 +1,180 @@
+"""
+MOFFI asyncio reservations, see moffi_sdk.reservations
+"""
+
+import asyncio
+import logging
+import math
+from collections import defaultdict, deque
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List, Tuple
+
+from moffi_sdk.aio.utils import query
+from moffi_sdk.exceptions import MoffiSdkException
+from moffi_sdk.reservations import (
+    ADAPTIVE_PAGE_SIZE,
+    AVAILABLE_STEPS,
+    MAX_WORKERS,
+    PAGE_SIZE,
+    ReservationItem,
+    _is_last_page,
+    _orders_params,
+    map_reservations,
+)
+from moffi_sdk.spaces import BUILDING_TIMEZONE
+
+
+async def _get_orders_page(auth_token: str, step: str, page: int, max_size: int) -> Tuple[List[ReservationItem], int]:
+    """
+    Get a page of reservations on a step
+    Return reservations and number of orders in page
+    """
+    params = _orders_params(step=step, page=page, max_size=max_size)
+    unparsed_reservations = await query(method="GET", url="/orders", params=params, auth_token=auth_token)
+    return map_reservations(unparsed_reservations), len(unparsed_reservations.get("content", []))
+
+
+async def iter_reservations(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    auth_token: str,
+    steps: List[str] = None,
+    max_workers: int = MAX_WORKERS,
+    page_size: int = PAGE_SIZE,
+    adaptive_page_size: bool = False,
+    end_date: date = None,
+) -> AsyncIterator[ReservationItem]:
+    """
+    Iterate on reservations, page by page
+
+    Pages are computed from orders count and fetched concurrently, up to max_workers pages ahead,
+    items are yielded in steps and pages order
+
+    :param page_size: number of orders per request
+    :param adaptive_page_size: use the largest page size already probed by the sync SDK, if any
+    :param end_date: stop paging a step once reservations start after this date
+    """
+
+    if not auth_token:
+        raise MoffiSdkException("Missing token on get_reservations")
+
+    if steps is None:
+        steps = AVAILABLE_STEPS.keys()
+
+    # count number of items
+    counts = await query(method="GET", url="/orders/count", auth_token=auth_token)
+
+    max_size = page_size
+    if adaptive_page_size and ADAPTIVE_PAGE_SIZE.get("size"):
+        max_size = ADAPTIVE_PAGE_SIZE.get("size")
+    pages = []
+    for step in steps:
+        if AVAILABLE_STEPS.get(step) is None or counts.get(step) is None:
+            logging.warning(f"Unknown reservation step {step}, ignoring.")
+            continue
+        pages.extend((step, page) for page in range(math.ceil(counts.get(step) / max_size)))
+
+    pending = deque()
+    next_page = 0
+    stopped_steps = set()
+    try:
+        while pending or next_page < len(pages):
+            # keep up to max_workers pages in flight
+            while next_page < len(pages) and len(pending) < max_workers:
+                step, page = pages[next_page]
+                next_page += 1
+                if step not in stopped_steps:
+                    task = asyncio.ensure_future(_get_orders_page(auth_token, step, page, max_size))
+                    pending.append((step, page, task))
+            if not pending:
+                break
+
+            step, page, task = pending.popleft()
+            if step in stopped_steps:
+                task.cancel()
+                continue
+            new_reservations, orders_count = await task
+
+            # next page, in flight or not yet submitted, is of another step
+            if pending:
+                next_step = pending[0][0]
+            else:
+                next_step = pages[next_page][0] if next_page < len(pages) else None
+            last_page_of_step = next_step != step
+            if last_page_of_step and orders_count > counts.get(step) - page * max_size:
+                # orders have been added since count, continue until a short page
+                while orders_count == max_size:
+                    page += 1
+                    more_reservations, orders_count = await _get_orders_page(auth_token, step, page, max_size)
+                    new_reservations += more_reservations
+
+            for resa in new_reservations:
+                if end_date is not None and resa.start.date() > end_date:
+                    logging.debug(f"Reached end date {end_date.isoformat()} on step {step}")
+                    stopped_steps.add(step)
+                    break
+                yield resa
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+
+
+async def get_reservations(auth_token: str, steps: List[str] = None, **kwargs) -> List[ReservationItem]:
+    """
+    Get all reservations
+
+    See iter_reservations for optional arguments
+    """
+    return [resa async for resa in iter_reservations(auth_token=auth_token, steps=steps, **kwargs)]
+
+
+async def iter_cancelled_reservations(
+    auth_token: str, include_past: bool = False, page_size: int = PAGE_SIZE, end_date: date = None
+) -> AsyncIterator[ReservationItem]:
+    """
+    Iterate on upcoming cancelled reservations, page by page, latest first
+
+    :param include_past: also yield cancelled reservations in the past, instead of stopping at the first one
+    :param page_size: number of orders per request
+    :param end_date: skip reservations starting after this date
+    """
+    page = 0
+    last_page = False
+    today = datetime.now(BUILDING_TIMEZONE.get("tz")).date()
+    while not last_page:
+        params = {"status": "CANCELLED", "size": page_size, "page": page, "sort": "start_date,desc"}
+        unparsed_reservations = await query(method="GET", url="/orders", params=params, auth_token=auth_token)
+        for resa in map_reservations(unparsed_reservations):
+            if resa.start.date() <= today and not include_past:
+                logging.debug("Found cancelled reservation in the past, break")
+                return
+            if end_date is None or resa.start.date() <= end_date:
+                yield resa
+        last_page = _is_last_page(unparsed_reservations, page=page, max_size=page_size)
+        page += 1
+
+
+async def get_cancelled_reservations(auth_token: str, **kwargs) -> List[ReservationItem]:
+    """
+    Get cancelled reservations
+
+    See iter_cancelled_reservations for optional arguments
+    """
+    return [resa async for resa in iter_cancelled_reservations(auth_token=auth_token, **kwargs)]
+
+
+async def get_reservations_by_date(
+    auth_token: str, steps: List[str] = None, view_cancelled: bool = True, end_date: date = None
+) -> Dict[str, List[ReservationItem]]:
+    """
+    Get all reservations in dict format, key is starting date, value are list of reservations for this date
+
+    :param end_date: ignore reservations after this date, and stop paging as soon as possible
+    """
+    ordered_reservations = defaultdict(list)
+
+    async for resa in iter_reservations(auth_token=auth_token, steps=steps, end_date=end_date):
+        ordered_reservations[resa.start.date()].append(resa)
+    if view_cancelled:
+        async for resa in iter_cancelled_reservations(auth_token=auth_token, end_date=end_date):
+            ordered_reservations[resa.start.date()].append(resa)
+
+    return ordered_reservations
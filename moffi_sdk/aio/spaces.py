@@ -0,0 +1,194 @@
+"""
+Moffi asyncio space details
+
+Get details about buildings, workspaces, desks, see moffi_sdk.spaces
+Metadata cache reads and writes its file, it is used from a thread to keep the event loop running
+Building timezone is set for the current task only, as tasks of several users may share a loop
+"""
+
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List
+
+from moffi_sdk.aio.utils import query
+from moffi_sdk.cache import get_metadata_cache
+from moffi_sdk.exceptions import ItemNotFoundException, MoffiSdkException
+from moffi_sdk.spaces import (
+    BUILDING_TIMEZONE,
+    get_building_timezone,
+    get_desk_details_from_workspace,
+    set_context_building_timezone,
+)
+from moffi_sdk.utils import format_rfc3339
+
+
+async def get_building(name: str, auth_token: str) -> Dict[str, Any]:
+    """Get details about building, from metadata cache if available"""
+
+    building_details = await asyncio.to_thread(get_metadata_cache().get, "building", name)
+    if building_details is not None:
+        set_context_building_timezone(get_building_timezone(building_details))
+        return building_details
+
+    # list cities available
+    available_buildings = await query(
+        method="get", url="/users/buildings", params={"withDetails": False}, auth_token=auth_token
+    )
+    city = None
+    for building in available_buildings:
+        if building.get("name") == name:
+            city = building
+            break
+
+    if city is None:
+        buildings = [building.get("name", "NO_NAME") for building in available_buildings]
+        raise ItemNotFoundException(f"City {name} not found", available_items=buildings)
+
+    building_details = await query(method="GET", url=f"/buildings/{city.get('id')}", auth_token=auth_token)
+    set_context_building_timezone(get_building_timezone(building_details))
+    await asyncio.to_thread(get_metadata_cache().set, "building", name, building_details)
+
+    return building_details
+
+
+async def get_workspace_availabilities(
+    name: str,
+    auth_token: str,
+    city: str = None,
+    building_details: Dict[str, Any] = None,
+    target_date: datetime = None,
+) -> Dict[str, Any]:
+    """
+    Get details about workspace
+
+    Floors are queried concurrently, first floor with the workspace wins and pending floors are cancelled
+    """
+
+    if building_details is None:
+        building_details = await get_building(name=city, auth_token=auth_token)
+
+    if target_date is None:
+        target_date = format_rfc3339(datetime.now(BUILDING_TIMEZONE.get("tz")) + timedelta(days=1))
+
+    async def get_floor(floor: Dict[str, Any]) -> List[Dict[str, Any]]:
+        params = {
+            "buildingId": building_details.get("id"),
+            "startDate": target_date,
+            "endDate": target_date,
+            "places": 1,
+            "period": "DAY",
+            "floor": floor.get("level"),
+        }
+        return await query(method="get", url="/workspaces/availabilities", params=params, auth_token=auth_token)
+
+    # iterate on floors to find workspace
+    workspace_details = None
+    workspace_names = []
+    tasks = [asyncio.ensure_future(get_floor(floor)) for floor in building_details.get("floors", [])]
+    try:
+        for next_floor in asyncio.as_completed(tasks):
+            floor_details = await next_floor
+            workspace_names.extend([wks.get("workspace", {}).get("title", "NO_NAME") for wks in floor_details])
+            for workspace in floor_details:
+                if workspace.get("workspace", {}).get("title", "") == name:
+                    workspace_details = workspace
+                    break
+            if workspace_details is not None:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if workspace_details is None:
+        # failed to find workspace
+        raise ItemNotFoundException(f"Workspace {name} not found", available_items=workspace_names)
+
+    return workspace_details
+
+
+async def get_desk_for_date(  # pylint: disable=too-many-arguments
+    desk_name: str, building_id: str, workspace_id: str, floor: int, target_date: date, auth_token: str
+) -> Dict[str, Any]:
+    """Get desk availabilities for a given date"""
+
+    params = {
+        "buildingId": building_id,
+        "places": 1,
+        "period": "DAY",
+        "floor": floor,
+        "workspaceId": workspace_id,
+        "startDate": format_rfc3339(datetime.combine(target_date, datetime.min.time())),
+        "endDate": format_rfc3339(datetime.combine(target_date, datetime.max.time())),
+    }
+    workspace_details_list = await query(
+        method="GET", url="/workspaces/availabilities", params=params, auth_token=auth_token
+    )
+    if not workspace_details_list:
+        raise ItemNotFoundException(f"Workspace id {workspace_id} not found on building {building_id}")
+
+    return get_desk_details_from_workspace(name=desk_name, workspace_details=workspace_details_list[0])
+
+
+async def get_desk_for_dates(  # pylint: disable=too-many-arguments
+    desk_name: str, building_id: str, workspace_id: str, floor: int, target_dates: List[date], auth_token: str
+) -> Dict[date, Dict[str, Any]]:
+    """
+    Get desk availabilities for several dates, concurrently
+
+    Dates that failed are missing from result
+
+    :return: desk details by date
+    """
+    results = await asyncio.gather(
+        *[
+            get_desk_for_date(
+                desk_name=desk_name,
+                building_id=building_id,
+                workspace_id=workspace_id,
+                floor=floor,
+                target_date=target_date,
+                auth_token=auth_token,
+            )
+            for target_date in target_dates
+        ],
+        return_exceptions=True,
+    )
+    desks = {}
+    for target_date, result in zip(target_dates, results):
+        if isinstance(result, MoffiSdkException):
+            logging.warning(f"Unable to get desk {desk_name} for {target_date.isoformat()} : {repr(result)}")
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            desks[target_date] = result
+    return desks
+
+
+async def get_workspace_details(city: str, workspace: str, auth_token: str) -> Dict[str, Any]:
+    """
+    Get all workspace details
+
+    Building, workspace url and details are kept in metadata cache, a warm call does not query the API
+    """
+
+    metadata_cache = get_metadata_cache()
+    building_details = await get_building(name=city, auth_token=auth_token)
+    cache_key = f"{building_details.get('id')}/{workspace}"
+
+    workspace_details = await asyncio.to_thread(metadata_cache.get, "workspace", cache_key)
+    if workspace_details is not None:
+        return workspace_details
+
+    workspace_url = await asyncio.to_thread(metadata_cache.get, "workspace_url", cache_key)
+    if workspace_url is None:
+        workspace_availabilities = await get_workspace_availabilities(
+            name=workspace, building_details=building_details, auth_token=auth_token
+        )
+        workspace_url = workspace_availabilities.get("workspace", {}).get("url")
+        await asyncio.to_thread(metadata_cache.set, "workspace_url", cache_key, workspace_url)
+
+    workspace_details = await query(method="GET", url=f"/workspaces/url/{workspace_url}", auth_token=auth_token)
+    await asyncio.to_thread(metadata_cache.set, "workspace", cache_key, workspace_details)
+
+    return workspace_details
@@ -0,0 +1,235 @@
+"""
+MOFFI asyncio utils methods
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+from moffi_sdk.exceptions import MoffiSdkException, RequestException
+from moffi_sdk.metrics import RequestRecord, endpoint_template, record_request
+from moffi_sdk.ratelimit import backoff_delay, get_rate_limiter, parse_retry_after
+from moffi_sdk.request_cache import RequestCache, get_request_cache, is_mutating
+from moffi_sdk.utils import RETRYABLE_METHODS, SESSION_SETTINGS, THROTTLED_STATUS, get_api_url, prepare_request
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+CLIENT_SETTINGS = {
+    "http2": False,
+    "max_connections": SESSION_SETTINGS.get("pool_maxsize"),
+    "max_keepalive_connections": SESSION_SETTINGS.get("pool_maxsize"),
+    # connection failures only, a request already sent is never retried
+    "retries": SESSION_SETTINGS.get("retries"),
+    "timeout": SESSION_SETTINGS.get("timeout"),
+}
+
+# httpx clients are bound to the event loop they were created in
+_CLIENTS: Dict[asyncio.AbstractEventLoop, "httpx.AsyncClient"] = {}
+# identical GET requests in flight, by event loop, URL and token
+_IN_FLIGHT: Dict[Tuple[asyncio.AbstractEventLoop, str, str], "asyncio.Future"] = {}
+
+
+def _build_client(settings: Dict[str, Any]) -> "httpx.AsyncClient":
+    """Build a pooled async client from settings"""
+    if httpx is None:
+        raise MoffiSdkException("moffi_sdk.aio needs httpx, install it with: pip install httpx[http2]")
+
+    timeout = settings.get("timeout")
+    if isinstance(timeout, tuple):
+        timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+    return httpx.AsyncClient(
+        http2=settings.get("http2"),
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=settings.get("max_connections"),
+            max_keepalive_connections=settings.get("max_keepalive_connections"),
+        ),
+        transport=httpx.AsyncHTTPTransport(http2=settings.get("http2"), retries=settings.get("retries")),
+    )
+
+
+async def configure_client(  # pylint: disable=too-many-arguments
+    http2: Optional[bool] = None,
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    retries: Optional[int] = None,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None,
+) -> "httpx.AsyncClient":
+    """
+    Configure the async HTTP client of the running event loop
+
+    Only given settings are changed, the current client is closed and replaced
+
+    :param http2: use HTTP/2, needs h2 package
+    :param max_connections: max number of concurrent connections
+    :param max_keepalive_connections: max number of idle connections kept alive
+    :param retries: max retries on connection errors
+    :param timeout: request timeout in seconds, or a (connect, read) tuple
+    :return: new client
+    """
+    new_settings = {
+        "http2": http2,
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "retries": retries,
+        "timeout": timeout,
+    }
+    for key, value in new_settings.items():
+        if value is not None:
+            CLIENT_SETTINGS[key] = value
+    await close_client()
+    return get_client()
+
+
+def get_client() -> "httpx.AsyncClient":
+    """Get the async HTTP client of the running event loop, create it on first call"""
+    loop = asyncio.get_running_loop()
+    client = _CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        # forget clients of closed loops
+        for other_loop in [other_loop for other_loop in _CLIENTS if other_loop.is_closed()]:
+            _CLIENTS.pop(other_loop, None)
+        client = _CLIENTS[loop] = _build_client(CLIENT_SETTINGS)
+    return client
+
+
+async def close_client() -> None:
+    """Close the async HTTP client of the running event loop"""
+    client = _CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _send(  # pylint: disable=too-many-arguments
+    client: "httpx.AsyncClient",
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    data: Any,
+    account: str,
+    record: RequestRecord,
+) -> "httpx.Response":
+    """
+    Send a request through the shared rate limiter buckets, see moffi_sdk.utils._send
+
+    Concurrency is bounded by the client connection limits
+    """
+    retry_status = {THROTTLED_STATUS, *SESSION_SETTINGS.get("status_forcelist", ())}
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        if limiter.enabled:
+            delay = limiter.reserve(account)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        result = await client.request(method=method, url=url, headers=dict(headers), json=data)
+        if result.status_code not in retry_status:
+            return result
+
+        retry_after = parse_retry_after(result.headers.get("Retry-After"))
+        if limiter.enabled:
+            limiter.throttled(account, retry_after)
+        if method not in RETRYABLE_METHODS or attempt >= SESSION_SETTINGS.get("retries"):
+            return result
+        delay = backoff_delay(attempt, SESSION_SETTINGS.get("backoff_factor"), retry_after)
+        attempt += 1
+        record.retries += 1
+        await asyncio.sleep(delay)
+
+
+async def _fetch(  # pylint: disable=too-many-arguments
+    method: str,
+    url: str,
+    endpoint: str,
+    headers: Dict[str, str],
+    data: Any,
+    auth_token: str,
+    renew_token: bool,
+) -> bytes:
+    """
+    Send a request, with metrics, see query
+
+    :return: response body
+    :raise: RequestException
+    """
+    client = get_client()
+    record = RequestRecord(method=method, endpoint=endpoint, status=None, duration=0.0)
+    start = time.perf_counter()
+    try:
+        result = await _send(client, method, url, headers, data, account=auth_token, record=record)
+        if result.status_code == 401 and renew_token:
+            # token may have expired, re-authenticate once with cached credentials
+            from moffi_sdk.aio.auth import renew_token as renew  # pylint: disable=import-outside-toplevel,cyclic-import
+
+            new_token = await renew(auth_token)
+            if new_token:
+                headers["Authorization"] = f"Bearer {new_token}"
+                record.retries += 1
+                result = await _send(client, method, url, headers, data, account=new_token, record=record)
+    except httpx.HTTPError as ex:
+        record.duration = time.perf_counter() - start
+        record_request(record)
+        raise RequestException from ex
+
+    record.duration = time.perf_counter() - start
+    record.status = result.status_code
+    record.response_size = len(result.content)
+    record_request(record)
+
+    if result.status_code > 399:
+        raise RequestException(f"Request error {result.status_code} {result.text}")
+
+    return result.content
+
+
+async def _fetch_memoized(cache: RequestCache, key: Tuple[str, str], *args) -> bytes:
+    """Fetch a response body and store it, see _fetch"""
+    generation = cache.generation(key[1])
+    content = await _fetch(*args)
+    cache.set(key, content, generation)
+    return content
+
+
+async def query(  # pylint: disable=too-many-arguments
+    method: str,
+    url: str,
+    auth_token: str,
+    params: Dict[str, str] = None,
+    headers: Dict[str, str] = None,
+    data: Dict[str, Any] = None,
+    renew_token: bool = True,
+) -> Dict[str, Any]:
+    """
+    Query Moffi API, see moffi_sdk.utils.query
+
+    :raise: RequestException
+    """
+    url, ciheaders = prepare_request(method=method, url=url, auth_token=auth_token, params=params, headers=headers)
+    method = method.upper()
+    endpoint = endpoint_template(url, get_api_url())
+    args = (method, url, endpoint, ciheaders, data, auth_token, renew_token)
+
+    cache = get_request_cache()
+    if cache is not None and method == "GET" and not headers:
+        key = (url, auth_token)
+        content = cache.get(key)
+        if content is None:
+            flight_key = (asyncio.get_running_loop(), *key)
+            flight = _IN_FLIGHT.get(flight_key)
+            if flight is None:
+                flight = _IN_FLIGHT[flight_key] = asyncio.ensure_future(_fetch_memoized(cache, key, *args))
+                flight.add_done_callback(lambda _: _IN_FLIGHT.pop(flight_key, None))
+            # a cancelled caller must not cancel the request of other callers
+            content = await asyncio.shield(flight)
+        return json.loads(content)
+
+    try:
+        return json.loads(await _fetch(*args))
+    finally:
+        # even a failed request may have changed orders
+        if cache is not None and is_mutating(method, endpoint):
+            cache.invalidate(auth_token)
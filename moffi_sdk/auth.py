@@ -2,12 +2,29 @@
 MOFFI Authentication
 """
 
-from typing import Any, Dict
-
-import requests
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
 
+from moffi_sdk.context import CURRENT_CLIENT
 from moffi_sdk.exceptions import AuthenticationException
-from moffi_sdk.utils import MOFFI_API
+from moffi_sdk.tracing import traced
+from moffi_sdk.utils import get_api_url, get_session, get_session_settings
+
+# token lifetime when it does not carry its own expiry
+TOKEN_TTL = 3600
+# renew tokens a bit before their real expiry
+TOKEN_EXPIRY_MARGIN = 60
+
+# per process secret, used to fingerprint and mask credentials kept in memory
+_PROCESS_KEY = os.urandom(32)
 
 
 def signin(username: str, password: str) -> Dict[str, Any]:
@@ -17,9 +34,13 @@ def signin(username: str, password: str) -> Dict[str, Any]:
     Raise AuthenticationException in case of error
     """
 
+    import requests  # pylint: disable=import-outside-toplevel
+
     data = {"captcha": "NOT_PROVIDED", "email": username, "password": password}
     try:
-        response = requests.post(url=f"{MOFFI_API}/signin", json=data)
+        response = get_session().post(
+            url=f"{get_api_url()}/signin", json=data, timeout=get_session_settings().get("timeout")
+        )
     except requests.exceptions.RequestException as ex:
         raise AuthenticationException from ex
 
@@ -29,13 +50,210 @@ def signin(username: str, password: str) -> Dict[str, Any]:
     return response.json()
 
 
-def get_auth_token(username: str, password: str) -> str:
+def get_token_expiry(auth_token: str) -> Optional[float]:
     """
-    Authenticate to Moffi API and return API authentication token
+    Read expiry timestamp of a JWT token, without verifying it
 
-    Raise AuthenticationException in case of error
+    Return None if token is not a JWT or has no expiry
+    """
+    try:
+        payload = auth_token.split(".")[1]
+        padding = "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload + padding))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def credentials_digest(username: str, password: str) -> str:
+    """
+    Fingerprint of credentials, only valid for the current process
+
+    Used to compare credentials without keeping them
+    """
+    return hmac.new(_PROCESS_KEY, f"{username}\0{password}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _mask(secret: bytes, nonce: bytes) -> bytes:
+    """XOR secret with a keystream derived from process key and nonce, masking is its own inverse"""
+    stream = hashlib.shake_256(_PROCESS_KEY + nonce).digest(len(secret))
+    return bytes(a ^ b for a, b in zip(secret, stream))
+
+
+@dataclass
+class CachedToken:
+    """Authentication token in cache"""
+
+    token: str
+    expires_at: float
+    digest: str
+    nonce: bytes
+    masked_password: bytes
+    previous_token: Optional[str] = None
+
+    def is_valid(self, now: float = None) -> bool:
+        """Token is still usable"""
+        if now is None:
+            now = time.time()
+        return now < self.expires_at - TOKEN_EXPIRY_MARGIN
+
+    def password(self) -> str:
+        """Unmask password to renew token"""
+        return _mask(self.masked_password, self.nonce).decode("utf-8")
+
+
+class TokenCache:
+    """
+    Thread safe authentication tokens cache, keyed by username
+
+    Passwords are never stored in clear : credentials are checked against a keyed digest,
+    and only kept masked with a per process key so an expired token can be renewed
     """
 
+    def __init__(self, ttl: int = TOKEN_TTL):
+        self.ttl = ttl
+        self._entries: Dict[str, CachedToken] = {}
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.Lock] = {}
+
+    def _user_lock(self, username: str) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(username, threading.Lock())
+
+    def store(self, username: str, password: str, token: str, previous_token: str = None) -> CachedToken:
+        """Add or replace a user token"""
+        expires_at = get_token_expiry(token)
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        nonce = os.urandom(16)
+        entry = CachedToken(
+            token=token,
+            expires_at=expires_at,
+            digest=credentials_digest(username, password),
+            nonce=nonce,
+            masked_password=_mask(password.encode("utf-8"), nonce),
+            previous_token=previous_token,
+        )
+        with self._lock:
+            self._entries[username] = entry
+        return entry
+
+    def lookup(self, username: str, password: str) -> Optional[str]:
+        """Return a valid token for these credentials, without signin"""
+        digest = credentials_digest(username, password)
+        with self._lock:
+            entry = self._entries.get(username)
+        if entry is not None and entry.is_valid() and hmac.compare_digest(entry.digest, digest):
+            return entry.token
+        return None
+
+    def credentials_for(self, auth_token: str) -> Optional[Tuple[str, str]]:
+        """Return username and password of a cached token, to renew it"""
+        with self._lock:
+            for user, entry in self._entries.items():
+                if auth_token in (entry.token, entry.previous_token):
+                    return user, entry.password()
+        return None
+
+    def get_token(self, username: str, password: str) -> str:
+        """
+        Return a valid token for user, signin only if needed
+
+        Raise AuthenticationException in case of error
+        """
+        with self._user_lock(username):
+            token = self.lookup(username, password)
+            if token is not None:
+                return token
+
+            logging.debug(f"No valid token in cache for {username}, signin")
+            try:
+                token = _signin_token(username=username, password=password)
+            except AuthenticationException:
+                # forget cached credentials once they are rejected, never on a failed attempt with other ones
+                self.invalidate_credentials(username, password)
+                raise
+            return self.store(username, password, token).token
+
+    def renew(self, auth_token: str) -> Optional[str]:
+        """
+        Renew a rejected token with cached credentials
+
+        Return new token, or None if token is unknown or renewal failed
+        """
+        username = None
+        with self._lock:
+            for user, entry in self._entries.items():
+                if auth_token in (entry.token, entry.previous_token):
+                    username = user
+                    break
+        if username is None:
+            return None
+
+        with self._user_lock(username):
+            with self._lock:
+                entry = self._entries.get(username)
+            if entry is None:
+                return None
+            if entry.token != auth_token and entry.is_valid():
+                # already renewed by another thread
+                return entry.token
+
+            logging.debug(f"Token rejected for {username}, renew it")
+            password = entry.password()
+            try:
+                token = _signin_token(username=username, password=password)
+            except AuthenticationException as ex:
+                logging.warning(f"Unable to renew token for {username} : {repr(ex)}")
+                self.invalidate(username)
+                return None
+            return self.store(username, password, token, previous_token=auth_token).token
+
+    def token_for(self, username: str) -> Optional[str]:
+        """
+        Return a valid token for an already authenticated user, renewed with cached credentials if expired
+
+        Return None if user is unknown or renewal failed
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+        if entry is None:
+            return None
+        if entry.is_valid():
+            return entry.token
+        return self.renew(entry.token)
+
+    def invalidate_credentials(self, username: str, password: str) -> None:
+        """Remove a user token, only if it was obtained with these credentials"""
+        digest = credentials_digest(username, password)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and hmac.compare_digest(entry.digest, digest):
+                del self._entries[username]
+
+    def invalidate(self, username: str = None) -> None:
+        """Remove a user token, or all tokens if no user given"""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+
+TOKEN_CACHE = TokenCache()
+
+
+def get_token_cache() -> TokenCache:
+    """Get token cache of the bound client, or the shared one"""
+    client = CURRENT_CLIENT.get()
+    if client is not None:
+        return client.token_cache
+    return TOKEN_CACHE
+
+
+def _signin_token(username: str, password: str) -> str:
+    """Signin and extract token from profile"""
+
     profile = signin(username=username, password=password)
     auth_token = profile.get("token")
 
@@ -43,3 +261,18 @@ def get_auth_token(username: str, password: str) -> str:
         raise AuthenticationException("No token found on profile")
 
     return auth_token
+
+
+@traced()
+def get_auth_token(username: str, password: str, use_cache: bool = True) -> str:
+    """
+    Authenticate to Moffi API and return API authentication token
+
+    Token is served from cache while valid, unless use_cache is False
+
+    Raise AuthenticationException in case of error
+    """
+
+    if use_cache:
+        return get_token_cache().get_token(username=username, password=password)
+    return _signin_token(username=username, password=password)
@@ -3,35 +3,126 @@ Moffi auto reservation functions
 """
 
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
 
-from moffi_sdk.exceptions import OrderException
-from moffi_sdk.order import order_desk_from_details, order_parking
-from moffi_sdk.reservations import get_reservations_by_date
-from moffi_sdk.spaces import BUILDING_TIMEZONE, get_desk_for_date, get_workspace_details
+from moffi_sdk.exceptions import OrderException, RequestException
+from moffi_sdk.order import get_unavailabilities, order_desk_from_details, order_parking
+from moffi_sdk.reservations import ReservationItem, get_reservations_by_date
+from moffi_sdk.spaces import BUILDING_TIMEZONE, get_desk_for_date, get_desk_for_dates, get_workspace_details
+from moffi_sdk.tracing import traced
+from moffi_sdk.utils import parse_datetime
 
 MAX_DAYS = 30
+# upcoming reservations steps, cancelled reservations are also fetched
+RESERVATION_STEPS = ["validation", "invitation", "waiting", "inProgress"]
 
 
-def auto_reservation(  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+@dataclass
+class RunContext:
+    """
+    Snapshot shared by auto_reservation and auto_parking during a run
+
+    Reservations are fetched once and updated with orders placed during the run,
+    workspace details are fetched once per workspace
+    """
+
+    auth_token: str
+    city: str
+    reservations: Optional[Dict[date, List[ReservationItem]]] = None
+    workspaces: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # orders are added to reservations, never change those of caller
+        if self.reservations is not None:
+            self.reservations = {day: list(items) for day, items in self.reservations.items()}
+
+    def get_reservations(self) -> Dict[date, List[ReservationItem]]:
+        """Reservations by date, cancelled ones included, fetched on first call"""
+        if self.reservations is None:
+            self.reservations = dict(get_reservations_by_date(auth_token=self.auth_token, steps=RESERVATION_STEPS))
+        return self.reservations
+
+    def get_workspace_details(self, workspace: str) -> Dict[str, Any]:
+        """Details of a workspace of the city, fetched on first call"""
+        if workspace not in self.workspaces:
+            self.workspaces[workspace] = get_workspace_details(
+                city=self.city, workspace=workspace, auth_token=self.auth_token
+            )
+        return self.workspaces[workspace]
+
+    def record_order(
+        self,
+        paid_order: Dict[str, Any],
+        order_date: date,
+        workspace_details: Dict[str, Any],
+        desk_name: Optional[str] = None,
+    ) -> None:
+        """
+        Add an order placed during the run to reservations
+
+        Reservation is built from what was ordered, paid order may lack booking details like workspace building.
+        Its booking gives start and end when present, the whole order date otherwise
+        """
+        tzinfo = BUILDING_TIMEZONE.get("tz")
+        start = datetime.combine(date=order_date, time=datetime.min.time(), tzinfo=tzinfo)
+        end = datetime.combine(date=order_date, time=datetime.max.time(), tzinfo=tzinfo)
+        booking = next(iter(paid_order.get("bookings") or []), {})
+        try:
+            start, end = parse_datetime(booking["start"]), parse_datetime(booking["end"])
+        except (AttributeError, KeyError, OverflowError, TypeError, ValueError):
+            logging.debug(f"No booking dates in paid order {paid_order.get('id')}, using order date")
+
+        self.get_reservations().setdefault(order_date, []).append(
+            ReservationItem(
+                workspace_name=workspace_details.get("title"),
+                workspace_address=workspace_details.get("address"),
+                workspace_type=workspace_details.get("type"),
+                workspace_city=self.city,
+                desk_name=desk_name,
+                start=start,
+                end=end,
+                step=paid_order.get("step"),
+                status=paid_order.get("status"),
+            )
+        )
+
+
+@traced()
+def auto_reservation(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-statements
     desk: str,
     city: str,
     workspace: str,
     auth_token: str,
     parking: Optional[str] = None,
     work_days: Optional[List[int]] = None,
-):
-    """Auto reservation loop"""
+    scan: bool = False,
+    workspace_details: Optional[Dict[str, Any]] = None,
+    reservations: Optional[Dict[date, List[ReservationItem]]] = None,
+    context: Optional[RunContext] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Auto reservation loop
+
+    :param scan: fetch availabilities and unavailabilities of all bookable dates upfront,
+                 instead of one date after another
+    :param workspace_details: already known workspace details, see moffi_sdk.spaces.get_workspace_details
+    :param reservations: already known reservations, see moffi_sdk.reservations.get_reservations_by_date
+    :param context: run snapshot, shared with auto_parking, a new one by default
+    :return: paid orders
+    """
 
     if work_days is None:
         work_days = range(1, 7)
 
-    workspace_details = get_workspace_details(city=city, workspace=workspace, auth_token=auth_token)
-
-    reservations = get_reservations_by_date(
-        auth_token=auth_token, steps=["validation", "invitation", "waiting", "inProgress"]
-    )
+    if context is None:
+        context = RunContext(auth_token=auth_token, city=city, reservations=reservations)
+    if workspace_details is not None:
+        context.workspaces.setdefault(workspace, workspace_details)
+    workspace_details = context.get_workspace_details(workspace)
+    reservations = context.get_reservations()
+    paid_orders = []
 
     workspace_reservation_range_min = datetime.now(BUILDING_TIMEZONE.get("tz")) + timedelta(
         minutes=workspace_details.get("plageMini", {}).get("minutes", 0)
@@ -53,6 +144,7 @@ def auto_reservation(  # pylint: disable=too-many-locals,too-many-branches,too-m
     if workspace_closed_days:
         logging.debug(f"Workspace closed days are {', '.join(workspace_closed_days)}")
 
+    candidate_dates = []
     for delay in range(1, MAX_DAYS):
         future_date = datetime.now(BUILDING_TIMEZONE.get("tz")) + timedelta(days=delay)
         if len(reservations.get(future_date.date(), [])) > 0:
@@ -78,45 +170,87 @@ def auto_reservation(  # pylint: disable=too-many-locals,too-many-branches,too-m
                 continue
 
             logging.info(f"No reservation for date {future_date.date().isoformat()}")
+            candidate_dates.append(future_date.date())
+
+    desks_by_date = {}
+    unavailabilities = None
+    if scan and candidate_dates:
+        # fetch the whole bookable window at once
+        desks_by_date = get_desk_for_dates(
+            desk_name=desk,
+            building_id=workspace_details.get("building", {}).get("id"),
+            workspace_id=workspace_details.get("id"),
+            target_dates=candidate_dates,
+            auth_token=auth_token,
+            floor=workspace_details.get("floor", {}).get("level"),
+        )
+        try:
+            unavailabilities = get_unavailabilities(
+                company_id=workspace_details.get("company", {}).get("id"),
+                start_date=candidate_dates[0],
+                end_date=candidate_dates[-1],
+                auth_token=auth_token,
+            )
+        except RequestException as ex:
+            logging.warning(f"Unable to get unavailabilities : {repr(ex)}")
+
+    for order_date in candidate_dates:
+        desk_details = desks_by_date.get(order_date)
+        if desk_details is None:
             desk_details = get_desk_for_date(
                 desk_name=desk,
                 building_id=workspace_details.get("building", {}).get("id"),
                 workspace_id=workspace_details.get("id"),
-                target_date=future_date.date(),
+                target_date=order_date,
                 auth_token=auth_token,
                 floor=workspace_details.get("floor", {}).get("level"),
             )
 
-            if desk_details.get("status") != "AVAILABLE":
-                logging.warning(f"Desk {desk} is not available for reservation")
-                continue
+        if desk_details.get("status") != "AVAILABLE":
+            logging.warning(f"Desk {desk} is not available for reservation on {order_date.isoformat()}")
+            continue
 
-            logging.info(f"Order desk {desk} for date {future_date.date().isoformat()}")
-            try:
-                order_desk_from_details(
-                    order_date=future_date.date(),
-                    workspace_details=workspace_details,
-                    desk_details=desk_details,
-                    auth_token=auth_token,
-                )
-                logging.info("Order successful")
-            except OrderException as ex:
-                logging.warning(f"Unable to order desk : {repr(ex)}")
-                continue
+        logging.info(f"Order desk {desk} for date {order_date.isoformat()}")
+        try:
+            paid_order = order_desk_from_details(
+                order_date=order_date,
+                workspace_details=workspace_details,
+                desk_details=desk_details,
+                auth_token=auth_token,
+                unavailabilities=unavailabilities,
+            )
+            logging.info("Order successful")
+        except OrderException as ex:
+            logging.warning(f"Unable to order desk : {repr(ex)}")
+            continue
+        paid_orders.append(paid_order)
+        context.record_order(paid_order, order_date=order_date, workspace_details=workspace_details, desk_name=desk)
 
     if parking:
-        auto_parking(city=city, parking=parking, auth_token=auth_token)
+        paid_orders += auto_parking(city=city, parking=parking, auth_token=auth_token, context=context)
 
+    return paid_orders
 
-def auto_parking(city: str, parking: str, auth_token: str):
-    """Order a parking for all reservations in the same city"""
 
+@traced()
+def auto_parking(  # pylint: disable=too-many-locals,too-many-branches
+    city: str, parking: str, auth_token: str, context: Optional[RunContext] = None
+) -> List[Dict[str, Any]]:
+    """
+    Order a parking for all reservations in the same city
+
+    :param context: run snapshot, shared with auto_reservation, a new one by default.
+                    With a warm context, only order requests are sent
+    :return: paid orders
+    """
+    paid_orders = []
+
+    if context is None:
+        context = RunContext(auth_token=auth_token, city=city)
     # get upcoming reservations
-    reservations_by_date = get_reservations_by_date(
-        auth_token=auth_token, steps=["validation", "invitation", "waiting", "inProgress"], view_cancelled=False
-    )
+    reservations_by_date = context.get_reservations()
 
-    parking_details = get_workspace_details(city=city, workspace=parking, auth_token=auth_token)
+    parking_details = context.get_workspace_details(parking)
     parking_reservation_range_min = datetime.now(BUILDING_TIMEZONE.get("tz")) + timedelta(
         minutes=parking_details.get("plageMini", {}).get("minutes", 0)
     )
@@ -130,11 +264,14 @@ def auto_parking(city: str, parking: str, auth_token: str):
 
     hour_now = datetime.now(BUILDING_TIMEZONE.get("tz")).time()
     # for all reservation in same city, check if parking for the same date
-    for day, reservations in reservations_by_date.items():
+    parking_dates = []
+    for day, reservations in sorted(reservations_by_date.items()):
         future_date = datetime.combine(date=day, time=hour_now, tzinfo=BUILDING_TIMEZONE.get("tz"))
         parking_needed = False
         parking_ordered = False
         for reservation in reservations:
+            if reservation.status == "CANCELLED":
+                continue
             if reservation.workspace_type == "parking":
                 parking_ordered = True
             elif reservation.workspace_type != "parking" and reservation.workspace_city == city:
@@ -148,16 +285,37 @@ def auto_parking(city: str, parking: str, auth_token: str):
             if future_date > parking_reservation_range_max:
                 logging.info(f"Date {day.isoformat()} is out of parking range. Ending loop")
                 break
-
-            try:
-                order_parking(
-                    order_date=day.isoformat(),
-                    city=city,
-                    parking=parking,
-                    auth_token=auth_token,
-                )
-            except OrderException as ex:
-                logging.warning(f"Unable to order parking : {repr(ex)}")
-                continue
+            parking_dates.append(day)
         else:
             logging.info(f"No need to order a parking for {day.isoformat()}")
+
+    unavailabilities = None
+    if len(parking_dates) > 1:
+        # one request for all dates, instead of one per order
+        try:
+            unavailabilities = get_unavailabilities(
+                company_id=parking_details.get("company", {}).get("id"),
+                start_date=parking_dates[0],
+                end_date=parking_dates[-1],
+                auth_token=auth_token,
+            )
+        except RequestException as ex:
+            logging.warning(f"Unable to get unavailabilities : {repr(ex)}")
+
+    for day in parking_dates:
+        try:
+            paid_order = order_parking(
+                order_date=day.isoformat(),
+                city=city,
+                parking=parking,
+                auth_token=auth_token,
+                workspace_details=parking_details,
+                unavailabilities=unavailabilities,
+            )
+        except OrderException as ex:
+            logging.warning(f"Unable to order parking : {repr(ex)}")
+            continue
+        paid_orders.append(paid_order)
+        context.record_order(paid_order, order_date=day, workspace_details=parking_details)
+
+    return paid_orders
@@ -0,0 +1,244 @@
+"""
+Moffi booking window
+
+Book a desk at the exact instant its date enters the workspace booking range
+"""
+
+import logging
+import statistics
+import threading
+import time
+from datetime import date, datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from moffi_sdk.auth import get_token_cache
+from moffi_sdk.exceptions import MoffiSdkException, OrderException, RequestException, UnavailableException
+from moffi_sdk.order import prepare_order, submit_order
+from moffi_sdk.reservations import get_reservations_by_date
+from moffi_sdk.spaces import BUILDING_TIMEZONE, get_desk_for_date, get_workspace_details
+from moffi_sdk.utils import get_api_url, query_headers
+
+# seconds before opening to prepare the order, refresh token and warm connections
+PREPARE_LEAD = 30
+# clock offset with server is estimated by polling its Date header every CLOCK_POLL_INTERVAL,
+# CLOCK_MAX_POLLS cover a bit more than one second, so Date changes at least once
+CLOCK_POLL_INTERVAL = 0.1
+CLOCK_MAX_POLLS = 12
+# retries when the date is not yet opened on server side, or on transient errors, within FIRE_WINDOW seconds
+FIRE_ATTEMPTS = 5
+FIRE_RETRY_DELAY = 0.2
+FIRE_WINDOW = 5.0
+
+
+def localize(day: date, tzinfo: Any) -> datetime:
+    """Midnight of a day in a timezone"""
+    naive = datetime.combine(day, datetime.min.time())
+    if hasattr(tzinfo, "localize"):
+        # pytz timezones need localize to get the right offset
+        return tzinfo.localize(naive)
+    return naive.replace(tzinfo=tzinfo)
+
+
+def next_opening(
+    workspace_details: Dict[str, Any],
+    now: datetime = None,
+    closed_days: List[str] = None,
+    work_days: List[int] = None,
+) -> Tuple[date, datetime]:
+    """
+    Compute next date entering the workspace booking range, and when
+
+    A date is bookable once now + plageMaxi reaches it, see auto_reservation
+
+    :param workspace_details: see moffi_sdk.spaces.get_workspace_details
+    :param now: current time, aware
+    :param closed_days: lower case day names to skip
+    :param work_days: iso week days (Monday is 1) to keep
+    :return: date and opening instant, in building timezone
+    """
+    tzinfo = BUILDING_TIMEZONE.get("tz")
+    if now is None:
+        now = datetime.now(tzinfo)
+    range_max = timedelta(minutes=workspace_details.get("plageMaxi", {}).get("minutes", 0))
+
+    next_date = (now + range_max).date() + timedelta(days=1)
+    for _ in range(7):
+        closed = closed_days is not None and next_date.strftime("%A").lower() in closed_days
+        not_working = work_days is not None and next_date.isoweekday() not in work_days
+        if not closed and not not_working:
+            break
+        next_date += timedelta(days=1)
+
+    return next_date, localize(next_date, tzinfo) - range_max
+
+
+def _server_date_sample(auth_token: str) -> Optional[Tuple[float, float]]:
+    """Return server date and local time at which it was read, None on error"""
+    try:
+        sent = time.time()
+        headers = query_headers(method="HEAD", url=get_api_url(), auth_token=auth_token)
+        received = time.time()
+        return parsedate_to_datetime(headers["Date"]).timestamp(), (sent + received) / 2
+    except (MoffiSdkException, KeyError, TypeError, ValueError) as ex:
+        logging.debug(f"Unable to read server date : {repr(ex)}")
+        return None
+
+
+def _wait(seconds: float, stop: Optional[threading.Event] = None) -> bool:
+    """Sleep, or wait for stop event if given, return True if stopped"""
+    if stop is None:
+        time.sleep(seconds)
+        return False
+    return stop.wait(seconds)
+
+
+def estimate_clock_offset(
+    auth_token: str, max_polls: int = CLOCK_MAX_POLLS, stop: Optional[threading.Event] = None
+) -> float:
+    """
+    Estimate offset between server clock and local clock, from Date headers
+
+    Date header is truncated to the second, so server is polled until its date changes :
+    the second boundary happened between the two last samples.
+    Also warm up connections to the API
+
+    :param auth_token: API token, requests go through the account rate limit
+    :param max_polls: max requests sent
+    :param stop: stop polling once this event is set
+    :return: seconds to add to local clock to get server clock
+    """
+    previous_date = previous_time = None
+    offsets = []
+    for _ in range(max_polls):
+        sample = _server_date_sample(auth_token)
+        if sample is None:
+            continue
+        server_date, local_time = sample
+        # without a boundary, Date is half a second behind server clock on average
+        offsets.append(server_date + 0.5 - local_time)
+        if previous_date is not None and server_date > previous_date:
+            return server_date - (previous_time + local_time) / 2
+        previous_date, previous_time = sample
+        if _wait(CLOCK_POLL_INTERVAL, stop):
+            break
+
+    if not offsets:
+        logging.warning("Unable to estimate clock offset with server, using local clock")
+        return 0.0
+    return statistics.median(offsets)
+
+
+def sleep_until(instant: float, stop: Optional[threading.Event] = None) -> bool:
+    """
+    Sleep until a local timestamp, precisely
+
+    :param stop: wake up early once this event is set
+    :return: True if stopped before instant
+    """
+    while True:
+        remaining = instant - time.time()
+        if remaining <= 0:
+            return False
+        # coarse sleep, then short ones to wake up on time
+        if _wait(remaining - 0.05 if remaining > 0.1 else min(remaining, 0.001), stop):
+            return True
+
+
+def book_at_opening(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-return-statements
+    desk: str,
+    city: str,
+    workspace: str,
+    auth_token: str,
+    username: str = None,
+    work_days: Optional[List[int]] = None,
+    max_wait: float = None,
+    advance: float = 0.0,
+    stop: Optional[threading.Event] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Wait for next date to enter the booking range, and order desk at this exact instant
+
+    :param auth_token: API token
+    :param username: if token was obtained with get_auth_token, renew it before opening when needed
+    :param work_days: iso week days (Monday is 1) to book
+    :param max_wait: do not wait if opening is further than this number of seconds
+    :param advance: seconds to fire before opening, to compensate network latency
+    :param stop: give up waiting once this event is set
+    :return: paid order, None if nothing to book or stopped
+    :raise: OrderException if error during order
+    """
+    workspace_details = get_workspace_details(city=city, workspace=workspace, auth_token=auth_token)
+    closed_days = [
+        day.lower()
+        for day, details in workspace_details.get("schedule", {}).items()
+        if isinstance(details, dict) and details.get("isOpen") is False
+    ]
+    order_date, opening = next_opening(workspace_details, closed_days=closed_days, work_days=work_days)
+    wait = opening.timestamp() - time.time()
+    logging.info(f"Date {order_date.isoformat()} opens for reservation at {opening.isoformat()}, in {wait:.0f}s")
+    if max_wait is not None and wait > max_wait:
+        logging.info(f"Opening is more than {max_wait}s away, nothing to do")
+        return None
+
+    reservations = get_reservations_by_date(
+        auth_token=auth_token, steps=["validation", "invitation", "waiting", "inProgress"], end_date=order_date
+    )
+    if reservations.get(order_date):
+        logging.info(f"User already have a reservation for date {order_date.isoformat()}")
+        return None
+
+    if sleep_until(opening.timestamp() - PREPARE_LEAD, stop):
+        logging.info("Stopped before opening")
+        return None
+
+    # prepare everything that does not depend on opening
+    if username is not None:
+        auth_token = get_token_cache().token_for(username) or auth_token
+    desk_details = get_desk_for_date(
+        desk_name=desk,
+        building_id=workspace_details.get("building", {}).get("id"),
+        workspace_id=workspace_details.get("id"),
+        target_date=order_date,
+        auth_token=auth_token,
+        floor=workspace_details.get("floor", {}).get("level"),
+    )
+    if desk_details.get("status") != "AVAILABLE":
+        raise UnavailableException(f"Desk {desk} is not available for reservation on {order_date.isoformat()}")
+    prepared = prepare_order(
+        order_date=order_date, workspace_details=workspace_details, desk_details=desk_details, auth_token=auth_token
+    )
+    offset = estimate_clock_offset(auth_token, stop=stop)
+    logging.info(f"Clock offset with server is {offset * 1000:.0f}ms, order prepared")
+
+    fire_at = opening.timestamp() - offset - advance
+    if sleep_until(fire_at, stop):
+        logging.info("Stopped before opening")
+        return None
+    for attempt in range(1, FIRE_ATTEMPTS + 1):
+        timings = {}
+        fired = time.time()
+        try:
+            paid_order = submit_order(prepared=prepared, auth_token=auth_token, timings=timings)
+        except (UnavailableException, RequestException) as ex:
+            # server may not have opened the date yet, or failed under load : retry while no order was sent
+            logging.info(f"Attempt {attempt} fired {(fired - fire_at) * 1000:.0f}ms after target : {repr(ex)}")
+            if attempt == FIRE_ATTEMPTS or "order" in timings or time.time() - fire_at > FIRE_WINDOW:
+                if isinstance(ex, RequestException):
+                    raise OrderException from ex
+                raise
+            if _wait(FIRE_RETRY_DELAY, stop):
+                logging.info("Stopped before any order was created")
+                return None
+            continue
+        except MoffiSdkException as ex:
+            raise OrderException from ex
+        finally:
+            steps = ", ".join(f"{step} {duration * 1000:.0f}ms" for step, duration in timings.items())
+            logging.info(f"Attempt {attempt} latencies : {steps}")
+
+        logging.info(
+            f"Order successful for {order_date.isoformat()}, {(time.time() - fire_at) * 1000:.0f}ms after target"
+        )
+        return paid_order
+    return None
@@ -0,0 +1,108 @@
+"""
+MOFFI metadata cache
+
+Persistent on-disk cache for data that rarely changes : buildings, floors, timezones, workspaces
+"""
+
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from moffi_sdk.context import CURRENT_CLIENT
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "moffi"
+)
+
+# seconds before each kind of metadata is fetched again
+DEFAULT_TTLS = {
+    "building": 7 * 86400,
+    "workspace_url": 7 * 86400,
+    "workspace": 86400,
+}
+
+
+class MetadataCache:
+    """
+    Thread safe metadata cache, stored as a JSON file
+
+    Values are grouped by kind, each kind has its own time to live
+    """
+
+    def __init__(self, path: str = None, ttls: Dict[str, int] = None, enabled: bool = True):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "metadata.json")
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.enabled = enabled
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.RLock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as cache_file:
+                    self._entries = json.load(cache_file)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as ex:
+                logging.warning(f"Unable to read metadata cache {self.path}, ignoring it : {repr(ex)}")
+        return self._entries
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            file_desc, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".metadata")
+            with os.fdopen(file_desc, "w", encoding="utf-8") as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError as ex:
+            logging.warning(f"Unable to write metadata cache {self.path} : {repr(ex)}")
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        """Return a cached value, None if missing or expired"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load().get(kind, {}).get(key)
+            if entry is None or time.time() - entry.get("stored_at", 0) > self.ttls.get(kind, 0):
+                return None
+            logging.debug(f"Metadata cache hit for {kind} {key}")
+            return copy.deepcopy(entry.get("value"))
+
+    def set(self, kind: str, key: str, value: Any) -> None:
+        """Store a value"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._load().setdefault(kind, {})[key] = {"stored_at": time.time(), "value": copy.deepcopy(value)}
+            self._save()
+
+    def invalidate(self, kind: str = None, key: str = None) -> None:
+        """Remove a value, all values of a kind, or everything if no kind given"""
+        with self._lock:
+            entries = self._load()
+            if kind is None:
+                entries.clear()
+            elif key is None:
+                entries.pop(kind, None)
+            else:
+                entries.get(kind, {}).pop(key, None)
+            self._save()
+
+
+METADATA_CACHE = MetadataCache()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Get metadata cache of the bound client, or the shared one"""
+    client = CURRENT_CLIENT.get()
+    if client is not None:
+        return client.metadata_cache
+    return METADATA_CACHE
@@ -0,0 +1,194 @@
+"""
+MOFFI client
+
+Thread safe SDK entry point, owning HTTP session, credentials, tokens, caches, rate limiter and timezone
+"""
+
+import threading
+from contextlib import contextmanager
+from datetime import date, timezone
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+from moffi_sdk.auth import TokenCache
+from moffi_sdk.auto_reservation import auto_reservation
+from moffi_sdk.cache import METADATA_CACHE, MetadataCache
+from moffi_sdk.context import CURRENT_CLIENT
+from moffi_sdk.order import order_desk, order_parking
+from moffi_sdk.ratelimit import RateLimiter
+from moffi_sdk.request_cache import RequestCache
+from moffi_sdk.reservations import (
+    ReservationItem,
+    get_cancelled_reservations,
+    get_reservations,
+    get_reservations_by_date,
+)
+from moffi_sdk.spaces import (
+    building_timezone_context,
+    get_building,
+    get_desk_for_date,
+    get_workspace_details,
+)
+from moffi_sdk.utils import SESSION_SETTINGS, _build_session
+
+if TYPE_CHECKING:  # pragma: no cover
+    import requests
+
+
+class MoffiClient:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    Moffi API client
+
+    Each client has its own HTTP session, token cache, request cache, rate limiter, building timezone and request
+    counters, so clients for different users or buildings can be used concurrently in the same process.
+    A client can itself be shared between threads.
+
+    SDK functions are run bound to the client : module functions called inside `with client.bind()`
+    use its session, tokens and caches instead of the process wide ones
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        username: str = None,
+        password: str = None,
+        auth_token: str = None,
+        metadata_cache: MetadataCache = None,
+        session_settings: Dict[str, Any] = None,
+        on_request: Callable[[str, str, Optional[int], float], None] = None,
+        rate_limit_settings: Dict[str, Any] = None,
+    ):
+        """
+        :param username: Moffi username, to get and renew tokens
+        :param password: Moffi password
+        :param auth_token: already known token, used as is if no credentials are given
+        :param metadata_cache: buildings and workspaces cache, process wide one by default since it is read only
+        :param session_settings: HTTP settings overriding moffi_sdk.utils.SESSION_SETTINGS
+        :param on_request: called after each API request with method, url, status (None on error) and duration
+        :param rate_limit_settings: rate limits overriding moffi_sdk.ratelimit.RATE_LIMIT_SETTINGS
+        """
+        if auth_token is None and (username is None or password is None):
+            raise ValueError("Either credentials or a token are needed")
+        self.username = username
+        self._password = password
+        self._auth_token = auth_token
+        self.metadata_cache = metadata_cache or METADATA_CACHE
+        self.session_settings = dict(SESSION_SETTINGS)
+        if session_settings:
+            self.session_settings.update(session_settings)
+        self.on_request = on_request
+        self.token_cache = TokenCache()
+        self.request_cache = RequestCache()
+        self.rate_limiter = RateLimiter(rate_limit_settings)
+        self.timezone = timezone.utc
+
+        self._session = None
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "duration": 0.0}
+
+    @property
+    def session(self) -> "requests.Session":
+        """HTTP session of the client, created on first use"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = _build_session(self.session_settings)
+        return self._session
+
+    def record_request(self, method: str, url: str, status: Optional[int], duration: float) -> None:
+        """Count a request made by the client, see moffi_sdk.utils.query"""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["duration"] += duration
+            if status is None or status > 399:
+                self.stats["errors"] += 1
+        if self.on_request is not None:
+            self.on_request(method, url, status, duration)
+
+    @contextmanager
+    def bind(self) -> Iterator["MoffiClient"]:
+        """
+        Bind client to current context
+
+        Each binding has its own building timezone, starting from client timezone : SDK functions set it
+        from the building they fetch, so concurrent bindings never see each other's building
+        """
+        client_token = CURRENT_CLIENT.set(self)
+        try:
+            with building_timezone_context(self.timezone):
+                yield self
+        finally:
+            CURRENT_CLIENT.reset(client_token)
+
+    def get_token(self) -> str:
+        """
+        Return a valid token, signin only if needed
+
+        Raise AuthenticationException in case of error
+        """
+        if self.username is None or self._password is None:
+            return self._auth_token
+        return self.token_cache.get_token(username=self.username, password=self._password)
+
+    def _call(self, func: Callable, **kwargs) -> Any:
+        """Call an SDK function bound to client, with a valid token"""
+        with self.bind():
+            return func(auth_token=self.get_token(), **kwargs)
+
+    def get_building(self, city: str) -> Dict[str, Any]:
+        """See moffi_sdk.spaces.get_building"""
+        return self._call(get_building, name=city)
+
+    def get_workspace_details(self, city: str, workspace: str) -> Dict[str, Any]:
+        """See moffi_sdk.spaces.get_workspace_details"""
+        return self._call(get_workspace_details, city=city, workspace=workspace)
+
+    def get_desk_for_date(  # pylint: disable=too-many-arguments
+        self, desk_name: str, building_id: str, workspace_id: str, floor: int, target_date: date
+    ) -> Dict[str, Any]:
+        """See moffi_sdk.spaces.get_desk_for_date"""
+        return self._call(
+            get_desk_for_date,
+            desk_name=desk_name,
+            building_id=building_id,
+            workspace_id=workspace_id,
+            floor=floor,
+            target_date=target_date,
+        )
+
+    def get_reservations(self, steps: List[str] = None, **kwargs) -> List[ReservationItem]:
+        """See moffi_sdk.reservations.get_reservations"""
+        return self._call(get_reservations, steps=steps, **kwargs)
+
+    def get_cancelled_reservations(self, include_past: bool = False, **kwargs) -> List[ReservationItem]:
+        """See moffi_sdk.reservations.get_cancelled_reservations"""
+        return self._call(get_cancelled_reservations, include_past=include_past, **kwargs)
+
+    def get_reservations_by_date(
+        self, steps: List[str] = None, view_cancelled: bool = True, end_date: date = None
+    ) -> Dict[str, List[ReservationItem]]:
+        """See moffi_sdk.reservations.get_reservations_by_date"""
+        return self._call(get_reservations_by_date, steps=steps, view_cancelled=view_cancelled, end_date=end_date)
+
+    def order_desk(self, city: str, workspace: str, desk: str, order_date: str) -> Dict[str, Any]:
+        """See moffi_sdk.order.order_desk"""
+        return self._call(order_desk, city=city, workspace=workspace, desk=desk, order_date=order_date)
+
+    def order_parking(self, city: str, parking: str, order_date: str) -> Dict[str, Any]:
+        """See moffi_sdk.order.order_parking"""
+        return self._call(order_parking, city=city, parking=parking, order_date=order_date)
+
+    def auto_reservation(self, desk: str, city: str, workspace: str, **kwargs) -> List[Dict[str, Any]]:
+        """See moffi_sdk.auto_reservation.auto_reservation"""
+        return self._call(auto_reservation, desk=desk, city=city, workspace=workspace, **kwargs)
+
+    def close(self) -> None:
+        """Close HTTP session"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def __enter__(self) -> "MoffiClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
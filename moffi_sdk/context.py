@@ -0,0 +1,10 @@
+"""
+MOFFI client context
+
+Client bound to the current context, shared state getters use its state instead of the process wide one
+"""
+
+import contextvars
+
+# client bound to current context, see moffi_sdk.client.MoffiClient
+CURRENT_CLIENT = contextvars.ContextVar("moffi_client", default=None)
@@ -0,0 +1,110 @@
+"""
+MOFFI ICS writer
+
+Lightweight streaming iCalendar (RFC 5545) serializer for reservations
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from moffi_sdk.reservations import ReservationItem
+
+PRODID = "-//moffi//moffics//EN"
+CRLF = "\r\n"
+# max line length in octets, without CRLF
+LINE_LENGTH = 75
+
+
+def escape_text(value: str) -> str:
+    """Escape a TEXT property value"""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+        .replace("\r", "\\n")
+    )
+
+
+def fold_line(line: str) -> str:
+    """
+    Fold a content line to 75 octets, continuation lines start with a space
+
+    UTF-8 characters are never split between lines
+    :return: folded line, with trailing CRLF
+    """
+    if len(line.encode("utf-8")) <= LINE_LENGTH:
+        return line + CRLF
+
+    parts = []
+    current = []
+    size = 0
+    limit = LINE_LENGTH
+    for char in line:
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > limit:
+            parts.append("".join(current))
+            current = []
+            size = 0
+            # leading space counts in continuation lines
+            limit = LINE_LENGTH - 1
+        current.append(char)
+        size += char_size
+    parts.append("".join(current))
+    return (CRLF + " ").join(parts) + CRLF
+
+
+def format_datetime(value: datetime) -> str:
+    """Format an aware datetime as UTC DATE-TIME, naive ones are considered UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def reservation_uid(item: ReservationItem) -> str:
+    """
+    Stable event UID for a reservation, so calendar clients and ETags do not see changes between renders
+    """
+    key = "|".join([item.workspace_city or "", item.workspace_name or "", item.desk_name or "", item.start.isoformat()])
+    return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}@moffi.io"
+
+
+def serialize_event(item: ReservationItem) -> str:
+    """
+    Render a reservation as a VEVENT
+
+    DTSTAMP is mandatory, it is taken from reservation start so renders of the same reservation are identical
+    """
+    name = f"{item.workspace_name} - {item.desk_name}" if item.desk_name else item.workspace_name
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{reservation_uid(item)}",
+        f"DTSTAMP:{format_datetime(item.start)}",
+        f"DTSTART:{format_datetime(item.start)}",
+        f"DTEND:{format_datetime(item.end)}",
+    ]
+    if name:
+        lines.append(f"SUMMARY:{escape_text(name)}")
+    if item.workspace_address:
+        lines.append(f"LOCATION:{escape_text(item.workspace_address)}")
+    lines.append("END:VEVENT")
+    return "".join(fold_line(line) for line in lines)
+
+
+def iter_calendar(items: Iterable[ReservationItem]) -> Iterator[str]:
+    """
+    Render reservations as an ICS calendar, chunk by chunk
+
+    Items are consumed lazily, events are emitted in items order
+    """
+    yield f"BEGIN:VCALENDAR{CRLF}VERSION:2.0{CRLF}{fold_line(f'PRODID:{PRODID}')}"
+    for item in items:
+        yield serialize_event(item)
+    yield f"END:VCALENDAR{CRLF}"
+
+
+def serialize_calendar(items: Iterable[ReservationItem]) -> str:
+    """Render reservations as an ICS calendar"""
+    return "".join(iter_calendar(items))
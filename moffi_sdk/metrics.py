@@ -0,0 +1,242 @@
+"""
+MOFFI API metrics
+
+Requests made by query are counted per endpoint template (ids replaced by placeholders), with latency histograms,
+status codes, retries and response sizes. Each request is sent to sinks, the default one aggregates in METRICS
+and can be rendered in Prometheus text format
+"""
+
+import logging
+import re
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# path segments replaced by a placeholder in endpoint templates
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$")
+# endpoints with a free form tail
+_TAIL_ENDPOINTS = {"/workspaces/url/": "/workspaces/url/{url}"}
+
+
+@dataclass
+class RequestRecord:
+    """A request made to Moffi API"""
+
+    method: str
+    endpoint: str
+    status: Optional[int]
+    duration: float
+    response_size: int = 0
+    retries: int = 0
+
+
+def endpoint_template(url: str, api_root: str = "") -> str:
+    """
+    Get endpoint template of an API URL, without API root, query string nor ids
+
+    /orders/1234/pay?x=1 gives /orders/{id}/pay
+    """
+    if api_root and url.startswith(api_root):
+        url = url[len(api_root) :]
+    path = urlsplit(url).path
+    if not path.startswith("/"):
+        path = f"/{path}"
+    for prefix, template in _TAIL_ENDPOINTS.items():
+        if path.startswith(prefix):
+            return template
+    return "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+class Histogram:
+    """Cumulative histogram, Prometheus like"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add a value, not thread safe"""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Cumulative count of each bucket upper bound, +Inf last"""
+        result = []
+        running = 0
+        for bound, count in zip([*[f"{bucket:g}" for bucket in self.buckets], "+Inf"], self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of its bucket, None if empty"""
+        if not self.count:
+            return None
+        rank = quantile * self.count
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+def _escape_label(value: str) -> str:
+    """Escape a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """Prometheus labels, escaped"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_histogram(name: str, labels: Dict[str, str], histogram: Histogram) -> List[str]:
+    """Prometheus lines of an histogram"""
+    lines = [f"{name}_bucket{format_labels(dict(labels, le=bound))} {count}" for bound, count in histogram.cumulative()]
+    lines.append(f"{name}_sum{format_labels(labels)} {histogram.total:.6f}")
+    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return lines
+
+
+class MetricsRegistry:
+    """
+    Thread safe aggregation of API requests, by method and endpoint template
+
+    Use it as a sink, see add_sink
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, subject: str = "Moffi API"):
+        """
+        :param buckets: latency buckets in seconds
+        :param subject: what requests are sent to, in metrics help
+        """
+        self.buckets = buckets
+        self.subject = subject
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, str], int] = {}
+        self._durations: Dict[Tuple[str, str], Histogram] = {}
+        self._retries: Dict[Tuple[str, str], int] = {}
+        self._response_bytes: Dict[Tuple[str, str], int] = {}
+
+    def __call__(self, record: RequestRecord) -> None:
+        self.record(record)
+
+    def record(self, record: RequestRecord) -> None:
+        """Count a request"""
+        key = (record.method, record.endpoint)
+        status = str(record.status) if record.status is not None else "error"
+        with self._lock:
+            self._requests[(*key, status)] = self._requests.get((*key, status), 0) + 1
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = Histogram(self.buckets)
+            histogram.observe(record.duration)
+            self._retries[key] = self._retries.get(key, 0) + record.retries
+            self._response_bytes[key] = self._response_bytes.get(key, 0) + record.response_size
+
+    def reset(self) -> None:
+        """Forget all requests"""
+        with self._lock:
+            self._requests.clear()
+            self._durations.clear()
+            self._retries.clear()
+            self._response_bytes.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        """
+        Current metrics by endpoint
+
+        :return: dict keyed by "METHOD endpoint", with count, errors, statuses, duration, p50, p95,
+                 retries and response_bytes
+        """
+        with self._lock:
+            result = {}
+            for (method, endpoint), histogram in sorted(self._durations.items()):
+                statuses = {
+                    status: count
+                    for (req_method, req_endpoint, status), count in self._requests.items()
+                    if (req_method, req_endpoint) == (method, endpoint)
+                }
+                result[f"{method} {endpoint}"] = {
+                    "count": histogram.count,
+                    "errors": sum(
+                        count for status, count in statuses.items() if status == "error" or int(status) > 399
+                    ),
+                    "statuses": statuses,
+                    "duration": histogram.total,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "retries": self._retries.get((method, endpoint), 0),
+                    "response_bytes": self._response_bytes.get((method, endpoint), 0),
+                }
+            return result
+
+    def render_prometheus(self, prefix: str = "moffi_api") -> str:
+        """Render metrics in Prometheus text exposition format"""
+        lines = [
+            f"# HELP {prefix}_requests_total Requests to {self.subject}",
+            f"# TYPE {prefix}_requests_total counter",
+        ]
+        with self._lock:
+            for (method, endpoint, status), count in sorted(self._requests.items()):
+                labels = {"method": method, "endpoint": endpoint, "status": status}
+                lines.append(f"{prefix}_requests_total{format_labels(labels)} {count}")
+
+            lines.append(f"# HELP {prefix}_request_duration_seconds Duration of requests to {self.subject}")
+            lines.append(f"# TYPE {prefix}_request_duration_seconds histogram")
+            for (method, endpoint), histogram in sorted(self._durations.items()):
+                lines.extend(
+                    format_histogram(
+                        f"{prefix}_request_duration_seconds", {"method": method, "endpoint": endpoint}, histogram
+                    )
+                )
+
+            lines.append(f"# HELP {prefix}_retries_total Retries of requests to {self.subject}")
+            lines.append(f"# TYPE {prefix}_retries_total counter")
+            for (method, endpoint), count in sorted(self._retries.items()):
+                lines.append(f"{prefix}_retries_total{format_labels({'method': method, 'endpoint': endpoint})} {count}")
+
+            lines.append(f"# HELP {prefix}_response_bytes_total Size of responses of {self.subject}")
+            lines.append(f"# TYPE {prefix}_response_bytes_total counter")
+            for (method, endpoint), size in sorted(self._response_bytes.items()):
+                labels = format_labels({"method": method, "endpoint": endpoint})
+                lines.append(f"{prefix}_response_bytes_total{labels} {size}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+# callables receiving every RequestRecord
+SINKS: List[Callable[[RequestRecord], None]] = [METRICS]
+
+
+def add_sink(sink: Callable[[RequestRecord], None]) -> None:
+    """Send next request records to a sink, like a statsd or OpenTelemetry exporter"""
+    if sink not in SINKS:
+        SINKS.append(sink)
+
+
+def remove_sink(sink: Callable[[RequestRecord], None]) -> None:
+    """Stop sending request records to a sink"""
+    if sink in SINKS:
+        SINKS.remove(sink)
+
+
+def record_request(record: RequestRecord) -> None:
+    """Send a request record to all sinks, a failing sink never fails the request"""
+    for sink in list(SINKS):
+        try:
+            sink(record)
+        except Exception as ex:  # pylint: disable=broad-except
+            logging.warning(f"Metrics sink {sink!r} failed : {repr(ex)}")
@@ -1,37 +1,71 @@
 """
 Moffi orders
 """
+
 import logging
+from dataclasses import dataclass
 from datetime import date, datetime, time, timezone
+from time import perf_counter
 from typing import Any, Dict
 
-from rfc3339 import rfc3339
-
 from moffi_sdk.exceptions import OrderException, RequestException, UnavailableException
 from moffi_sdk.spaces import BUILDING_TIMEZONE, get_desk_for_date, get_workspace_details
-from moffi_sdk.utils import query
+from moffi_sdk.tracing import span, traced
+from moffi_sdk.utils import format_rfc3339, query
 
 
-def order_desk_from_details(  # pylint: disable=too-many-locals
-    order_date: date, workspace_details: Dict[str, Any], desk_details: Dict[str, Any], auth_token: str
-) -> Dict[str, Any]:
+@traced()
+def get_unavailabilities(company_id: str, start_date: date, end_date: date, auth_token: str) -> Dict[str, Any]:
     """
-    Order a desk in a workspace
+    Get user unavailabilities between two dates, included
+
+    :return: unavailabilities by date in isoformat
+    """
+    params = {
+        "companyId": company_id,
+        "start": format_rfc3339(datetime.combine(start_date, datetime.min.time())),
+        "end": format_rfc3339(datetime.combine(end_date, datetime.max.time())),
+    }
+    return query(method="GET", url="/planning/unavailabilities", params=params, auth_token=auth_token)
+
+
+@dataclass
+class PreparedOrder:
+    """Order bodies, ready to be sent"""
+
+    order_date: date
+    desk_fullname: str
+    body_estimate: Dict[str, Any]
+    body_order: Dict[str, Any]
+
+
+@traced(attributes=("order_date",))
+def prepare_order(  # pylint: disable=too-many-locals
+    order_date: date,
+    workspace_details: Dict[str, Any],
+    desk_details: Dict[str, Any],
+    auth_token: str,
+    unavailabilities: Dict[str, Any] = None,
+) -> PreparedOrder:
+    """
+    Check a desk can be ordered on date, and build estimate and order bodies
 
     :param order_date: date to order
     :param workspace_details: json with all details of workspace (see moffi_sdk.spaces.get_workspace_details)
     :param desk_details: json with all details of desk (see moffi_sdk.spaces.get_desk_for_date)
     :param auth_token: API token
-    :return: paid order
-    :raise: OrderException if error during order
+    :param unavailabilities: user unavailabilities already fetched for this date (see get_unavailabilities)
+    :return: prepared order, see submit_order
+    :raise: UnavailableException if date can not be ordered
     """
     # verify unavailabilities for user
-    params = {
-        "companyId": workspace_details.get("company", {}).get("id"),
-        "start": rfc3339(datetime.combine(order_date, datetime.min.time())),
-        "end": rfc3339(datetime.combine(order_date, datetime.max.time())),
-    }
-    unavailabilities = query(method="GET", url="/planning/unavailabilities", params=params, auth_token=auth_token)
+    if unavailabilities is None:
+        unavailabilities = get_unavailabilities(
+            company_id=workspace_details.get("company", {}).get("id"),
+            start_date=order_date,
+            end_date=order_date,
+            auth_token=auth_token,
+        )
     if unavailabilities.get(order_date.isoformat(), {}).get("date") == order_date.isoformat():
         raise UnavailableException(f"Orders is unavailable on {order_date.isoformat()}")
 
@@ -66,23 +100,16 @@ def order_desk_from_details(  # pylint: disable=too-many-locals
     body_estimate = {
         "id": workspace_details.get("id"),
         "workspaceId": workspace_details.get("id"),
-        "start": rfc3339(start_date, utc=True),
-        "end": rfc3339(end_date, utc=True),
+        "start": format_rfc3339(start_date, utc=True),
+        "end": format_rfc3339(end_date, utc=True),
         "isMonthlyBooking": False,
         "places": 1,
-        "days": [{"day": order_date.isoformat(), "date": rfc3339(start_date, utc=True), "period": "DAY"}],
+        "days": [{"day": order_date.isoformat(), "date": format_rfc3339(start_date, utc=True), "period": "DAY"}],
         "bookedSeats": [{"seat": desk_details.get("seat")}] if desk_details else [],
         "period": "DAY",
         "rrule": None,
     }
-    estimate = query(method="POST", url="/bookings/estimate", data=body_estimate, auth_token=auth_token)
-
-    # verify desk is available on estimate
     desk_fullname = desk_details.get("seat", {}).get("fullname") if desk_details else "Parking"
-    if estimate.get("errorCode"):
-        raise UnavailableException(
-            f"Error during estimate for desk {desk_fullname} on {order_date.isoformat()} : {estimate.get('errorCode')}"
-        )
 
     # create order
     body_order = {
@@ -96,21 +123,61 @@ def order_desk_from_details(  # pylint: disable=too-many-locals
                     "id": workspace_details.get("id"),
                 },
                 "workspaceId": workspace_details.get("id"),
-                "start": rfc3339(start_date, utc=True),
-                "end": rfc3339(start_date, utc=True),
+                "start": format_rfc3339(start_date, utc=True),
+                "end": format_rfc3339(start_date, utc=True),
                 "places": 1,
                 "isMonthlyBooking": False,
                 "coupon": None,
                 "period": "DAY",
                 "bookedSeats": [{"seat": desk_details.get("seat")}] if desk_details else [],
-                "days": [{"day": order_date.isoformat(), "date": rfc3339(start_date, utc=True), "period": "DAY"}],
+                "days": [
+                    {"day": order_date.isoformat(), "date": format_rfc3339(start_date, utc=True), "period": "DAY"}
+                ],
                 "bookNextToInfo": {"id": None},
                 "rrule": None,
             }
         ],
         "origin": "WIDGET",
     }
-    order = query(method="POST", url="/orders/add", data=body_order, auth_token=auth_token)
+    return PreparedOrder(
+        order_date=order_date, desk_fullname=desk_fullname, body_estimate=body_estimate, body_order=body_order
+    )
+
+
+@traced()
+def submit_order(prepared: PreparedOrder, auth_token: str, timings: Dict[str, float] = None) -> Dict[str, Any]:
+    """
+    Send a prepared order : estimate, order and pay
+
+    :param prepared: see prepare_order
+    :param auth_token: API token
+    :param timings: if given, filled with duration in seconds of each step, order step is recorded even if it failed
+    :return: paid order
+    :raise: OrderException if error during order
+    """
+    if timings is None:
+        timings = {}
+    order_date = prepared.order_date
+    desk_fullname = prepared.desk_fullname
+
+    step_start = perf_counter()
+    with span("estimate"):
+        estimate = query(method="POST", url="/bookings/estimate", data=prepared.body_estimate, auth_token=auth_token)
+    timings["estimate"] = perf_counter() - step_start
+
+    # verify desk is available on estimate
+    if estimate.get("errorCode"):
+        raise UnavailableException(
+            f"Error during estimate for desk {desk_fullname} on {order_date.isoformat()} : {estimate.get('errorCode')}"
+        )
+
+    step_start = perf_counter()
+    try:
+        with span("order"):
+            order = query(method="POST", url="/orders/add", data=prepared.body_order, auth_token=auth_token)
+    finally:
+        # once sent, order may exist on server even if request failed, it must never be sent again
+        timings["order"] = perf_counter() - step_start
 
     # verify price is 0
     try:
@@ -132,14 +199,47 @@ def order_desk_from_details(  # pylint: disable=too-many-locals
         "methodId": None,
         "target": {"kind": "ORDER", "order": order},
     }
-    paid_order = query(method="POST", url=f"/orders/{order_id}/pay", data=body_pay, auth_token=auth_token)
+    step_start = perf_counter()
+    with span("pay"):
+        paid_order = query(method="POST", url=f"/orders/{order_id}/pay", data=body_pay, auth_token=auth_token)
+    timings["pay"] = perf_counter() - step_start
 
     if paid_order.get("status") != "PAID":
-        OrderException(f"Paid order is not on status PAID : {paid_order.get('status')}")
+        raise OrderException(f"Paid order is not on status PAID : {paid_order.get('status')}")
 
     return paid_order
 
 
+@traced(attributes=("order_date",))
+def order_desk_from_details(
+    order_date: date,
+    workspace_details: Dict[str, Any],
+    desk_details: Dict[str, Any],
+    auth_token: str,
+    unavailabilities: Dict[str, Any] = None,
+) -> Dict[str, Any]:
+    """
+    Order a desk in a workspace
+
+    :param order_date: date to order
+    :param workspace_details: json with all details of workspace (see moffi_sdk.spaces.get_workspace_details)
+    :param desk_details: json with all details of desk (see moffi_sdk.spaces.get_desk_for_date)
+    :param auth_token: API token
+    :param unavailabilities: user unavailabilities already fetched for this date (see get_unavailabilities)
+    :return: paid order
+    :raise: OrderException if error during order
+    """
+    prepared = prepare_order(
+        order_date=order_date,
+        workspace_details=workspace_details,
+        desk_details=desk_details,
+        auth_token=auth_token,
+        unavailabilities=unavailabilities,
+    )
+    return submit_order(prepared=prepared, auth_token=auth_token)
+
+
+@traced(attributes=("desk", "order_date"))
 def order_desk(city: str, workspace: str, desk: str, order_date: str, auth_token: str) -> Dict[str, Any]:
     """
     Order a desk from basic details
@@ -184,7 +284,15 @@ def order_desk(city: str, workspace: str, desk: str, order_date: str, auth_token
     return order_details
 
 
-def order_parking(city: str, parking: str, order_date: str, auth_token: str) -> Dict[str, Any]:
+@traced(attributes=("parking", "order_date"))
+def order_parking(  # pylint: disable=too-many-arguments
+    city: str,
+    parking: str,
+    order_date: str,
+    auth_token: str,
+    workspace_details: Dict[str, Any] = None,
+    unavailabilities: Dict[str, Any] = None,
+) -> Dict[str, Any]:
     """
     Order a parking from basic details
 
@@ -192,6 +300,8 @@ def order_parking(city: str, parking: str, order_date: str, auth_token: str) ->
     :param parking: Parking where order a place
     :param order_date: date in isoformat to book
     :param auth
+    :param workspace_details: parking details already fetched (see moffi_sdk.spaces.get_workspace_details)
+    :param unavailabilities: user unavailabilities already fetched for this date (see get_unavailabilities)
     :return: Completed order
     :raise: OrderException in case of error
     """
@@ -200,10 +310,11 @@ def order_parking(city: str, parking: str, order_date: str, auth_token: str) ->
     except ValueError as ex:
         raise OrderException from ex
 
-    try:
-        workspace_details = get_workspace_details(city=city, workspace=parking, auth_token=auth_token)
-    except RequestException as ex:
-        raise OrderException from ex
+    if workspace_details is None:
+        try:
+            workspace_details = get_workspace_details(city=city, workspace=parking, auth_token=auth_token)
+        except RequestException as ex:
+            raise OrderException from ex
 
     logging.info(f"Order parking {parking} for date {order_date}")
     order_details = order_desk_from_details(
@@ -211,6 +322,7 @@ def order_parking(city: str, parking: str, order_date: str, auth_token: str) ->
         workspace_details=workspace_details,
         desk_details=None,
         auth_token=auth_token,
+        unavailabilities=unavailabilities,
     )
     logging.info("Order successful")
     return order_details
@@ -0,0 +1,255 @@
+"""
+MOFFI client side rate limiting
+
+Requests go through a global token bucket and a per-account one, and through an adaptive concurrency limit :
+each throttled response (429, or a retryable 5xx) halves the number of requests in flight, each success
+raises it slowly back (AIMD). Retry-After of throttled responses pauses the account bucket, so all threads of
+the account wait instead of hammering the API
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from moffi_sdk.context import CURRENT_CLIENT
+
+RATE_LIMIT_SETTINGS = {
+    "enabled": True,
+    # requests per second and burst of all accounts
+    "rate": 50.0,
+    "burst": 100,
+    # requests per second and burst of each account
+    "account_rate": 20.0,
+    "account_burst": 40,
+    # bounds of requests in flight
+    "max_concurrency": 16,
+    "min_concurrency": 1,
+    # longest pause, whatever Retry-After says
+    "max_backoff": 60.0,
+}
+
+# accounts buckets kept, least recently used are forgotten
+MAX_ACCOUNTS = 1024
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket
+
+    Tokens are reserved ahead : a caller gets the delay to wait for its token, so waiting can be done
+    with time.sleep or asyncio.sleep
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens, going in debt if needed
+
+        :return: seconds to wait before sending the request
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.rate > 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            delay = -self._tokens / self.rate if self._tokens < 0 < self.rate else 0.0
+            return max(delay, self._paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Delay all next reservations by seconds from now"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit of requests in flight
+
+    Limit grows by one every `limit` successes, and is halved on each throttled response
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Wait for a free slot"""
+        with self._condition:
+            while self.in_flight >= max(self.min_limit, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: Optional[bool] = False) -> None:
+        """Free a slot, and adapt limit to request outcome, unchanged if outcome is unknown (None)"""
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+            elif throttled is not None:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RateLimiter:
+    """Global and per-account token buckets, with adaptive concurrency"""
+
+    def __init__(self, settings: Dict[str, Any] = None):
+        self.settings = dict(RATE_LIMIT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self.global_bucket = TokenBucket(self.settings.get("rate"), self.settings.get("burst"))
+        self.concurrency = AdaptiveConcurrency(
+            self.settings.get("max_concurrency"), self.settings.get("min_concurrency")
+        )
+        self.stats = {"throttled": 0, "waited": 0.0}
+        self._accounts: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Limiter is in use"""
+        return bool(self.settings.get("enabled"))
+
+    def account_bucket(self, account: str) -> TokenBucket:
+        """Bucket of an account, created on first use"""
+        with self._lock:
+            bucket = self._accounts.get(account)
+            if bucket is None:
+                bucket = self._accounts[account] = TokenBucket(
+                    self.settings.get("account_rate"), self.settings.get("account_burst")
+                )
+                while len(self._accounts) > MAX_ACCOUNTS:
+                    self._accounts.popitem(last=False)
+            else:
+                self._accounts.move_to_end(account)
+            return bucket
+
+    def reserve(self, account: str) -> float:
+        """
+        Reserve a request of an account on both buckets
+
+        :return: seconds to wait before sending it
+        """
+        delay = max(self.global_bucket.reserve(), self.account_bucket(account).reserve())
+        if delay > 0:
+            with self._lock:
+                self.stats["waited"] += delay
+        return delay
+
+    def acquire(self, account: str) -> None:
+        """Wait for rate and concurrency limits, release must be called once request is done"""
+        delay = self.reserve(account)
+        if delay > 0:
+            time.sleep(delay)
+        self.concurrency.acquire()
+
+    def release(self, throttled: Optional[bool] = False) -> None:
+        """Request is done, see AdaptiveConcurrency.release"""
+        self.concurrency.release(throttled=throttled)
+
+    def throttled(self, account: str, retry_after: Optional[float]) -> None:
+        """Server pushed back, pause the account for Retry-After seconds if given"""
+        with self._lock:
+            self.stats["throttled"] += 1
+        if retry_after:
+            self.account_bucket(account).pause(min(retry_after, self.settings.get("max_backoff")))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, in seconds or HTTP date, None if missing or invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, backoff_factor: float, retry_after: Optional[float] = None) -> float:
+    """
+    Delay before a retry : Retry-After when given, exponential backoff with full jitter otherwise
+
+    Delay is bounded by max_backoff of the rate limiter in use
+    """
+    max_backoff = get_rate_limiter().settings.get("max_backoff")
+    if retry_after is not None:
+        return min(retry_after, max_backoff)
+    return random.uniform(0, min(max_backoff, backoff_factor * (2**attempt)))
+
+
+RATE_LIMITER = RateLimiter()
+
+
+def configure_rate_limit(  # pylint: disable=too-many-arguments
+    enabled: Optional[bool] = None,
+    rate: Optional[float] = None,
+    burst: Optional[int] = None,
+    account_rate: Optional[float] = None,
+    account_burst: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    min_concurrency: Optional[int] = None,
+    max_backoff: Optional[float] = None,
+) -> RateLimiter:
+    """
+    Configure the shared rate limiter
+
+    Only given settings are changed, the current limiter is replaced.
+    Clients built afterwards get their own limiter with these settings
+
+    :param enabled: use rate limiter
+    :param rate: requests per second of all accounts
+    :param burst: requests sent at once before rate applies
+    :param account_rate: requests per second of each account
+    :param account_burst: requests of an account sent at once before rate applies
+    :param max_concurrency: max requests in flight, lowered when server pushes back
+    :param min_concurrency: requests in flight kept whatever server says
+    :param max_backoff: longest pause between retries, in seconds
+    :return: new shared rate limiter
+    """
+    global RATE_LIMITER  # pylint: disable=global-statement
+
+    new_settings = {
+        "enabled": enabled,
+        "rate": rate,
+        "burst": burst,
+        "account_rate": account_rate,
+        "account_burst": account_burst,
+        "max_concurrency": max_concurrency,
+        "min_concurrency": min_concurrency,
+        "max_backoff": max_backoff,
+    }
+    for key, value in new_settings.items():
+        if value is not None:
+            RATE_LIMIT_SETTINGS[key] = value
+    RATE_LIMITER = RateLimiter()
+    return RATE_LIMITER
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the rate limiter of the bound client, or the shared one"""
+    client = CURRENT_CLIENT.get()
+    if client is not None:
+        return client.rate_limiter
+    return RATE_LIMITER
@@ -0,0 +1,127 @@
+"""
+MOFFI request memoization
+
+Identical GET requests (same URL, parameters and token) within a short TTL get the same response body without
+calling the API. Requests changing orders invalidate responses of their token
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from moffi_sdk.context import CURRENT_CLIENT
+from moffi_sdk.singleflight import SingleFlight
+
+REQUEST_CACHE_SETTINGS = {
+    "enabled": True,
+    # seconds a response is reused
+    "ttl": 5.0,
+    "max_entries": 512,
+}
+
+# requests to these endpoints, other than GET, change orders and seats availability
+MUTATING_PREFIXES = ("/orders",)
+# estimate only checks an order, nothing is changed
+NON_MUTATING_ENDPOINTS = frozenset(["/bookings/estimate"])
+
+
+def is_mutating(method: str, endpoint: str) -> bool:
+    """A request invalidates memoized responses of its token"""
+    if method in ("GET", "HEAD", "OPTIONS") or endpoint in NON_MUTATING_ENDPOINTS:
+        return False
+    return endpoint.startswith(MUTATING_PREFIXES)
+
+
+class RequestCache:
+    """
+    Thread safe TTL cache of response bodies, by token
+
+    Each token has a generation, bumped on invalidation : a response fetched before an invalidation
+    is never stored after it
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = REQUEST_CACHE_SETTINGS.get("ttl") if ttl is None else ttl
+        self.max_entries = REQUEST_CACHE_SETTINGS.get("max_entries") if max_entries is None else max_entries
+        self.flights = SingleFlight()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, bytes]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        """Response body of a (url, token) key, None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def generation(self, token: str) -> int:
+        """Current generation of a token, to give back to set"""
+        with self._lock:
+            return self._generations.get(token, 0)
+
+    def set(self, key: Tuple[str, str], body: bytes, generation: int) -> None:
+        """Store a response body, unless its token was invalidated since generation"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if self._generations.get(key[1], 0) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str = None) -> None:
+        """Forget responses of a token, or all responses"""
+        with self._lock:
+            self.stats["invalidations"] += 1
+            if token is None:
+                self._entries.clear()
+                for known_token in self._generations:
+                    self._generations[known_token] += 1
+                return
+            self._generations[token] = self._generations.get(token, 0) + 1
+            for key in [key for key in self._entries if key[1] == token]:
+                del self._entries[key]
+
+
+REQUEST_CACHE = RequestCache()
+
+
+def configure_request_cache(
+    enabled: Optional[bool] = None, ttl: Optional[float] = None, max_entries: Optional[int] = None
+) -> RequestCache:
+    """
+    Configure GET memoization
+
+    Only given settings are changed, the current cache is replaced
+
+    :param enabled: memoize and coalesce identical GET requests
+    :param ttl: seconds a response is reused, 0 to only coalesce concurrent requests
+    :param max_entries: max responses kept, least recently stored are evicted first
+    :return: new shared cache
+    """
+    global REQUEST_CACHE  # pylint: disable=global-statement
+
+    new_settings = {"enabled": enabled, "ttl": ttl, "max_entries": max_entries}
+    for key, value in new_settings.items():
+        if value is not None:
+            REQUEST_CACHE_SETTINGS[key] = value
+    REQUEST_CACHE = RequestCache()
+    return REQUEST_CACHE
+
+
+def get_request_cache() -> Optional[RequestCache]:
+    """Get the request cache of the bound client, or the shared one, None if memoization is disabled"""
+    if not REQUEST_CACHE_SETTINGS.get("enabled"):
+        return None
+    client = CURRENT_CLIENT.get()
+    if client is not None:
+        return client.request_cache
+    return REQUEST_CACHE
@@ -2,16 +2,18 @@
 MOFFI reservations items
  """
 import logging
-from collections import defaultdict
+import math
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, List
+from datetime import date, datetime
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Tuple
 
-from dateutil import parser as dateparser
-
-from moffi_sdk.exceptions import MoffiSdkException
+from moffi_sdk.exceptions import MoffiSdkException, RequestException
 from moffi_sdk.spaces import BUILDING_TIMEZONE
-from moffi_sdk.utils import query
+from moffi_sdk.tracing import span, traced
+from moffi_sdk.utils import parse_datetime, query, submit_in_context
 
 AVAILABLE_STEPS = {
     "validation": "VALIDATION",
@@ -22,9 +24,29 @@ AVAILABLE_STEPS = {
 }
 AVAILABLE_STATUS = ["CREATED", "VALIDATED", "CONFIRMED", "PAID"]
 
+# max concurrent requests when fetching pages
+MAX_WORKERS = 4
+
+# number of orders per request
+PAGE_SIZE = 10
+# page sizes tried, largest first, to find the one accepted by API
+PAGE_SIZE_CANDIDATES = [100, 50, 20, 10]
+# page size found by probing
+ADAPTIVE_PAGE_SIZE = {"size": None}
+
+
+def format_reservation(item: "ReservationItem") -> str:
+    """Human readable reservation item"""
+    return (
+        f"{item.workspace_name} - {item.desk_name}"
+        f" / {item.workspace_type}"
+        f" / status {item.status} / step {item.step}"
+        f" / from {item.start.isoformat()} to {item.end.isoformat()}"
+    )
 
-@dataclass
-class ReservationItem:
+
+@dataclass(slots=True)
+class ReservationItem:  # pylint: disable=too-many-instance-attributes
     """Reservation item"""
 
     workspace_name: str
@@ -38,20 +60,105 @@ class ReservationItem:
     status: str
 
     def __str__(self):
-        return (
-            f"{self.workspace_name} - {self.desk_name}"
-            f" / {self.workspace_type}"
-            f" / status {self.status} / step {self.step}"
-            f" / from {self.start.isoformat()} to {self.end.isoformat()}"
-        )
+        return format_reservation(self)
+
+
+@dataclass(frozen=True, slots=True)
+class FrozenReservationItem:  # pylint: disable=too-many-instance-attributes
+    """Immutable and hashable reservation item"""
+
+    workspace_name: str
+    workspace_address: str
+    workspace_type: str
+    workspace_city: str
+    desk_name: str
+    start: datetime
+    end: datetime
+    step: str
+    status: str
+
+    def __str__(self):
+        return format_reservation(self)
+
+
+def _orders_params(step: str, page: int, max_size: int) -> List[Tuple[str, Any]]:
+    """Query parameters of a page of reservations on a step"""
+    params = [
+        ("step", AVAILABLE_STEPS.get(step)),
+        ("kind", "BOOKING"),
+        ("size", max_size),
+        ("page", page),
+        ("sort", "start_date,asc"),
+    ]
+    for status in AVAILABLE_STATUS:
+        params.append(("status", status))
+    return params
 
 
-def get_reservations(auth_token: str, steps: List[str] = None) -> List[ReservationItem]:
+def _get_orders_page(auth_token: str, step: str, page: int, max_size: int) -> Tuple[List[ReservationItem], int]:
     """
-    Get all reservations
+    Get a page of reservations on a step
+    Return reservations and number of orders in page
     """
+    params = _orders_params(step=step, page=page, max_size=max_size)
+    unparsed_reservations = query(method="GET", url="/orders", params=params, auth_token=auth_token)
+    return map_reservations(unparsed_reservations), len(unparsed_reservations.get("content", []))
+
 
-    reservations = []
+@traced()
+def probe_page_size(auth_token: str, step: str, count: int) -> Tuple[int, List[ReservationItem], int]:
+    """
+    Find the largest page size accepted by the API, and remember it
+
+    :param step: a step with orders, used for probing
+    :param count: number of orders on step
+    :return: page size, reservations of the first page of step and number of orders in it
+    """
+    for candidate in PAGE_SIZE_CANDIDATES:
+        try:
+            unparsed_reservations = query(
+                method="GET",
+                url="/orders",
+                params=_orders_params(step=step, page=0, max_size=candidate),
+                auth_token=auth_token,
+            )
+        except RequestException as ex:
+            logging.debug(f"Page size {candidate} rejected : {repr(ex)}")
+            continue
+
+        orders_count = len(unparsed_reservations.get("content", []))
+        page_size = candidate
+        if isinstance(unparsed_reservations.get("size"), int) and 0 < unparsed_reservations.get("size") < candidate:
+            page_size = unparsed_reservations.get("size")
+        elif 0 < orders_count < min(candidate, count):
+            # API silently capped the page
+            page_size = orders_count
+
+        ADAPTIVE_PAGE_SIZE["size"] = page_size
+        logging.debug(f"Using page size {page_size}")
+        return page_size, map_reservations(unparsed_reservations), orders_count
+
+    raise RequestException("No page size accepted by API")
+
+
+def iter_reservations(  # pylint: disable=too-many-arguments,too-many-locals,too-many-branches,too-many-statements
+    auth_token: str,
+    steps: List[str] = None,
+    max_workers: int = MAX_WORKERS,
+    page_size: int = PAGE_SIZE,
+    adaptive_page_size: bool = False,
+    end_date: date = None,
+) -> Iterator[ReservationItem]:
+    """
+    Iterate on reservations, page by page
+
+    Pages are computed from orders count and fetched concurrently, up to max_workers pages ahead,
+    items are yielded in steps and pages order
+
+    :param page_size: number of orders per request
+    :param adaptive_page_size: use the largest page size accepted by the API, probed on first call
+    :param end_date: stop paging a step once reservations start after this date
+    """
 
     if not auth_token:
         raise MoffiSdkException("Missing token on get_reservations")
@@ -62,6 +169,11 @@ def get_reservations(auth_token: str, steps: List[str] = None) -> List[Reservati
     # count number of items
     counts = query(method="GET", url="/orders/count", auth_token=auth_token)
 
+    max_size = page_size
+    if adaptive_page_size and ADAPTIVE_PAGE_SIZE.get("size"):
+        max_size = ADAPTIVE_PAGE_SIZE.get("size")
+    probed = {}
+    pages = []
     for step in steps:
         if AVAILABLE_STEPS.get(step) is None or counts.get(step) is None:
             logging.warning(f"Unknown reservation step {step}, ignoring.")
@@ -72,117 +184,186 @@ def get_reservations(auth_token: str, steps: List[str] = None) -> List[Reservati
             logging.debug(f"No reservations on step {step}")
             continue
 
-        page = 0
-        max_size = 10
-        returned_size = max_size
-        while returned_size == max_size:
-            params = [
-                ("step", AVAILABLE_STEPS.get(step)),
-                ("kind", "BOOKING"),
-                ("size", max_size),
-                ("page", page),
-                ("sort", "start_date,asc"),
-            ]
-            for status in AVAILABLE_STATUS:
-                params.append(("status", status))
+        if adaptive_page_size and not ADAPTIVE_PAGE_SIZE.get("size"):
+            max_size, probed_reservations, probed_count = probe_page_size(auth_token=auth_token, step=step, count=size)
+            probed[step] = (probed_reservations, probed_count)
+
+        pages.extend((step, page) for page in range(math.ceil(size / max_size)))
+
+    def fetch_page(step: str, page: int) -> Tuple[List[ReservationItem], int]:
+        if page == 0 and step in probed:
+            # an order may give several reservations, pages are counted in orders
+            return probed[step]
+        with span("orders_page", step=step, page=page):
+            return _get_orders_page(auth_token=auth_token, step=step, page=page, max_size=max_size)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    next_page = 0
+    stopped_steps = set()
+    try:
+        while pending or next_page < len(pages):
+            # keep up to max_workers pages in flight
+            while next_page < len(pages) and len(pending) < max_workers:
+                step, page = pages[next_page]
+                next_page += 1
+                if step not in stopped_steps:
+                    pending.append((step, page, submit_in_context(executor, fetch_page, step, page)))
+            if not pending:
+                break
+
+            step, page, future = pending.popleft()
+            if step in stopped_steps:
+                future.cancel()
+                continue
+            new_reservations, orders_count = future.result()
 
-            unparsed_reservations = query(method="GET", url="/orders", params=params, auth_token=auth_token)
-            new_reservations = map_reservations(unparsed_reservations)
-            reservations += new_reservations
-            returned_size = len(new_reservations)
-            page += 1
+            # next page, in flight or not yet submitted, is of another step
+            if pending:
+                next_step = pending[0][0]
+            else:
+                next_step = pages[next_page][0] if next_page < len(pages) else None
+            last_page_of_step = next_step != step
+            if last_page_of_step and orders_count > counts.get(step) - page * max_size:
+                # orders have been added since count, continue until a short page
+                while orders_count == max_size:
+                    page += 1
+                    more_reservations, orders_count = fetch_page(step, page)
+                    new_reservations += more_reservations
+
+            for resa in new_reservations:
+                if end_date is not None and resa.start.date() > end_date:
+                    logging.debug(f"Reached end date {end_date.isoformat()} on step {step}")
+                    stopped_steps.add(step)
+                    break
+                yield resa
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+@traced()
+def get_reservations(auth_token: str, steps: List[str] = None, **kwargs) -> List[ReservationItem]:
+    """
+    Get all reservations
 
-    return reservations
+    See iter_reservations for optional arguments
+    """
+    return list(iter_reservations(auth_token=auth_token, steps=steps, **kwargs))
 
 
-def get_cancelled_reservations(auth_token: str, include_past: bool = False) -> List[ReservationItem]:
+def iter_cancelled_reservations(
+    auth_token: str,
+    include_past: bool = False,
+    page_size: int = PAGE_SIZE,
+    adaptive_page_size: bool = False,
+    end_date: date = None,
+) -> Iterator[ReservationItem]:
     """
-    Get cancelled reservations
+    Iterate on upcoming cancelled reservations, page by page, latest first
+
+    :param include_past: also yield cancelled reservations in the past, instead of stopping at the first one
+    :param page_size: number of orders per request
+    :param adaptive_page_size: use the largest page size already probed by get_reservations, if any
+    :param end_date: skip reservations starting after this date
     """
-    reservations = []
     page = 0
-    max_size = 10
-    returned_size = max_size
-    need_break = False
+    max_size = page_size
+    if adaptive_page_size and ADAPTIVE_PAGE_SIZE.get("size"):
+        max_size = ADAPTIVE_PAGE_SIZE.get("size")
+    last_page = False
     today = datetime.now(BUILDING_TIMEZONE.get("tz")).date()
-    while returned_size == max_size:
+    while not last_page:
         params = {"status": "CANCELLED", "size": max_size, "page": page, "sort": "start_date,desc"}
         unparsed_reservations = query(method="GET", url="/orders", params=params, auth_token=auth_token)
-        new_reservations = map_reservations(unparsed_reservations)
-        for resa in new_reservations:
-            if resa.start.date() > today:
-                reservations.append(resa)
-            else:
+        for resa in map_reservations(unparsed_reservations):
+            if resa.start.date() <= today and not include_past:
                 logging.debug("Found cancelled reservation in the past, break")
-                need_break = True
-                break
-        if need_break:
-            break
-        returned_size = len(new_reservations)
+                return
+            if end_date is None or resa.start.date() <= end_date:
+                yield resa
+        last_page = _is_last_page(unparsed_reservations, page=page, max_size=max_size)
         page += 1
-    return reservations
 
 
-def map_reservations(reservations: dict) -> List[ReservationItem]:
+@traced()
+def get_cancelled_reservations(auth_token: str, include_past: bool = False, **kwargs) -> List[ReservationItem]:
+    """
+    Get cancelled reservations
+
+    See iter_cancelled_reservations for optional arguments
+    """
+    return list(iter_cancelled_reservations(auth_token=auth_token, include_past=include_past, **kwargs))
+
+
+def _is_last_page(unparsed_reservations: Dict[str, Any], page: int, max_size: int) -> bool:
+    """
+    Check if a page is the last one, from page metadata when API sends them
+    """
+    if isinstance(unparsed_reservations.get("last"), bool):
+        return unparsed_reservations.get("last")
+    if isinstance(unparsed_reservations.get("totalElements"), int):
+        return (page + 1) * max_size >= unparsed_reservations.get("totalElements")
+    return len(unparsed_reservations.get("content", [])) < max_size
+
+
+def map_reservations(reservations: dict, frozen: bool = False) -> List[ReservationItem]:
     """
     Map a list of reservations from API to list of ReservationItem
+
+    :param frozen: return immutable FrozenReservationItem
     """
 
-    content = reservations.get("content", [])
+    item_class = FrozenReservationItem if frozen else ReservationItem
     cleaned = []
-    for reservation in content:
+    append = cleaned.append
+    for reservation in reservations.get("content", []):
         step = reservation.get("step")
         status = reservation.get("status")
 
         for booking in reservation.get("bookings", []):
-            workspace = booking.get("workspace", {}).get("title")
-            workspace_type = booking.get("workspace", {}).get("type")
-            address = booking.get("workspace", {}).get("address")
-            city = booking.get("workspace", {}).get("building", {}).get("name")
-            start = dateparser.parse(booking.get("start"))
-            end = dateparser.parse(booking.get("end"))
-
-            for seat in booking.get("bookedSeats", []):
-                item = ReservationItem(
-                    workspace_name=workspace,
-                    workspace_address=address,
-                    workspace_type=workspace_type,
-                    workspace_city=city,
-                    desk_name=seat.get("seat", {}).get("fullname"),
-                    start=start,
-                    end=end,
-                    step=step,
-                    status=status,
-                )
-                cleaned.append(item)
-            if not booking.get("bookedSeats"):
-                # some workspaces dont have a seat, like parkings
-                item = ReservationItem(
-                    workspace_name=workspace,
-                    workspace_address=address,
-                    workspace_type=workspace_type,
-                    workspace_city=city,
-                    desk_name=None,
-                    start=start,
-                    end=end,
-                    step=step,
-                    status=status,
+            workspace = booking.get("workspace", {})
+            title = workspace.get("title")
+            workspace_type = workspace.get("type")
+            address = workspace.get("address")
+            city = workspace.get("building", {}).get("name")
+            start = parse_datetime(booking.get("start"))
+            end = parse_datetime(booking.get("end"))
+
+            # some workspaces dont have a seat, like parkings
+            seats = booking.get("bookedSeats") or [{}]
+            for seat in seats:
+                append(
+                    item_class(
+                        title,
+                        address,
+                        workspace_type,
+                        city,
+                        seat.get("seat", {}).get("fullname"),
+                        start,
+                        end,
+                        step,
+                        status,
+                    )
                 )
-                cleaned.append(item)
 
     return cleaned
 
 
+@traced()
 def get_reservations_by_date(
-    auth_token: str, steps: List[str] = None, view_cancelled: bool = True
+    auth_token: str, steps: List[str] = None, view_cancelled: bool = True, end_date: date = None
 ) -> Dict[str, List[ReservationItem]]:
     """
     Get all reservations in dict format, key is starting date, value are list of reservations for this date
+
+    :param end_date: ignore reservations after this date, and stop paging as soon as possible
     """
 
-    reservations = get_reservations(auth_token=auth_token, steps=steps)
+    reservations = iter_reservations(auth_token=auth_token, steps=steps, end_date=end_date)
     if view_cancelled:
-        reservations += get_cancelled_reservations(auth_token=auth_token)
+        reservations = chain(reservations, iter_cancelled_reservations(auth_token=auth_token, end_date=end_date))
 
     ordered_reservations = defaultdict(list)
 
@@ -0,0 +1,134 @@
+"""
+Moffi multi-account runner
+
+Run auto reservation for many accounts at once, on a bounded worker pool
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.auto_reservation import auto_reservation
+from moffi_sdk.spaces import building_timezone_context, get_building, get_building_timezone, get_workspace_details
+
+# max accounts processed at the same time
+MAX_WORKERS = 4
+
+
+@dataclass
+class AccountConfig:  # pylint: disable=too-many-instance-attributes
+    """Auto reservation settings of an account"""
+
+    name: str
+    user: str
+    password: str = field(repr=False)
+    city: str
+    workspace: str
+    desk: str
+    parking: Optional[str] = None
+    work_days: Optional[List[int]] = None
+
+
+@dataclass
+class AccountResult:
+    """Outcome of auto reservation for an account"""
+
+    name: str
+    success: bool
+    orders: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+    duration: float = 0.0
+
+
+class SharedMetadata:
+    """
+    Building and workspace details shared between accounts, resolved once per city and workspace
+
+    Values are read only : accounts must not modify them
+    """
+
+    def __init__(self):
+        self._values: Dict[Tuple[str, str], Tuple[Any, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    def get(self, city: str, workspace: str, auth_token: str) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Return building timezone and workspace details, first account asking for them queries the API
+
+        :raise: MoffiSdkException if unable to get details
+        """
+        key = (city, workspace)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._values:
+                # get_building sets building timezone, keep it away from other accounts
+                with building_timezone_context():
+                    tzinfo = get_building_timezone(get_building(name=city, auth_token=auth_token))
+                    workspace_details = get_workspace_details(city=city, workspace=workspace, auth_token=auth_token)
+                self._values[key] = (tzinfo, workspace_details)
+            return self._values[key]
+
+
+def run_account(account: AccountConfig, metadata: SharedMetadata, scan: bool = False) -> AccountResult:
+    """
+    Run auto reservation for one account, never raise
+
+    Building timezone is isolated from other accounts running concurrently
+    """
+    start = time.perf_counter()
+    try:
+        auth_token = get_auth_token(username=account.user, password=account.password)
+        tzinfo, workspace_details = metadata.get(city=account.city, workspace=account.workspace, auth_token=auth_token)
+        with building_timezone_context(tzinfo):
+            orders = auto_reservation(
+                desk=account.desk,
+                city=account.city,
+                workspace=account.workspace,
+                auth_token=auth_token,
+                parking=account.parking,
+                work_days=account.work_days,
+                scan=scan,
+                workspace_details=workspace_details,
+            )
+    except Exception as ex:  # pylint: disable=broad-except
+        logging.error(f"Auto reservation failed for account {account.name} : {repr(ex)}")
+        return AccountResult(name=account.name, success=False, error=repr(ex), duration=time.perf_counter() - start)
+
+    return AccountResult(name=account.name, success=True, orders=orders, duration=time.perf_counter() - start)
+
+
+def run_accounts(
+    accounts: List[AccountConfig], max_workers: int = MAX_WORKERS, scan: bool = False
+) -> List[AccountResult]:
+    """
+    Run auto reservation for all accounts, at most max_workers at the same time
+
+    A failing account does not stop the others
+
+    :return: results, in accounts order
+    """
+    metadata = SharedMetadata()
+    if not accounts:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(accounts)))) as executor:
+        return list(executor.map(lambda account: run_account(account, metadata, scan=scan), accounts))
+
+
+def format_report(results: List[AccountResult]) -> str:
+    """Summary of a multi-account run, one line per account"""
+    lines = []
+    for result in results:
+        if result.success:
+            lines.append(f"{result.name}: OK, {len(result.orders)} order(s) in {result.duration:.1f}s")
+        else:
+            lines.append(f"{result.name}: FAILED in {result.duration:.1f}s, {result.error}")
+    succeeded = sum(1 for result in results if result.success)
+    orders = sum(len(result.orders) for result in results)
+    lines.append(f"{succeeded}/{len(results)} account(s) succeeded, {orders} order(s) placed")
+    return "\n".join(lines)
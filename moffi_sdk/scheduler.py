@@ -0,0 +1,175 @@
+"""
+Moffi auto reservation scheduler
+
+Long running auto reservation, keeping session, token, workspace and reservations warm between cycles
+"""
+
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.auto_reservation import RunContext, auto_reservation
+from moffi_sdk.booking_window import PREPARE_LEAD, book_at_opening, next_opening
+from moffi_sdk.exceptions import MoffiSdkException
+from moffi_sdk.reservations import get_reservations_by_date
+from moffi_sdk.spaces import get_workspace_details
+from moffi_sdk.utils import get_session
+
+# seconds before reservations are fetched again, orders placed by the daemon are added meanwhile
+SNAPSHOT_TTL = 3600
+# seconds before workspace details are fetched again
+WORKSPACE_TTL = 86400
+# max seconds between two cycles, even if no date opens
+MAX_SLEEP = 6 * 3600
+# exponential backoff after failures
+RETRY_DELAY = 30
+RETRY_MAX_DELAY = 1800
+# wake up a bit after opening when not booking at the exact instant
+OPENING_MARGIN = 5
+
+
+class AutoReservationDaemon:  # pylint: disable=too-many-instance-attributes
+    """
+    Run auto reservation in cycles, sleeping until the next date enters the booking range,
+    or until a retry after a failure
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        username: str,
+        password: str,
+        desk: str,
+        city: str,
+        workspace: str,
+        parking: Optional[str] = None,
+        work_days: Optional[List[int]] = None,
+        scan: bool = True,
+        window_open: bool = False,
+    ):
+        self.username = username
+        self._password = password
+        self.desk = desk
+        self.city = city
+        self.workspace = workspace
+        self.parking = parking
+        self.work_days = work_days
+        self.scan = scan
+        self.window_open = window_open
+
+        self.workspace_details = None
+        self.workspace_fetched_at = 0.0
+        self.reservations = None
+        self.reservations_fetched_at = 0.0
+        self.failures = 0
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Ask daemon to stop, current request is completed"""
+        logging.info("Stopping auto reservation daemon")
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        """Daemon was asked to stop"""
+        return self._stop.is_set()
+
+    def _token(self) -> str:
+        return get_auth_token(username=self.username, password=self._password)
+
+    def _refresh_state(self, auth_token: str) -> None:
+        """Fetch workspace details and reservations when outdated"""
+        now = time.time()
+        if self.workspace_details is None or now - self.workspace_fetched_at > WORKSPACE_TTL:
+            self.workspace_details = get_workspace_details(
+                city=self.city, workspace=self.workspace, auth_token=auth_token
+            )
+            self.workspace_fetched_at = now
+        if self.reservations is None or now - self.reservations_fetched_at > SNAPSHOT_TTL:
+            self.reservations = get_reservations_by_date(
+                auth_token=auth_token, steps=["validation", "invitation", "waiting", "inProgress"]
+            )
+            self.reservations_fetched_at = now
+
+    def cycle(self) -> float:
+        """
+        Book every available date
+
+        :return: timestamp of next opening
+        """
+        auth_token = self._token()
+        self._refresh_state(auth_token)
+        # orders placed during the run are added to the snapshot by the context
+        context = RunContext(auth_token=auth_token, city=self.city, reservations=self.reservations)
+        auto_reservation(
+            desk=self.desk,
+            city=self.city,
+            workspace=self.workspace,
+            auth_token=auth_token,
+            parking=self.parking,
+            work_days=self.work_days,
+            scan=self.scan,
+            workspace_details=self.workspace_details,
+            context=context,
+        )
+        self.reservations = context.reservations
+
+        closed_days = [
+            day.lower()
+            for day, details in self.workspace_details.get("schedule", {}).items()
+            if isinstance(details, dict) and details.get("isOpen") is False
+        ]
+        order_date, opening = next_opening(self.workspace_details, closed_days=closed_days, work_days=self.work_days)
+        logging.info(f"Next date to book is {order_date.isoformat()}, opening at {opening.isoformat()}")
+        return opening.timestamp()
+
+    def _book_opening(self) -> None:
+        """Book next date at its opening instant"""
+        auth_token = self._token()
+        paid_order = book_at_opening(
+            desk=self.desk,
+            city=self.city,
+            workspace=self.workspace,
+            auth_token=auth_token,
+            username=self.username,
+            work_days=self.work_days,
+            max_wait=2 * PREPARE_LEAD,
+            stop=self._stop,
+        )
+        if paid_order:
+            # order date is only known by book_at_opening, fetch reservations again on next cycle
+            self.reservations_fetched_at = 0.0
+
+    def run(self) -> None:
+        """Run until stopped"""
+        logging.info("Starting auto reservation daemon")
+        while not self.stopped:
+            try:
+                next_event = self.cycle()
+                self.failures = 0
+                if self.window_open:
+                    wake_at = next_event - PREPARE_LEAD
+                else:
+                    wake_at = next_event + OPENING_MARGIN
+                delay = min(max(0.0, wake_at - time.time()), MAX_SLEEP)
+            except MoffiSdkException as ex:
+                self.failures += 1
+                delay = min(RETRY_DELAY * 2 ** (self.failures - 1), RETRY_MAX_DELAY)
+                logging.warning(f"Auto reservation cycle failed ({self.failures} in a row), retry in {delay}s : {ex}")
+                # state may be outdated
+                self.reservations = None
+                wake_at = None
+
+            logging.info(f"Sleeping {delay:.0f}s")
+            if self._stop.wait(delay):
+                break
+
+            if self.window_open and wake_at is not None and delay < MAX_SLEEP:
+                try:
+                    self._book_opening()
+                except MoffiSdkException as ex:
+                    logging.warning(f"Unable to book at opening : {repr(ex)}")
+
+        get_session().close()
+        logging.info("Auto reservation daemon stopped")
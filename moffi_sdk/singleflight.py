@@ -0,0 +1,72 @@
+"""
+MOFFI request coalescing
+
+Concurrent calls for the same key share a single execution
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """A call in flight"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Thread safe call coalescing
+
+    While a call for a key runs, other callers with the same key wait for it and get the same result,
+    or the same exception. Nothing is kept once the call is done
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "shared": 0}
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run func, or wait for the call already running for key
+
+        :return: func result
+        :raise: exception raised by func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.stats["shared"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.stats["calls"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as ex:  # pylint: disable=broad-except
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def in_flight(self, key: Hashable) -> bool:
+        """A call is running for key"""
+        with self._lock:
+            return key in self._calls
@@ -4,20 +4,93 @@ Moffi Space details
 Get details about buildings, workspaces, desks
 """
 
-from datetime import date, datetime, timedelta
-from typing import Any, Dict
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List
 
-import pytz
-from rfc3339 import rfc3339
+from moffi_sdk.cache import get_metadata_cache
+from moffi_sdk.exceptions import ItemNotFoundException, MoffiSdkException
+from moffi_sdk.tracing import traced
+from moffi_sdk.utils import format_rfc3339, query, submit_in_context
 
-from moffi_sdk.exceptions import ItemNotFoundException
-from moffi_sdk.utils import query
+_BUILDING_TIMEZONE = contextvars.ContextVar("building_timezone")
+_DEFAULT_BUILDING_TIMEZONE = {"tz": timezone.utc}
 
-BUILDING_TIMEZONE = {"tz": pytz.timezone("UTC")}
 
+class BuildingTimezone:
+    """
+    Timezone of the building in use, as a mapping with a single "tz" key
 
+    Each context gets its own value with building_timezone_context,
+    outside of it a process wide value is shared
+    """
+
+    @staticmethod
+    def _values() -> Dict[str, Any]:
+        return _BUILDING_TIMEZONE.get(_DEFAULT_BUILDING_TIMEZONE)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a value"""
+        return self._values().get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return self._values()[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._values()[key] = value
+
+    def __repr__(self) -> str:
+        return repr(self._values())
+
+
+BUILDING_TIMEZONE = BuildingTimezone()
+
+
+@contextmanager
+def building_timezone_context(tzinfo: Any = None) -> Iterator[BuildingTimezone]:
+    """
+    Isolate building timezone for the current context, like a thread running another account
+
+    :param tzinfo: initial timezone, UTC by default
+    """
+    token = _BUILDING_TIMEZONE.set({"tz": tzinfo or timezone.utc})
+    try:
+        yield BUILDING_TIMEZONE
+    finally:
+        _BUILDING_TIMEZONE.reset(token)
+
+
+def set_context_building_timezone(tzinfo: Any) -> None:
+    """
+    Set building timezone for the current context only, never for the process
+
+    Each asyncio task runs in a copy of its parent context, concurrent tasks do not see each other value
+    """
+    _BUILDING_TIMEZONE.set({"tz": tzinfo})
+
+
+def get_building_timezone(building_details: Dict[str, Any]) -> Any:
+    """Timezone of a building"""
+    import pytz  # pylint: disable=import-outside-toplevel
+
+    return pytz.timezone(building_details.get("timezone", "UTC"))
+
+
+# max concurrent requests when looking for a workspace on floors
+MAX_WORKERS = 8
+
+
+@traced(attributes=("name",))
 def get_building(name: str, auth_token: str) -> Dict[str, Any]:
-    """Get details about building"""
+    """Get details about building, from metadata cache if available"""
+
+    building_details = get_metadata_cache().get("building", name)
+    if building_details is not None:
+        BUILDING_TIMEZONE["tz"] = get_building_timezone(building_details)
+        return building_details
 
     # list cities available
     available_buildings = query(
@@ -34,26 +107,34 @@ def get_building(name: str, auth_token: str) -> Dict[str, Any]:
         raise ItemNotFoundException(f"City {name} not found", available_items=buildings)
 
     building_details = query(method="GET", url=f"/buildings/{city.get('id')}", auth_token=auth_token)
-    BUILDING_TIMEZONE["tz"] = pytz.timezone(building_details.get("timezone", "UTC"))
+    BUILDING_TIMEZONE["tz"] = get_building_timezone(building_details)
+    get_metadata_cache().set("building", name, building_details)
 
     return building_details
 
 
-def get_workspace_availabilities(
-    name: str, auth_token: str, city: str = None, building_details: Dict[str, Any] = None, target_date: datetime = None
+@traced(attributes=("name",))
+def get_workspace_availabilities(  # pylint: disable=too-many-arguments
+    name: str,
+    auth_token: str,
+    city: str = None,
+    building_details: Dict[str, Any] = None,
+    target_date: datetime = None,
+    max_workers: int = MAX_WORKERS,
 ) -> Dict[str, Any]:
-    """Get details about workspace"""
+    """
+    Get details about workspace
+
+    Floors are queried concurrently, first floor with the workspace wins and pending floors are cancelled
+    """
 
     if building_details is None:
         building_details = get_building(name=city, auth_token=auth_token)
 
-    # iterate on floors to find workspace
-    workspace_details = None
     if target_date is None:
-        target_date = rfc3339(datetime.now(BUILDING_TIMEZONE.get("tz")) + timedelta(days=1))
+        target_date = format_rfc3339(datetime.now(BUILDING_TIMEZONE.get("tz")) + timedelta(days=1))
 
-    workspace_names = []
-    for floor in building_details.get("floors", []):
+    def get_floor(floor: Dict[str, Any]) -> List[Dict[str, Any]]:
         params = {
             "buildingId": building_details.get("id"),
             "startDate": target_date,
@@ -62,20 +143,33 @@ def get_workspace_availabilities(
             "period": "DAY",
             "floor": floor.get("level"),
         }
-        floor_details = query(
+        return query(
             method="get",
             url="/workspaces/availabilities",
             params=params,
             auth_token=auth_token,
         )
-        workspace_names.extend([wks.get("workspace", {}).get("title", "NO_NAME") for wks in floor_details])
-        for workspace in floor_details:
-            if workspace.get("workspace", {}).get("title", "") == name:
-                workspace_details = workspace
+
+    # iterate on floors to find workspace
+    workspace_details = None
+    workspace_names = []
+    floors = building_details.get("floors", [])
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(floors))))
+    futures = [submit_in_context(executor, get_floor, floor) for floor in floors]
+    try:
+        for future in as_completed(futures):
+            floor_details = future.result()
+            workspace_names.extend([wks.get("workspace", {}).get("title", "NO_NAME") for wks in floor_details])
+            for workspace in floor_details:
+                if workspace.get("workspace", {}).get("title", "") == name:
+                    workspace_details = workspace
+                    break
+            if workspace_details is not None:
                 break
-        if workspace_details is not None:
-            break
-        
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
 
     if workspace_details is None:
         # failed to find workspace
@@ -99,6 +193,7 @@ def get_desk_details_from_workspace(name: str, workspace_details: Dict[str, Any]
     return desk_details
 
 
+@traced(attributes=("target_date",))
 def get_desk_for_date(  # pylint: disable=too-many-arguments
     desk_name: str, building_id: str, workspace_id: str, floor: int, target_date: date, auth_token: str
 ) -> Dict[str, Any]:
@@ -110,8 +205,8 @@ def get_desk_for_date(  # pylint: disable=too-many-arguments
         "period": "DAY",
         "floor": floor,
         "workspaceId": workspace_id,
-        "startDate": rfc3339(datetime.combine(target_date, datetime.min.time())),
-        "endDate": rfc3339(datetime.combine(target_date, datetime.max.time())),
+        "startDate": format_rfc3339(datetime.combine(target_date, datetime.min.time())),
+        "endDate": format_rfc3339(datetime.combine(target_date, datetime.max.time())),
     }
     workspace_details_list = query(method="GET", url="/workspaces/availabilities", params=params, auth_token=auth_token)
     if not workspace_details_list:
@@ -126,19 +221,78 @@ def get_desk_for_date(  # pylint: disable=too-many-arguments
     return desk_details
 
 
+@traced()
+def get_desk_for_dates(  # pylint: disable=too-many-arguments
+    desk_name: str,
+    building_id: str,
+    workspace_id: str,
+    floor: int,
+    target_dates: List[date],
+    auth_token: str,
+    max_workers: int = MAX_WORKERS,
+) -> Dict[date, Dict[str, Any]]:
+    """
+    Get desk availabilities for several dates
+
+    API only answers availabilities for one day, dates are queried concurrently
+    Dates that failed are missing from result
+
+    :return: desk details by date
+    """
+
+    def get_desk(target_date: date) -> Dict[str, Any]:
+        return get_desk_for_date(
+            desk_name=desk_name,
+            building_id=building_id,
+            workspace_id=workspace_id,
+            floor=floor,
+            target_date=target_date,
+            auth_token=auth_token,
+        )
+
+    desks = {}
+    if not target_dates:
+        return desks
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(target_dates)))) as executor:
+        futures = {submit_in_context(executor, get_desk, target_date): target_date for target_date in target_dates}
+        for future in as_completed(futures):
+            try:
+                desks[futures[future]] = future.result()
+            except MoffiSdkException as ex:
+                logging.warning(f"Unable to get desk {desk_name} for {futures[future].isoformat()} : {repr(ex)}")
+    return desks
+
+
+@traced(attributes=("workspace",))
 def get_workspace_details(city: str, workspace: str, auth_token: str) -> Dict[str, Any]:
-    """Get all workspace details"""
+    """
+    Get all workspace details
 
+    Building, workspace url and details are kept in metadata cache, a warm call does not query the API
+    """
+
+    metadata_cache = get_metadata_cache()
     building_details = get_building(name=city, auth_token=auth_token)
-    workspace_availabilities = get_workspace_availabilities(
-        name=workspace, building_details=building_details, auth_token=auth_token
-    )
+    cache_key = f"{building_details.get('id')}/{workspace}"
+
+    workspace_details = metadata_cache.get("workspace", cache_key)
+    if workspace_details is not None:
+        return workspace_details
+
+    workspace_url = metadata_cache.get("workspace_url", cache_key)
+    if workspace_url is None:
+        workspace_availabilities = get_workspace_availabilities(
+            name=workspace, building_details=building_details, auth_token=auth_token
+        )
+        workspace_url = workspace_availabilities.get("workspace", {}).get("url")
+        metadata_cache.set("workspace_url", cache_key, workspace_url)
 
     # https://api.moffi.io/api/workspaces/url/coworking/418608-Paris-23-personnes
     workspace_details = query(
         method="GET",
-        url=f"/workspaces/url/{workspace_availabilities.get('workspace', {}).get('url')}",
+        url=f"/workspaces/url/{workspace_url}",
         auth_token=auth_token,
     )
+    metadata_cache.set("workspace", cache_key, workspace_details)
 
     return workspace_details
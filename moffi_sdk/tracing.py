@@ -0,0 +1,176 @@
+"""
+MOFFI tracing
+
+Lightweight spans around SDK steps, with parent/child relationships kept in a context variable, so spans of
+worker threads (see moffi_sdk.utils.submit_in_context) and asyncio tasks are attached to their caller.
+Tracing is off by default, spans are then not recorded at all
+"""
+
+import contextvars
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+TRACING = {"enabled": False}
+
+_CURRENT_SPAN = contextvars.ContextVar("moffi_span", default=None)
+_TRACES: List["Span"] = []
+_LOCK = threading.Lock()
+
+
+class Span:  # pylint: disable=too-many-instance-attributes
+    """A timed step"""
+
+    __slots__ = ("name", "attributes", "start", "end", "parent", "children", "thread_id", "error")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional["Span"]):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.children: List["Span"] = []
+        self.thread_id = threading.get_ident()
+        self.error: Optional[str] = None
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        """Span duration in seconds, up to now if still running"""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def walk(self, depth: int = 0) -> Iterator[Tuple["Span", int]]:
+        """Iterate on span and its descendants, with their depth, children by start time"""
+        yield self, depth
+        for child in sorted(self.children, key=lambda child: child.start):
+            yield from child.walk(depth + 1)
+
+    def __repr__(self) -> str:
+        return f"Span({self.name!r}, {self.duration * 1000:.1f}ms, {len(self.children)} children)"
+
+
+def start_tracing() -> None:
+    """Record next spans, forget previous ones"""
+    with _LOCK:
+        _TRACES.clear()
+    TRACING["enabled"] = True
+
+
+def stop_tracing() -> List[Span]:
+    """Stop recording spans, return root spans recorded since start_tracing"""
+    TRACING["enabled"] = False
+    with _LOCK:
+        traces = list(_TRACES)
+        _TRACES.clear()
+    return traces
+
+
+def current_span() -> Optional[Span]:
+    """Innermost running span, None if not tracing"""
+    return _CURRENT_SPAN.get()
+
+
+@contextmanager
+def span(name: str, /, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Time a block as a child of the current span
+
+    Yield None when tracing is off
+    """
+    if not TRACING["enabled"]:
+        yield None
+        return
+
+    parent = _CURRENT_SPAN.get()
+    new_span = Span(name, attributes, parent)
+    with _LOCK:
+        if parent is not None:
+            parent.children.append(new_span)
+        else:
+            _TRACES.append(new_span)
+    token = _CURRENT_SPAN.set(new_span)
+    try:
+        yield new_span
+    except BaseException as ex:
+        new_span.error = repr(ex)
+        raise
+    finally:
+        new_span.end = time.perf_counter()
+        _CURRENT_SPAN.reset(token)
+
+
+def traced(name: str = None, attributes: Sequence[str] = ()) -> Callable:
+    """
+    Decorator running a function in a span
+
+    :param name: span name, function name by default
+    :param attributes: keyword arguments kept as span attributes
+    """
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACING["enabled"]:
+                return func(*args, **kwargs)
+            with span(span_name, **{key: kwargs.get(key) for key in attributes if key in kwargs}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def format_waterfall(traces: List[Span], width: int = 40) -> str:
+    """
+    Render spans as a text waterfall : start offset, duration, tree of names and a timeline bar
+    """
+    if not traces:
+        return "No span recorded"
+    origin = min(root.start for root in traces)
+    total = max(root.start + root.duration for root in traces) - origin or 1e-9
+    lines = [f"{'start ms':>9} {'duration ms':>11}  {'span':<48} timeline"]
+    for root in traces:
+        for item, depth in root.walk():
+            offset = item.start - origin
+            begin = int(offset / total * width)
+            length = max(1, int(item.duration / total * width))
+            bar_str = " " * begin + "#" * min(length, width - begin)
+            label = "  " * depth + item.name
+            if item.attributes:
+                label += " " + " ".join(f"{key}={value}" for key, value in item.attributes.items())
+            if item.error:
+                label += " !"
+            lines.append(f"{offset * 1000:>9.1f} {item.duration * 1000:>11.1f}  {label[:48]:<48} |{bar_str:<{width}}|")
+    return "\n".join(lines)
+
+
+def to_chrome_trace(traces: List[Span]) -> Dict[str, Any]:
+    """Convert spans to Chrome trace event format, readable by chrome://tracing and Perfetto"""
+    events = []
+    for root in traces:
+        for item, _ in root.walk():
+            args = {key: str(value) for key, value in item.attributes.items()}
+            if item.error:
+                args["error"] = item.error
+            events.append(
+                {
+                    "name": item.name,
+                    "ph": "X",
+                    "ts": item.start * 1e6,
+                    "dur": item.duration * 1e6,
+                    "pid": 1,
+                    "tid": item.thread_id,
+                    "args": args,
+                }
+            )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def dump_chrome_trace(traces: List[Span], path: str) -> None:
+    """Write spans to a Chrome trace JSON file"""
+    with open(path, "w", encoding="utf-8") as trace_file:
+        json.dump(to_chrome_trace(traces), trace_file)
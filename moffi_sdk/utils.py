@@ -1,15 +1,310 @@
 """
 MOFFI Utils methods
 """
-from typing import Any, Dict
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Callable, Dict, Mapping, Optional, Tuple, Union
 from urllib.parse import urlencode
 
-import requests
-from requests.structures import CaseInsensitiveDict
-
+from moffi_sdk.context import CURRENT_CLIENT
 from moffi_sdk.exceptions import RequestException
+from moffi_sdk.metrics import RequestRecord, endpoint_template, record_request
+from moffi_sdk.ratelimit import backoff_delay, get_rate_limiter, parse_retry_after
+from moffi_sdk.request_cache import RequestCache, get_request_cache, is_mutating
+from moffi_sdk.tracing import span
+
+if TYPE_CHECKING:  # pragma: no cover
+    import requests
+
+# requests, urllib3 and dateutil are heavy to import, they are only loaded on first use
+
+# API root, can be overridden with MOFFI_API environment variable, to use a mock server for example
+MOFFI_API = os.environ.get("MOFFI_API", "https://api.moffi.io/api").rstrip("/")
+
+HTTP_METHODS = ["get", "post", "put", "patch", "delete", "head", "options"]
+# only idempotent methods are retried, an order must never be placed twice
+RETRYABLE_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+# rate limited, always retried
+THROTTLED_STATUS = 429
+
+SESSION_SETTINGS = {
+    "pool_connections": 4,
+    "pool_maxsize": 16,
+    "pool_block": False,
+    "timeout": (5.0, 30.0),
+    "retries": 3,
+    "backoff_factor": 0.3,
+    "status_forcelist": (502, 503, 504),
+}
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_api_url() -> str:
+    """Get Moffi API root URL"""
+    return MOFFI_API
+
+
+def set_api_url(url: str) -> None:
+    """Set Moffi API root URL, for all next requests"""
+    global MOFFI_API  # pylint: disable=global-statement
+
+    MOFFI_API = url.rstrip("/")
+
+
+def _build_session(settings: Dict[str, Any]) -> "requests.Session":
+    """Build a pooled session from settings"""
+    import requests  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    from requests.adapters import HTTPAdapter  # pylint: disable=import-outside-toplevel
+    from urllib3.util.retry import Retry  # pylint: disable=import-outside-toplevel
+
+    # connection errors only, retryable status are handled by query with the rate limiter
+    retry = Retry(
+        total=settings.get("retries"),
+        connect=settings.get("retries"),
+        read=settings.get("retries"),
+        status=0,
+        backoff_factor=settings.get("backoff_factor"),
+        allowed_methods=RETRYABLE_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.get("pool_connections"),
+        pool_maxsize=settings.get("pool_maxsize"),
+        pool_block=settings.get("pool_block"),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_session(  # pylint: disable=too-many-arguments
+    pool_connections: Optional[int] = None,
+    pool_maxsize: Optional[int] = None,
+    pool_block: Optional[bool] = None,
+    timeout: Optional[Union[float, Tuple[float, float]]] = None,
+    retries: Optional[int] = None,
+    backoff_factor: Optional[float] = None,
+    status_forcelist: Optional[Tuple[int, ...]] = None,
+) -> "requests.Session":
+    """
+    Configure the shared HTTP session used by all SDK calls
+
+    Only given settings are changed, the current session is closed and replaced
+
+    :param pool_connections: number of connection pools to cache (one per host)
+    :param pool_maxsize: max number of connections kept alive per pool
+    :param pool_block: block when no free connection is available in pool
+    :param timeout: request timeout in seconds, or a (connect, read) tuple
+    :param retries: max retries on connection errors and retryable status, for idempotent methods only
+    :param backoff_factor: exponential backoff factor between retries, when server sends no Retry-After
+    :param status_forcelist: HTTP status to retry, in addition to 429
+    :return: new shared session
+    """
+    global _SESSION  # pylint: disable=global-statement
+
+    new_settings = {
+        "pool_connections": pool_connections,
+        "pool_maxsize": pool_maxsize,
+        "pool_block": pool_block,
+        "timeout": timeout,
+        "retries": retries,
+        "backoff_factor": backoff_factor,
+        "status_forcelist": status_forcelist,
+    }
+    with _SESSION_LOCK:
+        for key, value in new_settings.items():
+            if value is not None:
+                SESSION_SETTINGS[key] = value
+        if _SESSION is not None:
+            _SESSION.close()
+        _SESSION = _build_session(SESSION_SETTINGS)
+        return _SESSION
+
+
+def get_session() -> "requests.Session":
+    """Get the HTTP session of the bound client, or the shared one, create it on first call"""
+    global _SESSION  # pylint: disable=global-statement
+
+    client = CURRENT_CLIENT.get()
+    if client is not None:
+        return client.session
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                _SESSION = _build_session(SESSION_SETTINGS)
+    return _SESSION
+
+
+def get_session_settings() -> Dict[str, Any]:
+    """Get HTTP settings of the bound client, or the shared ones"""
+    client = CURRENT_CLIENT.get()
+    if client is not None:
+        return client.session_settings
+    return SESSION_SETTINGS
+
 
-MOFFI_API = "https://api.moffi.io/api"
+def prepare_request(
+    method: str, url: str, auth_token: str, params: Dict[str, str] = None, headers: Dict[str, str] = None
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Build full URL and headers of an API request
+
+    :return: URL and headers
+    """
+    if not url.startswith(MOFFI_API):
+        if not url.startswith("/"):
+            url = f"/{url}"
+        url = f"{MOFFI_API}{url}"
+
+    if params:
+        url = f"{url}?{urlencode(params)}"
+
+    ciheaders = {}
+    if headers is not None:
+        for key, value in headers.items():
+            if key.lower() not in ("accept", "authorization"):
+                ciheaders[key] = value
+
+    ciheaders["Accept"] = "application/json"
+    ciheaders["Authorization"] = f"Bearer {auth_token}"
+
+    if method.lower() not in HTTP_METHODS:
+        raise RecursionError(f"Unknown method {method}")
+
+    return url, ciheaders
+
+
+def _retries_count(result: "requests.Response") -> int:
+    """Number of retries done by urllib3 for a response"""
+    retries = getattr(result.raw, "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+def _send(  # pylint: disable=too-many-arguments
+    session: "requests.Session",
+    method: str,
+    url: str,
+    headers: Dict[str, str],
+    data: Optional[Dict[str, Any]],
+    account: str,
+    record: RequestRecord,
+) -> "requests.Response":
+    """
+    Send a request through the rate limiter
+
+    Idempotent requests answered with 429 or a retryable 5xx are retried, after Retry-After or an exponential backoff
+    """
+    settings = get_session_settings()
+    retry_status = {THROTTLED_STATUS, *settings.get("status_forcelist", ())}
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        throttled = None
+        if limiter.enabled:
+            limiter.acquire(account)
+        try:
+            result = session.request(
+                method=method, url=url, headers=headers, json=data, timeout=settings.get("timeout")
+            )
+            record.retries += _retries_count(result)
+            throttled = result.status_code in retry_status
+        finally:
+            if limiter.enabled:
+                limiter.release(throttled=throttled)
+
+        if not throttled:
+            return result
+        retry_after = parse_retry_after(result.headers.get("Retry-After"))
+        if limiter.enabled:
+            limiter.throttled(account, retry_after)
+        if method not in RETRYABLE_METHODS or attempt >= settings.get("retries"):
+            return result
+
+        delay = backoff_delay(attempt, settings.get("backoff_factor"), retry_after)
+        logging.debug(f"{method} {record.endpoint} answered {result.status_code}, retry in {delay:.2f}s")
+        attempt += 1
+        record.retries += 1
+        time.sleep(delay)
+
+
+def _fetch(  # pylint: disable=too-many-arguments,too-many-locals
+    method: str,
+    url: str,
+    endpoint: str,
+    headers: Dict[str, str],
+    data: Optional[Dict[str, Any]],
+    auth_token: str,
+    renew_token: bool,
+) -> "requests.Response":
+    """
+    Send a request, with metrics and tracing, see query
+
+    :return: response, whatever its status
+    :raise: RequestException on network errors
+    """
+    import requests  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    client = CURRENT_CLIENT.get()
+    session = get_session()
+    record = RequestRecord(method=method, endpoint=endpoint, status=None, duration=0.0)
+    with span(f"{record.method} {record.endpoint}") as http_span:
+        start = time.perf_counter()
+        try:
+            result = _send(session, method, url, headers, data, account=auth_token, record=record)
+            if result.status_code == 401 and renew_token:
+                # token may have expired, re-authenticate once with cached credentials
+                from moffi_sdk.auth import get_token_cache  # pylint: disable=import-outside-toplevel,cyclic-import
+
+                new_token = get_token_cache().renew(auth_token)
+                if new_token:
+                    headers["Authorization"] = f"Bearer {new_token}"
+                    record.retries += 1
+                    result = _send(session, method, url, headers, data, account=new_token, record=record)
+        except requests.exceptions.RequestException as ex:
+            record.duration = time.perf_counter() - start
+            record_request(record)
+            if client is not None:
+                client.record_request(method=method, url=url, status=None, duration=record.duration)
+            raise RequestException from ex
+
+    record.duration = time.perf_counter() - start
+    record.status = result.status_code
+    record.response_size = len(result.content)
+    record_request(record)
+    if http_span is not None:
+        http_span.attributes["status"] = result.status_code
+    if client is not None:
+        client.record_request(method=method, url=url, status=result.status_code, duration=record.duration)
+    return result
+
+
+def _content(result: "requests.Response") -> bytes:
+    """
+    Body of a successful response
+
+    :raise: RequestException on error status
+    """
+    if result.status_code > 399:
+        raise RequestException(f"Request error {result.status_code} {result.text}")
+    return result.content
+
+
+def _fetch_memoized(cache: RequestCache, key: Tuple[str, str], *args) -> bytes:
+    """Fetch a response body and store it, see _fetch"""
+    generation = cache.generation(key[1])
+    content = _content(_fetch(*args))
+    cache.set(key, content, generation)
+    return content
 
 
 def query(  # pylint: disable=too-many-arguments
@@ -19,45 +314,96 @@ def query(  # pylint: disable=too-many-arguments
     params: Dict[str, str] = None,
     headers: Dict[str, str] = None,
     data: Dict[str, Any] = None,
+    renew_token: bool = True,
 ) -> Dict[str, Any]:
     """
     Query Moffi API
 
+    Identical GET requests are coalesced while in flight and memoized for a short time, requests changing orders
+    forget memoized responses of their token, see moffi_sdk.request_cache
+
     :param method: Used method (GET, POST, OPTIONS…)
     :param url: Moffi endpoint URL
     :param auth_token: Authentication token
     :param headers: custom headers
     :param data: body data
+    :param renew_token: on 401, renew a cached token and retry once
     :return: Json response
     :raise: RequestException
     """
 
-    if not url.startswith(MOFFI_API):
-        if not url.startswith("/"):
-            url = f"/{url}"
-        url = f"{MOFFI_API}{url}"
+    url, ciheaders = prepare_request(method=method, url=url, auth_token=auth_token, params=params, headers=headers)
+    method = method.upper()
+    endpoint = endpoint_template(url, MOFFI_API)
+    args = (method, url, endpoint, ciheaders, data, auth_token, renew_token)
 
-    if params:
-        url = f"{url}?{urlencode(params)}"
+    cache = get_request_cache()
+    if cache is not None and method == "GET" and not headers:
+        key = (url, auth_token)
+        content = cache.get(key)
+        if content is None:
+            content = cache.flights.do(key, _fetch_memoized, cache, key, *args)
+        # parse on each call, callers may change their result
+        return json.loads(content)
 
-    ciheaders = CaseInsensitiveDict()
-    if headers is not None:
-        for key, value in headers.items():
-            ciheaders[key] = value
+    try:
+        return json.loads(_content(_fetch(*args)))
+    finally:
+        # even a failed request may have changed orders
+        if cache is not None and is_mutating(method, endpoint):
+            cache.invalidate(auth_token)
 
-    ciheaders["Accept"] = "application/json"
-    ciheaders["Authorization"] = f"Bearer {auth_token}"
 
-    if method.lower() not in requests.__dict__:
-        raise RecursionError(f"Unknown method {method}")
-    method = requests.__dict__[method.lower()]
+def query_headers(method: str, url: str, auth_token: str, params: Dict[str, str] = None) -> Mapping[str, str]:
+    """
+    Query Moffi API for response headers only, whatever the response status, like Date of a HEAD request
+
+    Request is rate limited, counted and traced like query ones, but never memoized
+
+    :return: case insensitive response headers
+    :raise: RequestException on network errors
+    """
+    url, ciheaders = prepare_request(method=method, url=url, auth_token=auth_token, params=params)
+    method = method.upper()
+    result = _fetch(method, url, endpoint_template(url, MOFFI_API), ciheaders, None, auth_token, False)
+    return result.headers
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parse an ISO 8601 datetime from API
 
+    Use fast standard library parser, dateutil only for formats it does not support
+    """
     try:
-        result = method(url=url, headers=ciheaders, json=data)
-    except requests.exceptions.RequestException as ex:
-        raise RequestException from ex
+        if value.endswith("Z"):
+            return datetime.fromisoformat(f"{value[:-1]}+00:00")
+        return datetime.fromisoformat(value)
+    except ValueError:
+        from dateutil import parser as dateparser  # pylint: disable=import-outside-toplevel
 
-    if result.status_code > 399:
-        raise RequestException(f"Request error {result.status_code} {result.text}")
+        return dateparser.parse(value)
+
+
+def format_rfc3339(value: datetime, utc: bool = False) -> str:
+    """
+    Format a datetime as RFC 3339, to the second
+
+    Naive datetimes are in local timezone
 
-    return result.json()
+    :param utc: convert to UTC, with Z suffix
+    """
+    if value.tzinfo is None:
+        value = value.astimezone()
+    if utc:
+        return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return value.replace(microsecond=0).isoformat()
+
+
+def submit_in_context(executor: Executor, func: Callable, *args, **kwargs) -> Future:
+    """
+    Submit a function to an executor, running in a copy of the caller context
+
+    Keep context dependent state, like building timezone, in worker threads
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
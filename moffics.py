@@ -9,21 +9,41 @@ Return as ICS datas
 
 import argparse
 import base64
+import hashlib
 import json
 import sys
-from typing import List
-
-from Crypto.Cipher import AES
-from flask import Flask, Response, abort, make_response, request
-from ics import Calendar, Event
-
-from moffi_sdk.auth import get_auth_token, signin
-from moffi_sdk.reservations import ReservationItem, get_reservations
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from flask import Flask, Response, abort, g, make_response, request
+
+from moffi_sdk.auth import TOKEN_CACHE, credentials_digest, get_auth_token
+from moffi_sdk.exceptions import AuthenticationException
+from moffi_sdk.ics_writer import iter_calendar, reservation_uid, serialize_calendar
+from moffi_sdk.metrics import METRICS, MetricsRegistry, RequestRecord
+from moffi_sdk.request_cache import get_request_cache
+from moffi_sdk.reservations import ReservationItem, get_reservations, iter_reservations
+from moffi_sdk.singleflight import SingleFlight
 from utils import ConfigError, parse_config
 
 APP = Flask(__name__)
 
-MOFFI_API = "https://api.moffi.io/api"
+DEFAULT_CACHE_TTL = 300
+DEFAULT_MAX_STALE = 3600
+DEFAULT_MAX_USERS = 1000
+DEFAULT_REFRESH_INTERVAL = 60
+DEFAULT_SERVER = "waitress"
+DEFAULT_THREADS = 16
+DEFAULT_CONNECTION_LIMIT = 100
+DEFAULT_MAX_UPSTREAM = 8
+DEFAULT_ICS_WRITER = "stream"
+# users who did not fetch their calendar for this long are not refreshed in background
+DEFAULT_ACTIVE_WINDOW = 86400
 
 
 def encrypt(message: str, key: bytes) -> str:
@@ -31,6 +51,8 @@ def encrypt(message: str, key: bytes) -> str:
     Encrypt a message with AES256
     Return as base64 urlsafe string
     """
+    from Crypto.Cipher import AES  # pylint: disable=import-outside-toplevel
+
     cipher = AES.new(key, AES.MODE_EAX)
     ciphertext, tag = cipher.encrypt_and_digest(message.encode("utf-8"))
 
@@ -46,6 +68,8 @@ def decrypt(message: str, key: bytes) -> str:
     """
     Decrypt a base64 urlsafe encrypted AES256 message
     """
+    from Crypto.Cipher import AES  # pylint: disable=import-outside-toplevel
+
     bmsg = message.encode("utf-8")
     padding = b"=" * (4 - (len(bmsg) % 4))
     datas = json.loads(base64.urlsafe_b64decode(bmsg + padding))
@@ -56,13 +80,16 @@ def decrypt(message: str, key: bytes) -> str:
     return cipher.decrypt_and_verify(ciphertext, tag).decode("utf-8")
 
 
-def generate_calendar(events: List[ReservationItem]) -> Calendar:
+def generate_calendar(events: List[ReservationItem]) -> "Calendar":
     """
-    Generate an ICS Calendar from a list of events
+    Generate an ICS Calendar from a list of events, with ics library
     """
+    from ics import Calendar, Event  # pylint: disable=import-outside-toplevel
+
     cal = Calendar()
     for item in events:
         event = Event()
+        event.uid = reservation_uid(item)
         event.name = f"{item.workspace_name} - {item.desk_name}" if item.desk_name else item.workspace_name
         event.begin = item.start.isoformat()
         event.end = item.end.isoformat()
@@ -72,22 +99,280 @@ def generate_calendar(events: List[ReservationItem]) -> Calendar:
     return cal
 
 
-def get_ics_from_moffi(token: str) -> Response:
+@dataclass
+class CalendarEntry:  # pylint: disable=too-many-instance-attributes
+    """Rendered calendar in cache"""
+
+    body: bytes
+    etag: str
+    last_modified: datetime
+    fetched_at: float
+    username: str
+    last_access: float
+    last_error: Optional[str] = None
+    refreshing: bool = False
+
+    def age(self, now: float = None) -> float:
+        """Seconds since calendar was fetched from Moffi"""
+        if now is None:
+            now = time.time()
+        return now - self.fetched_at
+
+
+class CalendarCache:
+    """
+    Per-user cache of rendered calendars
+
+    Users are identified by a digest of their credentials, so a wrong password never gets a cached calendar.
+    Expired calendars are still served for max_stale seconds while they are refreshed in background,
+    at most max_users calendars are kept, least recently used first evicted.
+    """
+
+    def __init__(
+        self,
+        ttl: int = DEFAULT_CACHE_TTL,
+        max_stale: int = DEFAULT_MAX_STALE,
+        max_users: int = DEFAULT_MAX_USERS,
+    ):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_users = max_users
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "not_modified": 0, "refreshes": 0, "refresh_errors": 0}
+        self._entries: "OrderedDict[str, CalendarEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[Optional[CalendarEntry], bool]:
+        """
+        Return calendar for user, and if it is still fresh
+
+        Return (None, False) if missing or older than staleness bound
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.age(now) < self.ttl + self.max_stale:
+                self._entries.move_to_end(key)
+                entry.last_access = now
+                if entry.age(now) < self.ttl:
+                    self.stats["hits"] += 1
+                    return entry, True
+                self.stats["stale_hits"] += 1
+                return entry, False
+            self.stats["misses"] += 1
+            return None, False
+
+    def set(self, key: str, body: bytes, username: str) -> CalendarEntry:
+        """Store a rendered calendar, keep its modification date if content did not change"""
+        etag = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(key)
+            last_access = now
+            if previous is not None:
+                last_access = previous.last_access
+            if previous is not None and previous.etag == etag:
+                last_modified = previous.last_modified
+            else:
+                last_modified = datetime.fromtimestamp(int(now), tz=timezone.utc)
+            entry = CalendarEntry(
+                body=body,
+                etag=etag,
+                last_modified=last_modified,
+                fetched_at=now,
+                username=username,
+                last_access=last_access,
+            )
+            if self.ttl > 0:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+            return entry
+
+    def start_refresh(self, key: str) -> Optional[str]:
+        """
+        Mark a calendar as refreshing
+
+        Return username to refresh, None if unknown or already refreshing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refreshing:
+                return None
+            entry.refreshing = True
+            return entry.username
+
+    def end_refresh(self, key: str, error: Exception = None) -> None:
+        """Mark a refresh as done, keep stale calendar on error"""
+        with self._lock:
+            self.stats["refreshes"] += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refreshing = False
+            if error is not None:
+                self.stats["refresh_errors"] += 1
+                entry.last_error = repr(error)
+
+    def keys_to_refresh(self, horizon: float, active_window: float) -> List[str]:
+        """Calendars of recently active users that will expire within horizon seconds"""
+        now = time.time()
+        with self._lock:
+            return [
+                key
+                for key, entry in self._entries.items()
+                if now - entry.last_access < active_window and entry.age(now) + horizon >= self.ttl
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def count_not_modified(self) -> None:
+        """Count a conditional request answered with 304"""
+        with self._lock:
+            self.stats["not_modified"] += 1
+
+
+class CalendarRefresher:
+    """
+    Keep calendars of active users warm in background
+    """
+
+    def __init__(self, cache: CalendarCache, interval: int = DEFAULT_REFRESH_INTERVAL, workers: int = 4):
+        self.cache = cache
+        self.interval = interval
+        self.active_window = DEFAULT_ACTIVE_WINDOW
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="moffics-refresh")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self, key: str) -> None:
+        """Refresh a calendar in background, if not already refreshing"""
+        username = self.cache.start_refresh(key)
+        if username is not None:
+            self._executor.submit(self._refresh, key, username)
+
+    def _refresh(self, key: str, username: str) -> None:
+        try:
+            FLIGHTS.do(key, self._fetch, key, username)
+            self.cache.end_refresh(key)
+        except Exception as ex:  # pylint: disable=broad-except
+            APP.logger.warning(f"Unable to refresh calendar of {username}, keep serving stale one : {repr(ex)}")
+            self.cache.end_refresh(key, error=ex)
+
+    def _fetch(self, key: str, username: str) -> CalendarEntry:
+        token = TOKEN_CACHE.token_for(username)
+        if token is None:
+            raise AuthenticationException(f"No valid credentials in cache for {username}")
+        return self.cache.set(key, render_ics_from_moffi(token=token), username=username)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            for key in self.cache.keys_to_refresh(horizon=self.interval, active_window=self.active_window):
+                self.refresh(key)
+
+    def start(self) -> None:
+        """Start periodic refresh of active users calendars"""
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="moffics-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop periodic refresh"""
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+
+
+# "stream" for moffi_sdk.ics_writer, "ics" for ics library
+ICS_WRITER = {"name": DEFAULT_ICS_WRITER}
+CALENDAR_CACHE = CalendarCache()
+REFRESHER = CalendarRefresher(CALENDAR_CACHE)
+# concurrent fetches of the same calendar share a single Moffi round trip
+FLIGHTS = SingleFlight()
+# max concurrent fetches from Moffi, other requests wait for a free slot
+UPSTREAM_SLOTS = {"semaphore": threading.BoundedSemaphore(DEFAULT_MAX_UPSTREAM)}
+# duration of moffics routes, Moffi API requests are in moffi_sdk.metrics.METRICS
+ROUTE_METRICS = MetricsRegistry(subject="moffics")
+
+
+def render_ics_from_moffi(token: str) -> bytes:
     """
     Get all reservations from moffi
-    Return a flask responce object
+    Return rendered ICS calendar
     """
     if not token:
         abort(500, "missing token in user profile")
 
-    reservations = get_reservations(auth_token=token, steps=["waiting", "inProgress"])
+    with UPSTREAM_SLOTS["semaphore"]:
+        reservations = get_reservations(auth_token=token, steps=["waiting", "inProgress"])
+
+    if ICS_WRITER.get("name") == "ics":
+        return generate_calendar(reservations).serialize().encode("utf-8")
+    return serialize_calendar(reservations).encode("utf-8")
+
 
-    calendar = generate_calendar(reservations)
-    response = make_response(calendar.serialize(), 200)
+def calendar_response(entry: CalendarEntry) -> Response:
+    """
+    Build a flask response from a calendar entry
+    Answer 304 to conditional requests if calendar did not change
+    """
+    response = make_response(entry.body, 200)
     response.mimetype = "text/html"
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.cache_control.private = True
+    response.cache_control.max_age = max(0, int(CALENDAR_CACHE.ttl - entry.age()))
+    response.make_conditional(request)
+    if response.status_code == 304:
+        CALENDAR_CACHE.count_not_modified()
+    return response
+
+
+def stream_ics_from_moffi(token: str) -> Response:
+    """
+    Stream user calendar, events are sent page by page as reservations are fetched from Moffi
+    """
+    if not token:
+        abort(500, "missing token in user profile")
+
+    def generate():
+        with UPSTREAM_SLOTS["semaphore"]:
+            reservations = iter_reservations(auth_token=token, steps=["waiting", "inProgress"])
+            for chunk in iter_calendar(reservations):
+                yield chunk.encode("utf-8")
+
+    response = Response(generate(), mimetype="text/html")
+    response.cache_control.no_store = True
     return response
 
 
+def fetch_calendar(key: str, username: str, password: str) -> CalendarEntry:
+    """Fetch user calendar from Moffi and store it in cache"""
+    token = get_auth_token(username=username, password=password)
+    return CALENDAR_CACHE.set(key, render_ics_from_moffi(token=token), username=username)
+
+
+def get_ics_from_moffi(username: str, password: str) -> Response:
+    """
+    Get user calendar, from cache if still fresh
+    A stale calendar is served immediately while refreshed in background
+    Return a flask responce object
+    """
+    if CALENDAR_CACHE.ttl <= 0 and ICS_WRITER.get("name") != "ics":
+        # nothing to cache, stream calendar while reservations are fetched
+        return stream_ics_from_moffi(token=get_auth_token(username=username, password=password))
+
+    key = credentials_digest(username, password)
+    entry, fresh = CALENDAR_CACHE.get(key)
+    if entry is None:
+        entry = FLIGHTS.do(key, fetch_calendar, key, username, password)
+    elif not fresh:
+        REFRESHER.refresh(key)
+
+    return calendar_response(entry)
+
+
 @APP.route("/")
 def get_with_basicauth():
     """
@@ -98,9 +383,7 @@ def get_with_basicauth():
         abort(401, "missing authentication")
     APP.logger.debug(f"Login : {auth.username}")  # pylint: disable=no-member
 
-    token = get_auth_token(username=auth.username, password=auth.password)
-
-    return get_ics_from_moffi(token=token)
+    return get_ics_from_moffi(username=auth.username, password=auth.password)
 
 
 @APP.route("/getToken")
@@ -117,7 +400,7 @@ def generate_token():
     APP.logger.debug(f"Login : {auth.username}")  # pylint: disable=no-member
 
     # ensure auth is legitimate
-    signin(username=auth.username, password=auth.password)
+    get_auth_token(username=auth.username, password=auth.password)
 
     message = json.dumps({"login": auth.username, "password": auth.password})
     token = encrypt(message, APP.config.get("secret_key"))
@@ -135,9 +418,103 @@ def get_with_token(token: str):
     jauth = json.loads(authent)
     APP.logger.debug(f"Login : {jauth.get('login')}")  # pylint: disable=no-member
 
-    moffi_token = get_auth_token(username=jauth.get("login"), password=jauth.get("password"))
+    return get_ics_from_moffi(username=jauth.get("login"), password=jauth.get("password"))
+
+
+@APP.route("/cache/stats")
+def get_cache_stats():
+    """
+    Calendar cache counters
+    """
+    stats = dict(CALENDAR_CACHE.stats)
+    stats["upstream_fetches"] = FLIGHTS.stats["calls"]
+    stats["coalesced"] = FLIGHTS.stats["shared"]
+    return stats
+
+
+@APP.before_request
+def start_request_timer():
+    """Remember request start, for route metrics"""
+    g.request_start = time.perf_counter()
+
+
+@APP.after_request
+def record_request_duration(response: Response) -> Response:
+    """Count request in route metrics, by route rule so tokens never end up in labels"""
+    start = g.get("request_start")
+    if start is not None:
+        ROUTE_METRICS.record(
+            RequestRecord(
+                method=request.method,
+                endpoint=request.url_rule.rule if request.url_rule is not None else "unmatched",
+                status=response.status_code,
+                duration=time.perf_counter() - start,
+                response_size=response.content_length or 0,
+            )
+        )
+    return response
 
-    return get_ics_from_moffi(token=moffi_token)
+
+def render_cache_metrics() -> str:
+    """Calendar cache and upstream metrics in Prometheus text format"""
+    lines = [
+        "# HELP moffics_calendar_cache_events_total Calendar cache events",
+        "# TYPE moffics_calendar_cache_events_total counter",
+    ]
+    for event, count in sorted(dict(CALENDAR_CACHE.stats).items()):
+        lines.append(f'moffics_calendar_cache_events_total{{event="{event}"}} {count}')
+    lines.extend(
+        [
+            "# HELP moffics_calendar_cache_entries Calendars in cache",
+            "# TYPE moffics_calendar_cache_entries gauge",
+            f"moffics_calendar_cache_entries {len(CALENDAR_CACHE)}",
+            "# HELP moffics_upstream_fetches_total Calendar fetches from Moffi",
+            "# TYPE moffics_upstream_fetches_total counter",
+            f"moffics_upstream_fetches_total {FLIGHTS.stats['calls']}",
+            "# HELP moffics_coalesced_requests_total Requests served by a fetch already in flight",
+            "# TYPE moffics_coalesced_requests_total counter",
+            f"moffics_coalesced_requests_total {FLIGHTS.stats['shared']}",
+            "# HELP moffi_request_cache_events_total Memoized Moffi API GET requests events",
+            "# TYPE moffi_request_cache_events_total counter",
+        ]
+    )
+    request_cache = get_request_cache()
+    if request_cache is not None:
+        events = dict(request_cache.stats, coalesced=request_cache.flights.stats["shared"])
+        for event, count in sorted(events.items()):
+            lines.append(f'moffi_request_cache_events_total{{event="{event}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+@APP.route("/metrics")
+def get_metrics():
+    """
+    Prometheus metrics : Moffi API requests, moffics routes and calendar cache
+    """
+    body = METRICS.render_prometheus() + ROUTE_METRICS.render_prometheus(prefix="moffics_http") + render_cache_metrics()
+    return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def serve(conf: dict) -> None:
+    """
+    Serve APP with a production WSGI server, or with flask development server
+    """
+    if conf.get("server") == "waitress":
+        try:
+            from waitress import serve as waitress_serve  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            APP.logger.warning("waitress is not installed, using flask development server (pip install waitress)")
+        else:
+            waitress_serve(
+                APP,
+                host=conf.get("listen"),
+                port=int(conf.get("port")),
+                threads=conf.get("threads"),
+                connection_limit=conf.get("connection_limit"),
+                ident="moffics",
+            )
+            return
+    APP.run(host=conf.get("listen"), port=conf.get("port"), debug=conf.get("verbose"), threaded=True)
 
 
 if __name__ == "__main__":
@@ -150,12 +527,116 @@ if __name__ == "__main__":
         "-s",
         help="Secret key for token auth",
     )
+    PARSER.add_argument(
+        "--cache-ttl",
+        dest="cache_ttl",
+        help=f"Seconds a rendered calendar is served without asking Moffi, 0 to disable (default {DEFAULT_CACHE_TTL})",
+    )
+    PARSER.add_argument(
+        "--max-stale",
+        dest="max_stale",
+        help=f"Seconds an expired calendar is still served while refreshed (default {DEFAULT_MAX_STALE})",
+    )
+    PARSER.add_argument(
+        "--max-users",
+        dest="max_users",
+        help=f"Max number of calendars kept in cache (default {DEFAULT_MAX_USERS})",
+    )
+    PARSER.add_argument(
+        "--refresh-interval",
+        dest="refresh_interval",
+        help=f"Seconds between background refreshes of active users, 0 to disable (default {DEFAULT_REFRESH_INTERVAL})",
+    )
+    PARSER.add_argument(
+        "--server",
+        choices=["waitress", "flask"],
+        help=f"WSGI server, flask is the development server (default {DEFAULT_SERVER})",
+    )
+    PARSER.add_argument(
+        "--threads",
+        type=int,
+        help=f"Worker threads handling requests, with waitress (default {DEFAULT_THREADS})",
+    )
+    PARSER.add_argument(
+        "--connection-limit",
+        dest="connection_limit",
+        type=int,
+        help=f"Max simultaneous client connections, with waitress (default {DEFAULT_CONNECTION_LIMIT})",
+    )
+    PARSER.add_argument(
+        "--max-upstream",
+        dest="max_upstream",
+        type=int,
+        help=f"Max calendars fetched from Moffi at the same time (default {DEFAULT_MAX_UPSTREAM})",
+    )
+    PARSER.add_argument(
+        "--ics-writer",
+        dest="ics_writer",
+        choices=["stream", "ics"],
+        help=f"Calendar serializer, stream is built in, ics needs ics library (default {DEFAULT_ICS_WRITER})",
+    )
     PARSER.add_argument("--config", help="Config file")
     CONFIG_TEMPLATE = {
         "verbose": {"section": "Logging", "key": "Verbose", "mandatory": False, "default_value": False},
         "listen": {"section": "Moffics", "key": "Listen", "mandatory": True, "default_value": "0.0.0.0"},
         "port": {"section": "Moffics", "key": "Port", "mandatory": True, "default_value": "8888"},
         "secret": {"section": "Moffics", "key": "Secret", "mandatory": False},
+        "cache_ttl": {
+            "section": "Moffics",
+            "key": "Cache TTL",
+            "mandatory": False,
+            "default_value": DEFAULT_CACHE_TTL,
+            "formatter": int,
+        },
+        "max_stale": {
+            "section": "Moffics",
+            "key": "Max Stale",
+            "mandatory": False,
+            "default_value": DEFAULT_MAX_STALE,
+            "formatter": int,
+        },
+        "max_users": {
+            "section": "Moffics",
+            "key": "Max Users",
+            "mandatory": False,
+            "default_value": DEFAULT_MAX_USERS,
+            "formatter": int,
+        },
+        "refresh_interval": {
+            "section": "Moffics",
+            "key": "Refresh Interval",
+            "mandatory": False,
+            "default_value": DEFAULT_REFRESH_INTERVAL,
+            "formatter": int,
+        },
+        "server": {"section": "Moffics", "key": "Server", "mandatory": False, "default_value": DEFAULT_SERVER},
+        "threads": {
+            "section": "Moffics",
+            "key": "Threads",
+            "mandatory": False,
+            "default_value": DEFAULT_THREADS,
+            "formatter": int,
+        },
+        "connection_limit": {
+            "section": "Moffics",
+            "key": "Connection Limit",
+            "mandatory": False,
+            "default_value": DEFAULT_CONNECTION_LIMIT,
+            "formatter": int,
+        },
+        "max_upstream": {
+            "section": "Moffics",
+            "key": "Max Upstream",
+            "mandatory": False,
+            "default_value": DEFAULT_MAX_UPSTREAM,
+            "formatter": int,
+        },
+        "ics_writer": {
+            "section": "Moffics",
+            "key": "Ics Writer",
+            "mandatory": False,
+            "default_value": DEFAULT_ICS_WRITER,
+        },
     }
     try:  # pylint: disable=R0801
         CONF = parse_config(argv=PARSER.parse_args(), config_template=CONFIG_TEMPLATE)
@@ -170,4 +651,12 @@ if __name__ == "__main__":
             sys.exit(1)
         APP.config["secret_key"] = CONF.get("secret").encode("utf-8")
 
-    APP.run(host=CONF.get("listen"), port=CONF.get("port"), debug=CONF.get("verbose"))
+    ICS_WRITER["name"] = CONF.get("ics_writer")
+    CALENDAR_CACHE.ttl = CONF.get("cache_ttl")
+    CALENDAR_CACHE.max_stale = CONF.get("max_stale")
+    CALENDAR_CACHE.max_users = CONF.get("max_users")
+    REFRESHER.interval = CONF.get("refresh_interval")
+    UPSTREAM_SLOTS["semaphore"] = threading.BoundedSemaphore(max(1, CONF.get("max_upstream")))
+    REFRESHER.start()
+
+    serve(CONF)
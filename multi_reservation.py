@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+Moffi multi-account auto-reservation main program
+"""
+import argparse
+import os
+import sys
+from configparser import ConfigParser
+from typing import List
+
+from moffi_sdk.cache import METADATA_CACHE
+from moffi_sdk.runner import MAX_WORKERS, AccountConfig, format_report, run_accounts
+from utils import format_working_days, setup_logging
+
+ACCOUNT_SECTION_PREFIX = "Account "
+ACCOUNT_KEYS = {"user": "User", "password": "Password", "city": "City", "workspace": "Workspace", "desk": "Desk"}
+# keys read from [Auth] section, never from [Reservation]
+CREDENTIAL_KEYS = ("user", "password")
+
+
+def parse_accounts(config_ini: ConfigParser) -> List[AccountConfig]:
+    """
+    Read accounts from [Account <name>] sections
+
+    Missing credentials are taken from [Auth] section, other missing keys from [Reservation] section
+    """
+    reservation = config_ini["Reservation"] if config_ini.has_section("Reservation") else {}
+    auth = config_ini["Auth"] if config_ini.has_section("Auth") else {}
+    defaults = {key: value for key, value in reservation.items() if key not in CREDENTIAL_KEYS}
+    defaults.update({key: auth[key] for key in CREDENTIAL_KEYS if key in auth})
+    accounts = []
+    for section in config_ini.sections():
+        if not section.startswith(ACCOUNT_SECTION_PREFIX):
+            continue
+        name = section[len(ACCOUNT_SECTION_PREFIX) :]
+        settings = dict(defaults)
+        settings.update(config_ini[section])
+
+        values = {}
+        for key, fkey in ACCOUNT_KEYS.items():
+            if fkey.lower() not in settings:
+                raise ValueError(f"Missing configuration value {fkey} for account {name}")
+            values[key] = settings[fkey.lower()]
+        work_days = settings.get("working days")
+        accounts.append(
+            AccountConfig(
+                name=name,
+                parking=settings.get("parking"),
+                work_days=format_working_days(work_days) if work_days else None,
+                **values,
+            )
+        )
+    return accounts
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument("--verbose", "-v", action="store_true", help="More verbose")
+    PARSER.add_argument("--config", help="Config file path", default=f"{os.environ.get('HOME')}/.config/moffi.ini")
+    PARSER.add_argument("--workers", type=int, help=f"Accounts processed at the same time (default {MAX_WORKERS})")
+    PARSER.add_argument(
+        "--scan",
+        action="store_true",
+        default=None,
+        help="Fetch availabilities of all bookable dates at once instead of day by day",
+    )
+    PARSER.add_argument(
+        "--refresh-metadata",
+        dest="refresh_metadata",
+        action="store_true",
+        help="Ignore cached buildings and workspaces, fetch them again",
+    )
+    ARGS = PARSER.parse_args()
+
+    CONFIG_INI = ConfigParser()
+    if not CONFIG_INI.read(ARGS.config):
+        sys.stderr.write(f"error: config file {ARGS.config} not found\n")
+        sys.exit(2)
+    RUNNER = CONFIG_INI["Runner"] if CONFIG_INI.has_section("Runner") else {}
+    setup_logging({"verbose": ARGS.verbose or RUNNER.get("Verbose", "").lower() in ("1", "true", "yes", "on")})
+
+    try:
+        ACCOUNTS = parse_accounts(CONFIG_INI)
+    except ValueError as ex:
+        sys.stderr.write(f"error: {str(ex)}\n")
+        sys.exit(2)
+    if not ACCOUNTS:
+        sys.stderr.write(f"error: no [{ACCOUNT_SECTION_PREFIX}<name>] section in {ARGS.config}\n")
+        sys.exit(2)
+
+    if ARGS.refresh_metadata:
+        METADATA_CACHE.invalidate()
+
+    RESULTS = run_accounts(
+        ACCOUNTS,
+        max_workers=ARGS.workers or int(RUNNER.get("Workers", MAX_WORKERS)),
+        scan=ARGS.scan if ARGS.scan is not None else RUNNER.get("Scan", "").lower() in ("1", "true", "yes", "on"),
+    )
+    print(format_report(RESULTS))
+    sys.exit(0 if all(result.success for result in RESULTS) else 1)
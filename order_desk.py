@@ -8,11 +8,13 @@ Main program
 import sys
 
 from moffi_sdk.auth import get_auth_token
+from moffi_sdk.cache import METADATA_CACHE
 from moffi_sdk.order import order_desk, order_parking
 from utils import (  # pylint: disable=R0801
     DEFAULT_CONFIG_RESERVATION_TEMPLATE,
     ConfigError,
     parse_config,
+    profile_run,
     setup_logging,
     setup_reservation_parser,
 )
@@ -31,19 +33,23 @@ if __name__ == "__main__":
 
     setup_logging(CONF)
 
-    TOKEN = get_auth_token(username=CONF.get("user"), password=CONF.get("password"))
-    order_desk(
-        desk=CONF.get("desk"),
-        city=CONF.get("city"),
-        workspace=CONF.get("workspace"),
-        order_date=CONF.get("date"),
-        auth_token=TOKEN,
-    )
-
-    if CONF.get("parking"):
-        order_parking(
+    if CONF.get("refresh_metadata"):
+        METADATA_CACHE.invalidate()
+
+    with profile_run(CONF):
+        TOKEN = get_auth_token(username=CONF.get("user"), password=CONF.get("password"))
+        order_desk(
+            desk=CONF.get("desk"),
             city=CONF.get("city"),
-            parking=CONF.get("parking"),
+            workspace=CONF.get("workspace"),
             order_date=CONF.get("date"),
             auth_token=TOKEN,
         )
+
+        if CONF.get("parking"):
+            order_parking(
+                city=CONF.get("city"),
+                parking=CONF.get("parking"),
+                order_date=CONF.get("date"),
+                auth_token=TOKEN,
+            )
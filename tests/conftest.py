@@ -0,0 +1,61 @@
+"""
+Shared fixtures : a local mock of Moffi API, and SDK state isolated between tests
+"""
+
+from datetime import timezone
+from typing import Callable, List
+
+import pytest
+
+from benchmarks.mock_server import MockMoffi, MockServer
+from moffi_sdk import utils
+from moffi_sdk.auth import TOKEN_CACHE
+from moffi_sdk.cache import METADATA_CACHE
+from moffi_sdk.request_cache import get_request_cache
+from moffi_sdk.spaces import BUILDING_TIMEZONE
+
+USERNAME = "user@example.com"
+PASSWORD = "secret"
+
+
+@pytest.fixture(autouse=True)
+def sdk_state(tmp_path, monkeypatch):
+    """
+    Restore API root, HTTP settings and building timezone changed by a test, forget cached tokens and responses
+
+    Metadata cache is kept in a temporary file, user cache is never read nor written
+    """
+    monkeypatch.setattr(METADATA_CACHE, "path", str(tmp_path / "metadata.json"))
+    monkeypatch.setattr(METADATA_CACHE, "_entries", None)
+    monkeypatch.setitem(BUILDING_TIMEZONE, "tz", timezone.utc)
+    api_url = utils.get_api_url()
+    session_settings = dict(utils.SESSION_SETTINGS)
+    yield
+    utils.set_api_url(api_url)
+    utils.configure_session(**session_settings)
+    TOKEN_CACHE.invalidate()
+    # mock servers may reuse a port and hand out the same tokens
+    if get_request_cache() is not None:
+        get_request_cache().invalidate()
+
+
+@pytest.fixture
+def serve_mock() -> Callable[..., MockServer]:
+    """Start mock servers with MockMoffi options, SDK is pointed to the last one"""
+    servers: List[MockServer] = []
+
+    def serve(**kwargs) -> MockServer:
+        server = MockServer(MockMoffi(**kwargs)).start()
+        servers.append(server)
+        utils.set_api_url(server.url)
+        return server
+
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def mock_api(serve_mock) -> MockServer:
+    """Mock server without latency nor errors"""
+    return serve_mock()
@@ -0,0 +1,163 @@
+"""
+Tests of moffi_sdk.aio
+"""
+
+import asyncio
+import gc
+from datetime import date, timedelta, timezone
+
+import pytest
+
+from moffi_sdk.aio import auth as aio_auth
+from moffi_sdk.aio import order as aio_order
+from moffi_sdk.aio.auth import get_auth_token
+from moffi_sdk.aio.order import order_desk
+from moffi_sdk.aio.reservations import get_reservations
+from moffi_sdk.aio.spaces import get_building, get_workspace_details
+from moffi_sdk.aio.utils import close_client, query
+from moffi_sdk.cache import get_metadata_cache
+from moffi_sdk.exceptions import AuthenticationException, OrderException
+from moffi_sdk.spaces import BUILDING_TIMEZONE
+
+from .conftest import PASSWORD, USERNAME
+from .test_booking_window import free_day
+
+pytest.importorskip("httpx")
+
+
+def run(coroutine_function):
+    """Run a coroutine function in a new event loop, closing its HTTP client"""
+
+    async def main():
+        try:
+            return await coroutine_function()
+        finally:
+            await close_client()
+
+    return asyncio.run(main())
+
+
+def test_signin_once(mock_api):
+    async def main():
+        tokens = await asyncio.gather(*[get_auth_token(username=USERNAME, password=PASSWORD) for _ in range(5)])
+        # locks are forgotten once signin is done
+        assert not aio_auth._USER_LOCKS[asyncio.get_running_loop()]  # pylint: disable=protected-access
+        return tokens
+
+    assert len(set(run(main))) == 1
+    assert mock_api.mock.requests["/signin"] == 1
+
+
+def test_user_locks_by_loop(mock_api):  # pylint: disable=unused-argument
+    # each loop gets its own locks, forgotten with the loop
+    for _ in range(2):
+        run(lambda: get_auth_token(username=USERNAME, password=PASSWORD, use_cache=False))
+    gc.collect()
+    assert not aio_auth._USER_LOCKS  # pylint: disable=protected-access
+
+
+def test_failed_signin_keeps_token(mock_api):  # pylint: disable=unused-argument
+    token = run(lambda: get_auth_token(username=USERNAME, password=PASSWORD))
+    with pytest.raises(AuthenticationException):
+        run(lambda: get_auth_token(username=USERNAME, password=""))
+    assert run(lambda: get_auth_token(username=USERNAME, password=PASSWORD)) == token
+
+
+def test_workspace_details_metadata_cache(mock_api):
+    token = run(lambda: get_auth_token(username=USERNAME, password=PASSWORD))
+    details = run(lambda: get_workspace_details(city="Paris", workspace="Open space 1-0", auth_token=token))
+    assert get_metadata_cache().get("workspace", f"{details['building']['id']}/Open space 1-0") == details
+
+    requests = mock_api.mock.stats["requests"]
+    assert run(lambda: get_workspace_details(city="Paris", workspace="Open space 1-0", auth_token=token)) == details
+    assert mock_api.mock.stats["requests"] == requests
+
+
+def test_concurrent_pages_keep_order(serve_mock):
+    server = serve_mock(orders=45)
+
+    async def main():
+        token = await get_auth_token(username=USERNAME, password=PASSWORD)
+        concurrent = await get_reservations(auth_token=token, steps=["waiting"], page_size=10, max_workers=4)
+        assert server.mock.requests["/orders"] == 5
+        sequential = await get_reservations(auth_token=token, steps=["waiting"], page_size=10, max_workers=1)
+        return concurrent, sequential
+
+    reservations, sequential = run(main)
+    starts = [resa.start for resa in reservations]
+    assert len(starts) == 45
+    assert starts == sorted(starts)
+    assert sequential == reservations
+
+
+def test_reservations_end_date(mock_api):
+    # mock books every other day from tomorrow
+    end_date = date.today() + timedelta(days=10)
+
+    async def main():
+        token = await get_auth_token(username=USERNAME, password=PASSWORD)
+        return await get_reservations(
+            auth_token=token, steps=["waiting"], page_size=2, max_workers=1, end_date=end_date
+        )
+
+    reservations = run(main)
+    assert [(resa.start.date() - date.today()).days for resa in reservations] == [1, 3, 5, 7, 9]
+    # paging stopped on the page going past end date
+    assert mock_api.mock.requests["/orders"] == 3
+
+
+def test_order_desk(mock_api):
+    async def main():
+        token = await get_auth_token(username=USERNAME, password=PASSWORD)
+        return await order_desk(
+            city="Paris",
+            workspace="Open space 1-0",
+            desk="Desk 1-0-5",
+            order_date=free_day().isoformat(),
+            auth_token=token,
+        )
+
+    assert run(main)["status"] == "PAID"
+    assert mock_api.mock.requests["/bookings/estimate"] == 1
+    assert mock_api.mock.requests["/orders/add"] == 1
+    assert mock_api.mock.requests["/orders/{id}/pay"] == 1
+
+
+def test_order_desk_unpaid(mock_api, monkeypatch):
+    async def unpaid_query(url: str, **kwargs):
+        response = await query(url=url, **kwargs)
+        if url.endswith("/pay"):
+            response["status"] = "CREATED"
+        return response
+
+    monkeypatch.setattr(aio_order, "query", unpaid_query)
+
+    async def main():
+        token = await get_auth_token(username=USERNAME, password=PASSWORD)
+        return await order_desk(
+            city="Paris",
+            workspace="Open space 1-0",
+            desk="Desk 1-0-5",
+            order_date=free_day().isoformat(),
+            auth_token=token,
+        )
+
+    with pytest.raises(OrderException, match="not on status PAID"):
+        run(main)
+    assert mock_api.mock.requests["/orders/add"] == 1
+
+
+def test_building_timezone_stays_in_task(mock_api):  # pylint: disable=unused-argument
+    async def user_timezone():
+        token = await get_auth_token(username=USERNAME, password=PASSWORD)
+        await get_building(name="Paris", auth_token=token)
+        return BUILDING_TIMEZONE.get("tz")
+
+    async def main():
+        return await asyncio.gather(user_timezone(), asyncio.sleep(0, result=BUILDING_TIMEZONE.get("tz")))
+
+    building_tz, other_tz = run(main)
+    assert str(building_tz) == "Europe/Paris"
+    assert other_tz == timezone.utc
+    # process wide value is left untouched
+    assert BUILDING_TIMEZONE.get("tz") == timezone.utc
@@ -0,0 +1,89 @@
+"""
+Tests of moffi_sdk.auth
+"""
+
+import base64
+import json
+import time
+
+import pytest
+
+from moffi_sdk.auth import TOKEN_CACHE, TOKEN_EXPIRY_MARGIN, TokenCache, get_auth_token, get_token_expiry
+from moffi_sdk.exceptions import AuthenticationException
+from moffi_sdk.utils import query
+
+from .conftest import PASSWORD, USERNAME
+
+
+def jwt(claims: dict) -> str:
+    """Unsigned JWT carrying claims"""
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return f"e30.{payload}.signature"
+
+
+def test_token_expiry():
+    assert get_token_expiry(jwt({"exp": 1234})) == 1234
+    assert get_token_expiry(jwt({})) is None
+    assert get_token_expiry("not-a-jwt") is None
+
+
+def test_lookup_checks_credentials():
+    cache = TokenCache()
+    entry = cache.store(USERNAME, PASSWORD, "token")
+    assert PASSWORD.encode() not in entry.masked_password
+    assert entry.password() == PASSWORD
+    assert cache.lookup(USERNAME, PASSWORD) == "token"
+    assert cache.lookup(USERNAME, "other") is None
+    assert cache.lookup("other@example.com", PASSWORD) is None
+
+
+def test_token_expires():
+    cache = TokenCache(ttl=0)
+    cache.store(USERNAME, PASSWORD, "token")
+    assert cache.lookup(USERNAME, PASSWORD) is None
+
+    cache = TokenCache()
+    cache.store(USERNAME, PASSWORD, jwt({"exp": time.time() + TOKEN_EXPIRY_MARGIN / 2}))
+    assert cache.lookup(USERNAME, PASSWORD) is None
+    token = jwt({"exp": time.time() + TOKEN_EXPIRY_MARGIN * 2})
+    cache.store(USERNAME, PASSWORD, token)
+    assert cache.lookup(USERNAME, PASSWORD) == token
+
+
+def test_invalidate():
+    cache = TokenCache()
+    cache.store(USERNAME, PASSWORD, "token")
+    cache.store("other@example.com", PASSWORD, "other")
+    cache.invalidate(USERNAME)
+    assert cache.lookup(USERNAME, PASSWORD) is None
+    assert cache.lookup("other@example.com", PASSWORD) == "other"
+    cache.invalidate()
+    assert cache.lookup("other@example.com", PASSWORD) is None
+
+
+def test_get_auth_token_signin_once(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    assert get_auth_token(username=USERNAME, password=PASSWORD) == token
+    assert mock_api.mock.requests["/signin"] == 1
+    assert get_auth_token(username=USERNAME, password=PASSWORD, use_cache=False) != token
+
+
+def test_failed_signin_keeps_cached_token(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    # mock rejects empty passwords
+    with pytest.raises(AuthenticationException):
+        get_auth_token(username=USERNAME, password="")
+    assert TOKEN_CACHE.lookup(USERNAME, PASSWORD) == token
+    assert mock_api.mock.requests["/signin"] == 2
+
+
+def test_query_renews_rejected_token(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    # server forgets its sessions
+    mock_api.mock.tokens.clear()
+
+    assert query(method="GET", url="/users/buildings", auth_token=token)
+    new_token = TOKEN_CACHE.lookup(USERNAME, PASSWORD)
+    assert new_token not in (None, token)
+    assert TOKEN_CACHE.credentials_for(token) == (USERNAME, PASSWORD)
+    assert mock_api.mock.requests["/signin"] == 2
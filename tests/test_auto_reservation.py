@@ -0,0 +1,125 @@
+"""
+Tests of moffi_sdk.auto_reservation
+"""
+
+import time
+from datetime import date, datetime, timezone
+from typing import Any, List, Tuple
+
+from moffi_sdk import auto_reservation as auto_reservation_module
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.auto_reservation import RunContext, auto_reservation
+from moffi_sdk.reservations import get_reservations_by_date
+from moffi_sdk.spaces import get_workspace_details
+
+from .conftest import PASSWORD, USERNAME
+
+WORKSPACE = {"title": "Open space", "type": "desk", "address": "1 rue de Paris"}
+DAY = date(2024, 6, 5)
+LATENCY = 0.2
+
+
+def test_record_order_without_booking_details():
+    context = RunContext(auth_token="token", city="Paris", reservations={})
+    context.record_order({"id": 1, "status": "PAID", "step": "WAITING"}, DAY, WORKSPACE, desk_name="A-12")
+
+    resa = context.reservations[DAY][0]
+    assert (resa.workspace_name, resa.workspace_type, resa.workspace_city, resa.desk_name) == (
+        "Open space",
+        "desk",
+        "Paris",
+        "A-12",
+    )
+    assert resa.start.date() == resa.end.date() == DAY
+    assert (resa.step, resa.status) == ("WAITING", "PAID")
+
+
+def test_record_order_booking_dates():
+    context = RunContext(auth_token="token", city="Paris", reservations={})
+    paid_order = {
+        "status": "PAID",
+        "bookings": [{"start": "2024-06-05T06:00:00.000Z", "end": "2024-06-05T17:00:00.000Z", "workspace": {}}],
+    }
+    context.record_order(paid_order, DAY, WORKSPACE)
+
+    resa = context.reservations[DAY][0]
+    assert resa.start == datetime(2024, 6, 5, 6, tzinfo=timezone.utc)
+    assert resa.end == datetime(2024, 6, 5, 17, tzinfo=timezone.utc)
+    # building name is missing from booking workspace, city of the run is kept
+    assert resa.workspace_city == "Paris"
+
+
+def test_parking_follows_incomplete_desk_orders(mock_api, monkeypatch):  # pylint: disable=unused-argument
+    desk_dates = []
+    parking_dates = []
+
+    def order_desk(order_date, **kwargs):  # pylint: disable=unused-argument
+        desk_dates.append(order_date)
+        # paid order without bookings, nothing can be read from it
+        return {"id": len(desk_dates), "status": "PAID"}
+
+    def order_parking(order_date, **kwargs):  # pylint: disable=unused-argument
+        parking_dates.append(date.fromisoformat(order_date))
+        return {"id": len(parking_dates), "status": "PAID"}
+
+    monkeypatch.setattr(auto_reservation_module, "order_desk_from_details", order_desk)
+    monkeypatch.setattr(auto_reservation_module, "order_parking", order_parking)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+
+    paid_orders = auto_reservation(
+        desk="Desk 1-0-5", city="Paris", workspace="Open space 1-0", parking="Parking", auth_token=token
+    )
+    assert desk_dates
+    assert set(desk_dates) <= set(parking_dates)
+    assert len(paid_orders) == len(desk_dates) + len(parking_dates)
+
+
+def scan_orders(monkeypatch) -> List[Tuple[date, Any]]:
+    """Record desk orders of auto_reservation instead of sending them, with unavailabilities they got"""
+    orders = []
+
+    def order_desk(order_date, unavailabilities=None, **kwargs):  # pylint: disable=unused-argument
+        orders.append((order_date, unavailabilities))
+        return {"id": len(orders), "status": "PAID"}
+
+    monkeypatch.setattr(auto_reservation_module, "order_desk_from_details", order_desk)
+    return orders
+
+
+def test_scan(serve_mock, monkeypatch):
+    server = serve_mock(latency=LATENCY)
+    orders = scan_orders(monkeypatch)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    workspace_details = get_workspace_details(city="Paris", workspace="Open space 1-0", auth_token=token)
+    reservations = get_reservations_by_date(auth_token=token)
+    requests = server.mock.requests["/workspaces/availabilities"]
+
+    started = time.monotonic()
+    auto_reservation(
+        desk="Desk 1-0-5",
+        city="Paris",
+        workspace="Open space 1-0",
+        auth_token=token,
+        scan=True,
+        workspace_details=workspace_details,
+        reservations=reservations,
+    )
+    elapsed = time.monotonic() - started
+
+    assert len(orders) >= 3
+    # one availabilities request per date, all at the same time, then unavailabilities of all dates
+    assert server.mock.requests["/workspaces/availabilities"] - requests == len(orders)
+    assert elapsed < 3 * LATENCY
+    assert server.mock.requests["/planning/unavailabilities"] == 1
+    assert all(unavailabilities == {} for _, unavailabilities in orders)
+
+
+def test_scan_without_unavailabilities(serve_mock, monkeypatch):
+    serve_mock(error_rate=1.0, error_paths="^/planning/unavailabilities$")
+    orders = scan_orders(monkeypatch)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+
+    auto_reservation(desk="Desk 1-0-5", city="Paris", workspace="Open space 1-0", auth_token=token, scan=True)
+    # orders are checked one by one instead
+    assert orders
+    assert all(unavailabilities is None for _, unavailabilities in orders)
@@ -0,0 +1,150 @@
+"""
+Tests of moffi_sdk.booking_window
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+from moffi_sdk import booking_window
+from moffi_sdk import order as order_module
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.booking_window import CLOCK_MAX_POLLS, book_at_opening, estimate_clock_offset, next_opening
+from moffi_sdk.exceptions import OrderException
+from moffi_sdk.metrics import METRICS
+from moffi_sdk.utils import query
+
+from .conftest import PASSWORD, USERNAME
+
+WORKSPACE = {
+    "plageMaxi": {"minutes": 2 * 1440},
+    "schedule": {"saturday": {"isOpen": False}, "sunday": {"isOpen": False}},
+}
+
+
+def free_day() -> date:
+    """Next week day without order in mock, which books every other day from tomorrow"""
+    day = date.today() + timedelta(days=2)
+    while day.weekday() >= 5:
+        day += timedelta(days=2)
+    return day
+
+
+def test_next_opening():
+    now = datetime(2024, 6, 5, 15, 30, tzinfo=timezone.utc)  # a wednesday
+    order_date, opening = next_opening(WORKSPACE, now=now)
+    assert order_date == date(2024, 6, 8)
+    assert opening == datetime(2024, 6, 6, tzinfo=timezone.utc)
+
+    # saturday and sunday are skipped, friday is not a work day
+    order_date, _ = next_opening(WORKSPACE, now=now, closed_days=["saturday", "sunday"], work_days=[1, 2, 3, 4])
+    assert order_date == date(2024, 6, 10)
+
+
+def test_estimate_clock_offset(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    METRICS.reset()
+
+    offset = estimate_clock_offset(token)
+    assert abs(offset) < 1.0
+    polls = mock_api.mock.requests["/"]
+    assert 2 <= polls <= CLOCK_MAX_POLLS
+    # polls go through query layer, and are counted
+    assert METRICS.snapshot()["HEAD /"]["count"] == polls
+
+
+@pytest.fixture
+def opening_now(monkeypatch):
+    """Next opening is in a few milliseconds, for a free day"""
+    monkeypatch.setattr(booking_window, "PREPARE_LEAD", 0)
+    monkeypatch.setattr(booking_window, "CLOCK_MAX_POLLS", 0)
+    monkeypatch.setattr(booking_window, "FIRE_RETRY_DELAY", 0.01)
+    monkeypatch.setattr(
+        booking_window,
+        "next_opening",
+        lambda *args, **kwargs: (free_day(), datetime.now(timezone.utc) + timedelta(milliseconds=50)),
+    )
+
+
+def book(token: str):
+    return book_at_opening(desk="Desk 1-0-5", city="Paris", workspace="Open space 1-0", auth_token=token)
+
+
+def test_book_at_opening(mock_api, opening_now):  # pylint: disable=unused-argument
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    paid_order = book(token)
+    assert paid_order["status"] == "PAID"
+    assert mock_api.mock.requests["/orders/{id}/pay"] == 1
+
+
+def test_book_at_opening_retries_transient_errors(serve_mock, opening_now):  # pylint: disable=unused-argument
+    server = serve_mock(error_rate=1.0, error_paths="^/bookings/estimate$")
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    with pytest.raises(OrderException):
+        book(token)
+    assert server.mock.requests["/bookings/estimate"] == booking_window.FIRE_ATTEMPTS
+    assert server.mock.requests["/orders/add"] == 0
+
+
+def test_book_at_opening_never_orders_twice(serve_mock, opening_now):  # pylint: disable=unused-argument
+    server = serve_mock(error_rate=1.0, error_paths="^/orders/[0-9]+/pay$")
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    with pytest.raises(OrderException):
+        book(token)
+    assert server.mock.requests["/orders/add"] == 1
+
+
+def test_book_at_opening_stops_waiting(mock_api, monkeypatch):
+    monkeypatch.setattr(booking_window, "PREPARE_LEAD", 0)
+    monkeypatch.setattr(
+        booking_window,
+        "next_opening",
+        lambda *args, **kwargs: (free_day(), datetime.now(timezone.utc) + timedelta(seconds=60)),
+    )
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    stop = threading.Event()
+    threading.Timer(0.2, stop.set).start()
+
+    started = time.monotonic()
+    assert (
+        book_at_opening(desk="Desk 1-0-5", city="Paris", workspace="Open space 1-0", auth_token=token, stop=stop)
+        is None
+    )
+    assert time.monotonic() - started < 5
+    assert mock_api.mock.requests["/orders/add"] == 0
+
+
+def test_estimate_clock_offset_stops_polling(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    stop = threading.Event()
+    stop.set()
+    estimate_clock_offset(token, stop=stop)
+    assert mock_api.mock.requests["/"] == 1
+
+
+def test_book_at_opening_never_resends_failed_order(serve_mock, opening_now):  # pylint: disable=unused-argument
+    # order may have been created even if its request failed
+    server = serve_mock(error_rate=1.0, error_paths="^/orders/add$")
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    with pytest.raises(OrderException):
+        book(token)
+    assert server.mock.requests["/orders/add"] == 1
+    assert server.mock.requests["/orders/{id}/pay"] == 0
+
+
+def test_book_at_opening_unpaid_order(mock_api, opening_now, monkeypatch):  # pylint: disable=unused-argument
+    # an order left unpaid is not a booking, daemon must not take it for one
+    def unpaid_query(url: str, **kwargs):
+        response = query(url=url, **kwargs)
+        if url.endswith("/pay"):
+            response["status"] = "CREATED"
+        return response
+
+    monkeypatch.setattr(order_module, "query", unpaid_query)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    with pytest.raises(OrderException) as excinfo:
+        book(token)
+    assert "not on status PAID" in str(excinfo.value.__cause__)
+    assert mock_api.mock.requests["/orders/add"] == 1
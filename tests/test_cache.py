@@ -0,0 +1,86 @@
+"""
+Tests of moffi_sdk.cache
+"""
+
+import time
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.cache import MetadataCache
+from moffi_sdk.spaces import get_workspace_details
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_values_persist(tmp_path):
+    path = str(tmp_path / "metadata.json")
+    cache = MetadataCache(path=path)
+    cache.set("building", "Paris", {"id": 1})
+    assert cache.get("building", "Paris") == {"id": 1}
+    assert cache.get("building", "Lyon") is None
+    assert cache.get("workspace", "Paris") is None
+
+    assert MetadataCache(path=path).get("building", "Paris") == {"id": 1}
+
+
+def test_values_are_copies(tmp_path):
+    cache = MetadataCache(path=str(tmp_path / "metadata.json"))
+    value = {"floors": [0, 1]}
+    cache.set("building", "Paris", value)
+    value["floors"].append(2)
+    cache.get("building", "Paris")["floors"].append(3)
+    assert cache.get("building", "Paris") == {"floors": [0, 1]}
+
+
+def test_ttl_by_kind(tmp_path, monkeypatch):
+    cache = MetadataCache(path=str(tmp_path / "metadata.json"), ttls={"building": 100, "workspace": 10})
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.set("building", "Paris", 1)
+    cache.set("workspace", "Open space", 2)
+
+    monkeypatch.setattr(time, "time", lambda: now + 50)
+    assert cache.get("building", "Paris") == 1
+    assert cache.get("workspace", "Open space") is None
+
+    monkeypatch.setattr(time, "time", lambda: now + 101)
+    assert cache.get("building", "Paris") is None
+
+
+def test_invalidate(tmp_path):
+    path = str(tmp_path / "metadata.json")
+    cache = MetadataCache(path=path)
+    cache.set("building", "Paris", 1)
+    cache.set("building", "Lyon", 2)
+    cache.set("workspace", "Open space", 3)
+
+    cache.invalidate("building", "Paris")
+    assert cache.get("building", "Paris") is None
+    assert cache.get("building", "Lyon") == 2
+    cache.invalidate("building")
+    assert cache.get("building", "Lyon") is None
+    assert cache.get("workspace", "Open space") == 3
+    cache.invalidate()
+    assert MetadataCache(path=path).get("workspace", "Open space") is None
+
+
+def test_disabled_and_corrupted(tmp_path):
+    path = tmp_path / "metadata.json"
+    cache = MetadataCache(path=str(path), enabled=False)
+    cache.set("building", "Paris", 1)
+    assert cache.get("building", "Paris") is None
+    assert not path.exists()
+
+    path.write_text("{not json", encoding="utf-8")
+    cache = MetadataCache(path=str(path))
+    assert cache.get("building", "Paris") is None
+    cache.set("building", "Paris", 1)
+    assert MetadataCache(path=str(path)).get("building", "Paris") == 1
+
+
+def test_warm_workspace_details_skip_api(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    details = get_workspace_details(city="Paris", workspace="Open space 1-0", auth_token=token)
+    requests = mock_api.mock.stats["requests"]
+
+    assert get_workspace_details(city="Paris", workspace="Open space 1-0", auth_token=token) == details
+    assert mock_api.mock.stats["requests"] == requests
@@ -0,0 +1,49 @@
+"""
+Tests of moffi_sdk.client
+"""
+
+from datetime import timezone
+
+from moffi_sdk.client import MoffiClient
+from moffi_sdk.ratelimit import get_rate_limiter
+from moffi_sdk.request_cache import get_request_cache
+from moffi_sdk.spaces import BUILDING_TIMEZONE
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_client_owns_its_state():
+    first = MoffiClient(username=USERNAME, password=PASSWORD, rate_limit_settings={"account_rate": 1.0})
+    second = MoffiClient(username=USERNAME, password=PASSWORD)
+    shared_cache, shared_limiter = get_request_cache(), get_rate_limiter()
+
+    with first.bind():
+        assert get_request_cache() is first.request_cache
+        assert get_rate_limiter() is first.rate_limiter
+        assert get_rate_limiter().settings["account_rate"] == 1.0
+    with second.bind():
+        assert get_request_cache() is second.request_cache
+        assert get_rate_limiter() is second.rate_limiter
+    assert first.request_cache is not second.request_cache
+    assert get_request_cache() is shared_cache
+    assert get_rate_limiter() is shared_limiter
+
+
+def test_bind_keeps_timezone_in_context():
+    client = MoffiClient(auth_token="token")
+    with client.bind():
+        BUILDING_TIMEZONE["tz"] = timezone.max
+        with client.bind():
+            # a concurrent binding does not see the other one's building
+            assert BUILDING_TIMEZONE["tz"] == timezone.utc
+    assert client.timezone == timezone.utc
+
+
+def test_client_requests(mock_api):
+    client = MoffiClient(username=USERNAME, password=PASSWORD)
+    with client:
+        building = client.get_building(city="Paris")
+    assert building["name"] == "Paris"
+    # signin is not an API query
+    assert client.stats["requests"] == mock_api.mock.stats["requests"] - mock_api.mock.requests["/signin"]
+    assert client.stats["errors"] == 0
@@ -0,0 +1,103 @@
+"""
+Tests of moffi_sdk.ics_writer
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from moffi_sdk.ics_writer import (
+    CRLF,
+    LINE_LENGTH,
+    escape_text,
+    fold_line,
+    format_datetime,
+    reservation_uid,
+    serialize_calendar,
+)
+from moffi_sdk.reservations import ReservationItem
+
+START = datetime(2024, 6, 5, 8, 0, tzinfo=timezone(timedelta(hours=2)))
+
+
+def reservation(**kwargs) -> ReservationItem:
+    values = {
+        "workspace_name": "Open space",
+        "workspace_address": "1 rue de Paris, 75001 Paris",
+        "workspace_type": "DESK",
+        "workspace_city": "Paris",
+        "desk_name": "A-12",
+        "start": START,
+        "end": START + timedelta(hours=10),
+        "step": "waiting",
+        "status": "PAID",
+    }
+    values.update(kwargs)
+    return ReservationItem(**values)
+
+
+def unfold(text: str) -> str:
+    return text.replace(CRLF + " ", "")
+
+
+def test_escape_text():
+    assert escape_text("a\\b;c,d") == r"a\\b\;c\,d"
+    assert escape_text("one\r\ntwo\nthree\rfour") == "one\\ntwo\\nthree\\nfour"
+
+
+def test_fold_short_line():
+    line = "X" * LINE_LENGTH
+    assert fold_line(line) == line + CRLF
+
+
+@pytest.mark.parametrize("char", ["x", "é", "€", "🪑"])
+def test_fold_long_line(char):
+    line = "SUMMARY:" + char * 200
+    folded = fold_line(line)
+
+    assert folded.endswith(CRLF)
+    lines = folded[: -len(CRLF)].split(CRLF)
+    assert len(lines) > 1
+    for content_line in lines:
+        # octets, characters are never split between lines
+        assert len(content_line.encode("utf-8")) <= LINE_LENGTH
+    assert all(content_line.startswith(" ") for content_line in lines[1:])
+    assert unfold(folded) == line + CRLF
+
+
+def test_format_datetime():
+    assert format_datetime(START) == "20240605T060000Z"
+    assert format_datetime(datetime(2024, 6, 5, 8, 0)) == "20240605T080000Z"
+
+
+def test_reservation_uid_is_stable():
+    assert reservation_uid(reservation()) == reservation_uid(reservation(status="CANCELLED"))
+    assert reservation_uid(reservation()) != reservation_uid(reservation(desk_name="A-13"))
+
+
+def test_serialize_calendar():
+    calendar = serialize_calendar([reservation(), reservation(desk_name=None, workspace_address=None)])
+
+    assert calendar.startswith(f"BEGIN:VCALENDAR{CRLF}VERSION:2.0{CRLF}")
+    assert calendar.endswith(f"END:VCALENDAR{CRLF}")
+    assert calendar.count("BEGIN:VEVENT") == calendar.count("END:VEVENT") == 2
+    content = unfold(calendar)
+    assert f"SUMMARY:Open space - A-12{CRLF}" in content
+    assert f"SUMMARY:Open space{CRLF}" in content
+    assert f"LOCATION:1 rue de Paris\\, 75001 Paris{CRLF}" in content
+    assert content.count("LOCATION:") == 1
+    assert f"DTSTAMP:20240605T060000Z{CRLF}DTSTART:20240605T060000Z{CRLF}DTEND:20240605T160000Z{CRLF}" in content
+    assert content.count("DTSTAMP:") == 2
+    # renders are identical, for ETags
+    assert serialize_calendar([reservation()]) == serialize_calendar([reservation()])
+
+
+def test_serialize_calendar_is_read_by_ics():
+    ics = pytest.importorskip("ics")
+    name = "Espace de travail très long ; avec des virgules, et des caractères accentués"
+    calendar = ics.Calendar(serialize_calendar([reservation(workspace_name=name)]))
+
+    event = next(iter(calendar.events))
+    assert event.name == f"{name} - A-12"
+    assert event.location == "1 rue de Paris, 75001 Paris"
+    assert event.begin == START
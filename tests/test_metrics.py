@@ -0,0 +1,94 @@
+"""
+Tests of moffi_sdk.metrics
+"""
+
+import pytest
+
+from moffi_sdk import metrics as metrics_module
+from moffi_sdk.metrics import MetricsRegistry, RequestRecord, add_sink, endpoint_template, record_request, remove_sink
+
+
+@pytest.mark.parametrize(
+    "url, template",
+    [
+        ("https://api.moffi.io/api/orders/1234/pay?x=1", "/orders/{id}/pay"),
+        ("/buildings/0f8fad5b-d9cb-469f-a165-70867728950e", "/buildings/{id}"),
+        ("orders/count", "/orders/count"),
+        ("/workspaces/url/open-space-1-0", "/workspaces/url/{url}"),
+        ("/workspaces/url/open-space/1234", "/workspaces/url/{url}"),
+        ("/orders/v2", "/orders/v2"),
+    ],
+)
+def test_endpoint_template(url, template):
+    assert endpoint_template(url, api_root="https://api.moffi.io/api") == template
+
+
+def test_registry_snapshot():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.record(RequestRecord("GET", "/orders", 200, 0.05, response_size=100))
+    registry.record(RequestRecord("GET", "/orders", 200, 0.5, response_size=50, retries=2))
+    registry.record(RequestRecord("GET", "/orders", 500, 2.0))
+    registry.record(RequestRecord("POST", "/orders/add", None, 0.01))
+
+    snapshot = registry.snapshot()
+    assert list(snapshot) == ["GET /orders", "POST /orders/add"]
+    assert snapshot["GET /orders"] == {
+        "count": 3,
+        "errors": 1,
+        "statuses": {"200": 2, "500": 1},
+        "duration": pytest.approx(2.55),
+        "p50": 1.0,
+        "p95": float("inf"),
+        "retries": 2,
+        "response_bytes": 150,
+    }
+    assert snapshot["POST /orders/add"]["statuses"] == {"error": 1}
+    assert snapshot["POST /orders/add"]["errors"] == 1
+
+    registry.reset()
+    assert not registry.snapshot()
+
+
+def test_render_prometheus():
+    registry = MetricsRegistry(buckets=(0.1, 1.0), subject="test")
+    registry.record(RequestRecord("GET", "/orders", 200, 0.05, response_size=100, retries=1))
+    registry.record(RequestRecord("GET", "/orders", 200, 0.5))
+
+    lines = registry.render_prometheus(prefix="test_api").splitlines()
+    assert "# TYPE test_api_requests_total counter" in lines
+    assert 'test_api_requests_total{method="GET",endpoint="/orders",status="200"} 2' in lines
+    assert "# TYPE test_api_request_duration_seconds histogram" in lines
+    assert 'test_api_request_duration_seconds_bucket{method="GET",endpoint="/orders",le="0.1"} 1' in lines
+    assert 'test_api_request_duration_seconds_bucket{method="GET",endpoint="/orders",le="1"} 2' in lines
+    assert 'test_api_request_duration_seconds_bucket{method="GET",endpoint="/orders",le="+Inf"} 2' in lines
+    assert 'test_api_request_duration_seconds_sum{method="GET",endpoint="/orders"} 0.550000' in lines
+    assert 'test_api_request_duration_seconds_count{method="GET",endpoint="/orders"} 2' in lines
+    assert 'test_api_retries_total{method="GET",endpoint="/orders"} 1' in lines
+    assert 'test_api_response_bytes_total{method="GET",endpoint="/orders"} 100' in lines
+
+
+def test_render_prometheus_escapes_labels():
+    registry = MetricsRegistry()
+    registry.record(RequestRecord("GET", 'a"b\\c\nd', 200, 0.05))
+
+    assert 'moffi_api_requests_total{method="GET",endpoint="a\\"b\\\\c\\nd",status="200"} 1' in (
+        registry.render_prometheus().splitlines()
+    )
+
+
+def test_failing_sink_is_isolated(monkeypatch):
+    monkeypatch.setattr(metrics_module, "SINKS", [])
+    registry = MetricsRegistry()
+
+    def failing_sink(record: RequestRecord) -> None:
+        raise ValueError(record.endpoint)
+
+    add_sink(failing_sink)
+    add_sink(registry)
+    add_sink(registry)
+    record_request(RequestRecord("GET", "/orders", 200, 0.05))
+    # sinks after the failing one still get the record, once
+    assert registry.snapshot()["GET /orders"]["count"] == 1
+
+    remove_sink(failing_sink)
+    assert metrics_module.SINKS == [registry]
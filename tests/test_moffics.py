@@ -0,0 +1,228 @@
+"""
+Tests of moffics, through flask test client against the mock of Moffi API
+"""
+
+import hashlib
+import time
+
+import pytest
+
+import moffics
+from moffi_sdk.auth import credentials_digest
+from moffi_sdk.exceptions import RequestException
+from moffi_sdk.metrics import METRICS, MetricsRegistry
+from moffi_sdk.singleflight import SingleFlight
+
+from .conftest import PASSWORD, USERNAME
+
+SECRET_KEY = b"0123456789abcdef0123456789abcdef"
+
+
+@pytest.fixture(name="client")
+def fixture_client(monkeypatch):
+    """Flask test client, with empty calendar cache and metrics"""
+    cache = moffics.CalendarCache()
+    monkeypatch.setattr(moffics, "CALENDAR_CACHE", cache)
+    monkeypatch.setattr(moffics, "REFRESHER", moffics.CalendarRefresher(cache, interval=0))
+    monkeypatch.setattr(moffics, "FLIGHTS", SingleFlight())
+    monkeypatch.setattr(moffics, "ROUTE_METRICS", MetricsRegistry(subject="moffics"))
+    monkeypatch.setitem(moffics.APP.config, "secret_key", SECRET_KEY)
+    METRICS.reset()
+    yield moffics.APP.test_client()
+    moffics.REFRESHER.stop()
+
+
+def get_calendar(client, password: str = PASSWORD, **headers):
+    return client.get("/", auth=(USERNAME, password), headers=headers)
+
+
+def test_metrics(mock_api, client):  # pylint: disable=unused-argument
+    assert get_calendar(client).status_code == 200
+    token = client.get("/getToken", auth=(USERNAME, PASSWORD)).json["token"]
+    assert client.get(f"/token/{token}").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type == "text/plain; version=0.0.4; charset=utf-8"
+    lines = response.get_data(as_text=True).splitlines()
+    # Moffi API requests
+    assert 'moffi_api_requests_total{method="GET",endpoint="/orders/count",status="200"} 1' in lines
+    # moffics routes, by rule so tokens never end up in labels
+    assert 'moffics_http_requests_total{method="GET",endpoint="/",status="200"} 1' in lines
+    assert 'moffics_http_requests_total{method="GET",endpoint="/token/<string:token>",status="200"} 1' in lines
+    assert not [line for line in lines if token in line]
+    # calendar cache, second calendar request was a hit
+    assert 'moffics_calendar_cache_events_total{event="hits"} 1' in lines
+    assert 'moffics_calendar_cache_events_total{event="misses"} 1' in lines
+    assert "moffics_calendar_cache_entries 1" in lines
+    assert "moffics_upstream_fetches_total 1" in lines
+
+
+def test_route_metrics(mock_api, client):  # pylint: disable=unused-argument
+    assert client.get("/").status_code == 401
+    assert get_calendar(client).status_code == 200
+    assert client.get("/missing").status_code == 404
+
+    snapshot = moffics.ROUTE_METRICS.snapshot()
+    assert snapshot["GET /"]["statuses"] == {"200": 1, "401": 1}
+    assert snapshot["GET /"]["response_bytes"] > 0
+    assert snapshot["GET unmatched"]["statuses"] == {"404": 1}
+
+
+def test_calendar_is_cached(mock_api, client):
+    response = get_calendar(client)
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).startswith("BEGIN:VCALENDAR")
+    assert response.headers["ETag"] == f'"{hashlib.sha256(response.data).hexdigest()}"'
+    assert response.last_modified is not None
+    assert response.cache_control.private
+    assert 0 < response.cache_control.max_age <= moffics.CALENDAR_CACHE.ttl
+
+    requests = mock_api.mock.stats["requests"]
+    cached = get_calendar(client)
+    assert cached.data == response.data
+    assert cached.headers["ETag"] == response.headers["ETag"]
+    assert mock_api.mock.stats["requests"] == requests
+    assert moffics.CALENDAR_CACHE.stats["misses"] == 1
+    assert moffics.CALENDAR_CACHE.stats["hits"] == 1
+
+
+def test_conditional_request(mock_api, client):
+    response = get_calendar(client)
+    requests = mock_api.mock.stats["requests"]
+
+    not_modified = get_calendar(client, **{"If-None-Match": response.headers["ETag"]})
+    assert not_modified.status_code == 304
+    assert not not_modified.data
+    assert get_calendar(client, **{"If-Modified-Since": response.headers["Last-Modified"]}).status_code == 304
+    assert get_calendar(client, **{"If-None-Match": '"outdated"'}).status_code == 200
+    # answered from cache, Moffi was not asked
+    assert mock_api.mock.stats["requests"] == requests
+    assert moffics.CALENDAR_CACHE.stats["not_modified"] == 2
+    assert moffics.CALENDAR_CACHE.stats["hits"] == 3
+
+
+def test_calendar_cache_keyed_by_credentials(mock_api, client):
+    assert get_calendar(client).status_code == 200
+    # another password never gets the cached calendar
+    assert get_calendar(client, password=f"{PASSWORD}-other").status_code == 200
+
+    assert moffics.CALENDAR_CACHE.stats["misses"] == 2
+    assert len(moffics.CALENDAR_CACHE) == 2
+    assert mock_api.mock.requests["/signin"] == 2
+    assert moffics.CALENDAR_CACHE.get(credentials_digest(USERNAME, PASSWORD))[0] is not None
+
+
+def test_calendar_cache_keeps_last_modified(monkeypatch):
+    cache = moffics.CalendarCache(ttl=60)
+    first = cache.set("key", b"calendar", username=USERNAME)
+    monkeypatch.setattr(moffics.time, "time", lambda: first.fetched_at + 5)
+
+    same = cache.set("key", b"calendar", username=USERNAME)
+    assert same.last_modified == first.last_modified
+    assert same.fetched_at == first.fetched_at + 5
+    changed = cache.set("key", b"other calendar", username=USERNAME)
+    assert changed.etag != first.etag
+    assert changed.last_modified > first.last_modified
+
+
+def test_calendar_not_cached(mock_api, client, monkeypatch):
+    monkeypatch.setattr(moffics, "CALENDAR_CACHE", moffics.CalendarCache(ttl=0))
+
+    for _ in range(2):
+        response = get_calendar(client)
+        assert response.status_code == 200
+        # streamed while reservations are fetched
+        assert response.is_streamed
+        assert response.cache_control.no_store
+        assert response.get_data(as_text=True).startswith("BEGIN:VCALENDAR")
+    assert not moffics.CALENDAR_CACHE
+    assert moffics.FLIGHTS.stats["calls"] == 0
+    assert mock_api.mock.requests["/orders/count"] >= 1
+
+
+def wait_refreshes(cache: moffics.CalendarCache, count: int) -> None:
+    """Wait for background refreshes to be done"""
+    deadline = time.monotonic() + 5
+    while cache.stats["refreshes"] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.stats["refreshes"] == count
+
+
+def test_calendar_cache_stale_window():
+    cache = moffics.CalendarCache(ttl=10, max_stale=20)
+    entry = cache.set("key", b"calendar", username=USERNAME)
+
+    assert cache.get("key") == (entry, True)
+    entry.fetched_at -= 15
+    assert cache.get("key") == (entry, False)
+    entry.fetched_at -= 15
+    assert cache.get("key") == (None, False)
+    assert cache.get("other") == (None, False)
+    assert cache.stats["hits"] == cache.stats["stale_hits"] == 1
+    assert cache.stats["misses"] == 2
+
+
+def test_calendar_cache_evicts_least_recently_used():
+    cache = moffics.CalendarCache(max_users=2)
+    cache.set("first", b"first", username="first")
+    cache.set("second", b"second", username="second")
+    assert cache.get("first")[0] is not None
+
+    cache.set("third", b"third", username="third")
+    assert len(cache) == 2
+    assert cache.get("second") == (None, False)
+    assert cache.get("first")[0].body == b"first"
+    assert cache.get("third")[0].body == b"third"
+
+
+def test_keys_to_refresh():
+    cache = moffics.CalendarCache(ttl=100)
+    cache.set("fresh", b"fresh", username="fresh")
+    cache.set("expiring", b"expiring", username="expiring").fetched_at -= 50
+    inactive = cache.set("inactive", b"inactive", username="inactive")
+    inactive.fetched_at -= 50
+    inactive.last_access -= 1000
+
+    assert cache.keys_to_refresh(horizon=60, active_window=500) == ["expiring"]
+
+
+def test_stale_calendar_refreshed_in_background(mock_api, client):  # pylint: disable=unused-argument
+    response = get_calendar(client)
+    key = credentials_digest(USERNAME, PASSWORD)
+    moffics.CALENDAR_CACHE.get(key)[0].fetched_at -= moffics.CALENDAR_CACHE.ttl + 1
+
+    stale = get_calendar(client)
+    assert stale.status_code == 200
+    assert stale.data == response.data
+    assert stale.cache_control.max_age == 0
+    wait_refreshes(moffics.CALENDAR_CACHE, 1)
+
+    entry, fresh = moffics.CALENDAR_CACHE.get(key)
+    assert fresh
+    assert entry.last_error is None
+    assert not entry.refreshing
+    assert moffics.CALENDAR_CACHE.stats["stale_hits"] == 1
+    assert moffics.FLIGHTS.stats["calls"] == 2
+
+
+def test_stale_calendar_served_when_refresh_fails(mock_api, client, monkeypatch):  # pylint: disable=unused-argument
+    response = get_calendar(client)
+    key = credentials_digest(USERNAME, PASSWORD)
+    moffics.CALENDAR_CACHE.get(key)[0].fetched_at -= moffics.CALENDAR_CACHE.ttl + 1
+
+    def failing_render(token: str) -> bytes:
+        raise RequestException(f"Moffi is down for {token}")
+
+    monkeypatch.setattr(moffics, "render_ics_from_moffi", failing_render)
+    assert get_calendar(client).data == response.data
+    wait_refreshes(moffics.CALENDAR_CACHE, 1)
+
+    entry, fresh = moffics.CALENDAR_CACHE.get(key)
+    assert not fresh
+    assert "Moffi is down" in entry.last_error
+    assert not entry.refreshing
+    assert moffics.CALENDAR_CACHE.stats["refresh_errors"] == 1
+    # stale calendar is still served, and refreshed again
+    assert get_calendar(client).data == response.data
+    wait_refreshes(moffics.CALENDAR_CACHE, 2)
@@ -0,0 +1,55 @@
+"""
+Tests of multi_reservation config parsing
+"""
+
+from configparser import ConfigParser
+
+import pytest
+
+from multi_reservation import parse_accounts
+
+CONFIG = """
+[Auth]
+User = main@example.com
+Password = main-secret
+
+[Reservation]
+User = ignored@example.com
+City = Paris
+Workspace = Open space
+Desk = A-12
+Working Days = Mon, Tue
+
+[Account main]
+
+[Account bob]
+User = bob@example.com
+Password = bob-secret
+Desk = A-13
+"""
+
+
+def parse(text: str):
+    config_ini = ConfigParser()
+    config_ini.read_string(text)
+    return {account.name: account for account in parse_accounts(config_ini)}
+
+
+def test_parse_accounts():
+    accounts = parse(CONFIG)
+
+    # credentials come from [Auth], never from [Reservation]
+    assert accounts["main"].user == "main@example.com"
+    assert accounts["main"].password == "main-secret"
+    assert accounts["main"].desk == "A-12"
+    assert accounts["main"].work_days == [1, 2]
+
+    assert accounts["bob"].user == "bob@example.com"
+    assert accounts["bob"].password == "bob-secret"
+    assert accounts["bob"].desk == "A-13"
+    assert accounts["bob"].city == "Paris"
+
+
+def test_parse_accounts_missing_credentials():
+    with pytest.raises(ValueError, match="Password"):
+        parse(CONFIG.replace("Password = main-secret\n", ""))
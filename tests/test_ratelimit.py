@@ -0,0 +1,142 @@
+"""
+Tests of moffi_sdk.ratelimit
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from moffi_sdk import ratelimit
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.client import MoffiClient
+from moffi_sdk.ratelimit import (
+    RATE_LIMIT_SETTINGS,
+    AdaptiveConcurrency,
+    RateLimiter,
+    TokenBucket,
+    backoff_delay,
+    parse_retry_after,
+)
+from moffi_sdk.utils import query
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10.0, burst=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    # bucket is empty, third token comes in 1 / rate seconds
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    # reservations go in debt, each waits for its own token
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=10.0, burst=10)
+    bucket.pause(2.0)
+    assert bucket.reserve() == pytest.approx(2.0, abs=0.01)
+    # a shorter pause does not shorten the current one
+    bucket.pause(1.0)
+    assert bucket.reserve() == pytest.approx(2.0, abs=0.01)
+
+
+def test_adaptive_concurrency():
+    concurrency = AdaptiveConcurrency(max_limit=16, min_limit=2)
+
+    # multiplicative decrease, down to min_limit
+    for expected in (8, 4, 2, 2):
+        concurrency.acquire()
+        concurrency.release(throttled=True)
+        assert concurrency.limit == expected
+
+    # additive increase : 1 / limit per success, about one more slot every `limit` successes
+    for _ in range(2):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+    # unknown outcome leaves limit unchanged
+    limit = concurrency.limit
+    concurrency.acquire()
+    concurrency.release(throttled=None)
+    assert concurrency.limit == limit
+    assert concurrency.in_flight == 0
+
+    # never above max_limit
+    for _ in range(1000):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == 16
+
+
+def test_account_buckets(monkeypatch):
+    monkeypatch.setattr(ratelimit, "MAX_ACCOUNTS", 2)
+    limiter = RateLimiter({"account_rate": 1.0, "account_burst": 1})
+    first = limiter.account_bucket("first")
+    assert limiter.account_bucket("first") is first
+
+    assert limiter.reserve("first") == 0.0
+    assert limiter.reserve("first") == pytest.approx(1.0, abs=0.01)
+    # other accounts are not slowed down
+    assert limiter.reserve("second") == 0.0
+
+    # least recently used accounts are forgotten
+    limiter.account_bucket("third")
+    assert limiter.account_bucket("first") is not first
+
+
+def test_throttled_pauses_account():
+    limiter = RateLimiter()
+    limiter.throttled("account", retry_after=3.0)
+    assert limiter.reserve("account") == pytest.approx(3.0, abs=0.01)
+    assert limiter.reserve("other") == 0.0
+    # pause never exceeds max_backoff
+    limiter.throttled("other", retry_after=3600.0)
+    assert limiter.reserve("other") == pytest.approx(RATE_LIMIT_SETTINGS["max_backoff"], abs=0.01)
+    assert limiter.stats["throttled"] == 2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("invalid") is None
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    retry_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert parse_retry_after(retry_date) == pytest.approx(30, abs=1.5)
+    past_date = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+    assert parse_retry_after(past_date) == 0.0
+
+
+def test_backoff_delay():
+    assert backoff_delay(0, 0.3, retry_after=2.0) == 2.0
+    assert backoff_delay(0, 0.3, retry_after=3600.0) == RATE_LIMIT_SETTINGS["max_backoff"]
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 0.3) <= min(RATE_LIMIT_SETTINGS["max_backoff"], 0.3 * 2**attempt)
+
+
+def test_backoff_delay_of_bound_client():
+    with MoffiClient(auth_token="token", rate_limit_settings={"max_backoff": 1.0}).bind():
+        assert backoff_delay(0, 0.3, retry_after=2.0) == 1.0
+        assert all(backoff_delay(attempt, 0.3) <= 1.0 for attempt in range(10))
+    assert backoff_delay(0, 0.3, retry_after=2.0) == 2.0
+
+
+def test_throttled_requests_are_retried(serve_mock, monkeypatch):
+    server = serve_mock(rate_limit=5.0)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    limiter = RateLimiter()
+    monkeypatch.setattr(ratelimit, "RATE_LIMITER", limiter)
+
+    started = time.monotonic()
+    for page in range(10):
+        query(method="GET", url="/orders", params={"page": page, "size": 1}, auth_token=token)
+
+    # server pushed back with Retry-After, requests waited for it instead of failing
+    assert server.mock.stats["status_429"] >= 1
+    assert limiter.stats["throttled"] == server.mock.stats["status_429"]
+    assert limiter.concurrency.limit < RATE_LIMIT_SETTINGS["max_concurrency"]
+    assert time.monotonic() - started >= 1.0
@@ -0,0 +1,112 @@
+"""
+Tests of moffi_sdk.request_cache
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.exceptions import RequestException
+from moffi_sdk.request_cache import RequestCache, get_request_cache, is_mutating
+from moffi_sdk.utils import query
+
+from .conftest import PASSWORD, USERNAME
+
+KEY = ("https://api/orders", "token")
+
+
+def test_is_mutating():
+    assert is_mutating("POST", "/orders/add")
+    assert is_mutating("POST", "/orders/{id}/pay")
+    assert not is_mutating("GET", "/orders")
+    assert not is_mutating("HEAD", "/orders")
+    assert not is_mutating("POST", "/bookings/estimate")
+    assert not is_mutating("POST", "/signin")
+
+
+def test_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = RequestCache(ttl=5.0)
+
+    cache.set(KEY, b"body", cache.generation(KEY[1]))
+    assert cache.get(KEY) == b"body"
+    now[0] += 6
+    assert cache.get(KEY) is None
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    # ttl 0 only coalesces, nothing is stored
+    cache = RequestCache(ttl=0)
+    cache.set(KEY, b"body", cache.generation(KEY[1]))
+    assert cache.get(KEY) is None
+
+
+def test_max_entries():
+    cache = RequestCache(ttl=60, max_entries=2)
+    for index in range(3):
+        cache.set((f"url{index}", "token"), b"body", 0)
+    assert cache.get(("url0", "token")) is None
+    assert cache.get(("url2", "token")) == b"body"
+
+
+def test_invalidate_by_token():
+    cache = RequestCache(ttl=60)
+    cache.set(KEY, b"body", 0)
+    cache.set(("https://api/orders", "other"), b"other", 0)
+
+    cache.invalidate("token")
+    assert cache.get(KEY) is None
+    assert cache.get(("https://api/orders", "other")) == b"other"
+
+    cache.invalidate()
+    assert cache.get(("https://api/orders", "other")) is None
+
+
+def test_response_fetched_before_invalidation_is_dropped():
+    cache = RequestCache(ttl=60)
+    generation = cache.generation("token")
+    # an order is placed while the GET is in flight
+    cache.invalidate("token")
+    cache.set(KEY, b"stale", generation)
+    assert cache.get(KEY) is None
+
+    cache.set(KEY, b"fresh", cache.generation("token"))
+    assert cache.get(KEY) == b"fresh"
+
+
+def get_orders(token: str):
+    return query(method="GET", url="/orders", params={"page": 0, "size": 10}, auth_token=token)
+
+
+def test_identical_gets_are_memoized(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    assert get_orders(token) == get_orders(token)
+    assert mock_api.mock.requests["/orders"] == 1
+
+
+def test_concurrent_gets_are_coalesced(serve_mock):
+    server = serve_mock(latency=0.2)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: get_orders(token), range(4)))
+    assert all(result == results[0] for result in results)
+    assert server.mock.requests["/orders"] == 1
+    assert get_request_cache().flights.stats["shared"] >= 1
+
+
+def test_orders_invalidate_memoized_responses(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    get_orders(token)
+
+    # an estimate changes nothing
+    query(method="POST", url="/bookings/estimate", data={}, auth_token=token)
+    get_orders(token)
+    assert mock_api.mock.requests["/orders"] == 1
+
+    # even a failed order may have changed orders
+    with pytest.raises(RequestException):
+        query(method="POST", url="/orders/add", data={}, auth_token=token)
+    get_orders(token)
+    assert mock_api.mock.requests["/orders"] == 2
@@ -0,0 +1,223 @@
+"""
+Tests of moffi_sdk.reservations
+"""
+
+import pickle
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+import pytest
+
+from benchmarks.mock_server import MAX_PAGE_SIZE
+from moffi_sdk import reservations as reservations_module
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.reservations import (
+    FrozenReservationItem,
+    ReservationItem,
+    get_cancelled_reservations,
+    get_reservations,
+    get_reservations_by_date,
+    map_reservations,
+)
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_concurrent_pages_keep_order(serve_mock):
+    server = serve_mock(orders=45)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+
+    reservations = get_reservations(auth_token=token, steps=["waiting"], page_size=10, max_workers=4)
+    starts = [resa.start for resa in reservations]
+    assert len(starts) == 45
+    assert starts == sorted(starts)
+    assert server.mock.requests["/orders"] == 5
+    assert get_reservations(auth_token=token, steps=["waiting"], page_size=10, max_workers=1) == reservations
+
+
+def test_reservations_by_date(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+
+    reservations = get_reservations_by_date(auth_token=token, steps=["waiting"])
+    assert len(reservations) == 40
+    for day, items in reservations.items():
+        assert [resa.start.date() for resa in items] == [day]
+        assert items[0].workspace_city == "Paris"
+
+
+def cancelled_pages(days: List[int], page_size: int) -> Callable[..., Dict[str, Any]]:
+    """Fake query answering pages of cancelled orders starting in days from today, latest first"""
+    today = datetime.now(timezone.utc).replace(hour=8, minute=0, second=0, microsecond=0)
+    orders = [
+        {
+            "status": "CANCELLED",
+            "step": "FINISHED",
+            "bookings": [
+                {
+                    "workspace": {"title": "Open space", "type": "desk", "building": {"name": "Paris"}},
+                    "start": (today + timedelta(days=day)).isoformat(),
+                    "end": (today + timedelta(days=day, hours=10)).isoformat(),
+                }
+            ],
+        }
+        for day in sorted(days, reverse=True)
+    ]
+
+    def fake_query(params: Dict[str, Any], **_) -> Dict[str, Any]:
+        page = params["page"]
+        assert params["size"] == page_size
+        return {"content": orders[page * page_size : (page + 1) * page_size], "totalElements": len(orders)}
+
+    return fake_query
+
+
+def test_cancelled_reservations_stop_at_past(monkeypatch):
+    monkeypatch.setattr(reservations_module, "query", cancelled_pages([5, 4, 3, 2, 1, -1, -2, -3], page_size=2))
+
+    upcoming = get_cancelled_reservations(auth_token="token", page_size=2)
+    assert [resa.start.date() - date.today() for resa in upcoming] == [timedelta(days=day) for day in (5, 4, 3, 2, 1)]
+
+    everything = get_cancelled_reservations(auth_token="token", page_size=2, include_past=True)
+    assert len(everything) == 8
+    assert [resa.start for resa in everything] == sorted((resa.start for resa in everything), reverse=True)
+
+
+def test_adaptive_page_size(serve_mock, monkeypatch):
+    server = serve_mock(orders=120)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    monkeypatch.setitem(reservations_module.ADAPTIVE_PAGE_SIZE, "size", None)
+
+    reservations = get_reservations(auth_token=token, steps=["waiting"], adaptive_page_size=True)
+    # mock rejects pages over 50 orders : 100 is probed and rejected, then 3 pages of 50
+    assert reservations_module.ADAPTIVE_PAGE_SIZE["size"] == MAX_PAGE_SIZE
+    assert len(reservations) == 120
+    assert server.mock.stats["status_400"] == 1
+    assert server.mock.requests["/orders"] == 4
+
+
+def multi_booking_orders(count: int, capped_size: int) -> Callable[..., Dict[str, Any]]:
+    """Fake query answering waiting orders of two bookings each, pages capped to capped_size orders"""
+    today = datetime.now(timezone.utc).replace(hour=8, minute=0, second=0, microsecond=0)
+    orders = [
+        {
+            "status": "PAID",
+            "step": "WAITING",
+            "bookings": [
+                {
+                    "workspace": {"title": title, "type": "desk", "building": {"name": "Paris"}},
+                    "start": (today + timedelta(days=day)).isoformat(),
+                    "end": (today + timedelta(days=day, hours=10)).isoformat(),
+                }
+                for title in ("Open space", "Meeting room")
+            ],
+        }
+        for day in range(1, count + 1)
+    ]
+    requests = []
+
+    def fake_query(url: str, params: Any = None, **_) -> Dict[str, Any]:
+        requests.append(url)
+        if url == "/orders/count":
+            return {"waiting": count}
+        params = dict(params)
+        size = min(params["size"], capped_size)
+        page = params["page"]
+        return {"content": orders[page * size : (page + 1) * size], "size": size}
+
+    fake_query.requests = requests
+    return fake_query
+
+
+def test_adaptive_page_size_counts_orders(monkeypatch):
+    # probed page has as many reservations as the page size, but only half of its orders
+    fake_query = multi_booking_orders(count=2, capped_size=4)
+    monkeypatch.setattr(reservations_module, "query", fake_query)
+    monkeypatch.setitem(reservations_module.ADAPTIVE_PAGE_SIZE, "size", None)
+
+    reservations = get_reservations(auth_token="token", steps=["waiting"], adaptive_page_size=True)
+    assert len(reservations) == 4
+    # count and probe only, no page fetched beyond the orders
+    assert fake_query.requests == ["/orders/count", "/orders"]
+
+
+def orders_by_step(orders: Dict[str, int], counts: Dict[str, int]) -> Callable[..., Dict[str, Any]]:
+    """Fake query answering orders of each step, with counts that may be outdated"""
+    today = datetime.now(timezone.utc).replace(hour=8, minute=0, second=0, microsecond=0)
+    steps = {value: key for key, value in reservations_module.AVAILABLE_STEPS.items()}
+
+    def fake_query(url: str, params: Any = None, **_) -> Dict[str, Any]:
+        if url == "/orders/count":
+            return counts
+        params = dict(params)
+        step = steps[params["step"]]
+        size, page = params["size"], params["page"]
+        content = [
+            {
+                "status": "PAID",
+                "step": params["step"],
+                "bookings": [
+                    {
+                        "workspace": {"title": step, "type": "desk", "building": {"name": "Paris"}},
+                        "start": (today + timedelta(days=day)).isoformat(),
+                        "end": (today + timedelta(days=day, hours=10)).isoformat(),
+                    }
+                ],
+            }
+            for day in range(1, orders[step] + 1)
+        ]
+        return {"content": content[page * size : (page + 1) * size]}
+
+    return fake_query
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_orders_added_since_count(monkeypatch, max_workers):
+    # waiting orders were added after count, they are past the last counted page
+    monkeypatch.setattr(
+        reservations_module, "query", orders_by_step({"waiting": 5, "validation": 1}, {"waiting": 3, "validation": 1})
+    )
+
+    reservations = get_reservations(
+        auth_token="token", steps=["waiting", "validation"], page_size=2, max_workers=max_workers
+    )
+    assert [resa.workspace_name for resa in reservations] == ["waiting"] * 5 + ["validation"]
+
+
+def test_map_reservations_items():
+    order = {
+        "status": "PAID",
+        "step": "WAITING",
+        "bookings": [
+            {
+                "workspace": {"title": "Parking", "type": "parking", "address": "1 rue", "building": {"name": "Paris"}},
+                "start": "2024-06-03T07:00:00.000Z",
+                "end": "2024-06-03T18:00:00.000Z",
+            }
+        ],
+    }
+    items = map_reservations({"content": [order]})
+    assert items == [
+        ReservationItem(
+            "Parking",
+            "1 rue",
+            "parking",
+            "Paris",
+            None,
+            datetime(2024, 6, 3, 7, tzinfo=timezone.utc),
+            datetime(2024, 6, 3, 18, tzinfo=timezone.utc),
+            "WAITING",
+            "PAID",
+        )
+    ]
+    assert str(items[0]) == (
+        "Parking - None / parking / status PAID / step WAITING"
+        " / from 2024-06-03T07:00:00+00:00 to 2024-06-03T18:00:00+00:00"
+    )
+    assert not hasattr(items[0], "__dict__")
+
+    frozen = map_reservations({"content": [order]}, frozen=True)[0]
+    assert isinstance(frozen, FrozenReservationItem)
+    assert str(frozen) == str(items[0])
+    assert len({frozen, map_reservations({"content": [order]}, frozen=True)[0]}) == 1
+    for item in (items[0], frozen):
+        assert pickle.loads(pickle.dumps(item)) == item
@@ -0,0 +1,26 @@
+"""
+Tests of moffi_sdk.runner
+"""
+
+from datetime import timezone
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.runner import SharedMetadata
+from moffi_sdk.spaces import BUILDING_TIMEZONE
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_shared_metadata(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    metadata = SharedMetadata()
+
+    tzinfo, details = metadata.get(city="Paris", workspace="Open space 1-0", auth_token=token)
+    assert str(tzinfo) == "Europe/Paris"
+    assert details["title"] == "Open space 1-0"
+    # building timezone of other accounts is left untouched
+    assert BUILDING_TIMEZONE.get("tz") == timezone.utc
+
+    requests = mock_api.mock.stats["requests"]
+    assert metadata.get(city="Paris", workspace="Open space 1-0", auth_token=token) == (tzinfo, details)
+    assert mock_api.mock.stats["requests"] == requests
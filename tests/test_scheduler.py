@@ -0,0 +1,30 @@
+"""
+Tests of moffi_sdk.scheduler
+"""
+
+from moffi_sdk.scheduler import AutoReservationDaemon
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_cycle_keeps_orders_in_snapshot(mock_api):
+    daemon = AutoReservationDaemon(
+        username=USERNAME,
+        password=PASSWORD,
+        desk="Desk 1-0-5",
+        city="Paris",
+        workspace="Open space 1-0",
+        scan=True,
+    )
+    daemon._refresh_state(daemon._token())  # pylint: disable=protected-access
+    before = {day for day, items in daemon.reservations.items() if items}
+
+    daemon.cycle()
+    ordered = {day for day, items in daemon.reservations.items() if items} - before
+    assert len(ordered) == mock_api.mock.requests["/orders/{id}/pay"] > 0
+
+    # next cycle books nothing more, reservations are not fetched again
+    orders_requests = mock_api.mock.requests["/orders"]
+    daemon.cycle()
+    assert mock_api.mock.requests["/orders/{id}/pay"] == len(ordered)
+    assert mock_api.mock.requests["/orders"] == orders_requests
@@ -0,0 +1,67 @@
+"""
+Tests of moffi_sdk.singleflight
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from moffi_sdk.singleflight import SingleFlight
+
+CALLERS = 8
+
+
+def run_concurrently(flight: SingleFlight, func, key="key"):
+    """Call func through flight from several threads at once, once all of them wait on it"""
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader_func():
+        started.set()
+        release.wait(5)
+        return func()
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+        futures = [executor.submit(flight.do, key, leader_func)]
+        started.wait(5)
+        futures += [executor.submit(flight.do, key, leader_func) for _ in range(CALLERS - 1)]
+        while flight.stats["shared"] < CALLERS - 1:
+            time.sleep(0.001)
+        release.set()
+    return futures
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    calls = []
+
+    futures = run_concurrently(flight, lambda: calls.append(1) or len(calls))
+    assert [future.result() for future in futures] == [1] * CALLERS
+    assert calls == [1]
+    assert flight.stats == {"calls": 1, "shared": CALLERS - 1}
+    # nothing is kept once done
+    assert not flight.in_flight("key")
+    assert flight.do("key", lambda: "again") == "again"
+
+
+def test_errors_are_shared():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("failed")
+
+    futures = run_concurrently(flight, fail)
+    for future in futures:
+        with pytest.raises(ValueError, match="failed"):
+            future.result()
+    assert flight.stats["calls"] == 1
+    assert not flight.in_flight("key")
+
+
+def test_keys_are_independent():
+    flight = SingleFlight()
+    assert flight.do("first", lambda: 1) == 1
+    assert flight.do("second", lambda: 2) == 2
+    assert flight.stats == {"calls": 2, "shared": 0}
@@ -0,0 +1,54 @@
+"""
+Tests of moffi_sdk.spaces
+"""
+
+import time
+
+import pytest
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.exceptions import ItemNotFoundException
+from moffi_sdk.spaces import get_building, get_workspace_availabilities
+
+from .conftest import PASSWORD, USERNAME
+
+LATENCY = 0.2
+
+
+def test_floors_queried_concurrently(serve_mock):
+    server = serve_mock(latency=LATENCY)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    building = get_building(name="Paris", auth_token=token)
+    assert len(building["floors"]) == 4
+
+    started = time.monotonic()
+    workspace = get_workspace_availabilities(name="Open space 3-2", building_details=building, auth_token=token)
+    assert workspace["workspace"]["title"] == "Open space 3-2"
+    # workspace is on last floor, all floors were queried at the same time
+    assert time.monotonic() - started < 2 * LATENCY
+    assert server.mock.requests["/workspaces/availabilities"] == 4
+
+
+def test_pending_floors_cancelled(serve_mock):
+    server = serve_mock(latency=LATENCY / 4)
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+    building = get_building(name="Paris", auth_token=token)
+
+    workspace = get_workspace_availabilities(
+        name="Open space 0-1", building_details=building, auth_token=token, max_workers=1
+    )
+    assert workspace["workspace"]["title"] == "Open space 0-1"
+    # floors after the one in progress at match are never queried
+    assert server.mock.requests["/workspaces/availabilities"] <= 2
+
+
+def test_workspace_not_found(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD)
+
+    with pytest.raises(ItemNotFoundException) as excinfo:
+        get_workspace_availabilities(name="Missing", city="Paris", auth_token=token)
+    # every workspace of every floor is listed
+    names = [workspace["title"] for workspace in mock_api.mock.workspaces.values() if workspace["building"]["id"] == 1]
+    assert len(names) == 12
+    assert sorted(excinfo.value.available_items) == sorted(names)
+    assert "Open space 3-2" in str(excinfo.value)
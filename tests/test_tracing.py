@@ -0,0 +1,158 @@
+"""
+Tests of moffi_sdk.tracing, and of profile_run which renders traces
+"""
+
+import json
+import pstats
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from moffi_sdk.tracing import (
+    TRACING,
+    current_span,
+    dump_chrome_trace,
+    format_waterfall,
+    span,
+    start_tracing,
+    stop_tracing,
+    traced,
+)
+from moffi_sdk.utils import submit_in_context
+from utils import profile_run
+
+
+@pytest.fixture(name="tracing")
+def fixture_tracing():
+    """Record spans during the test"""
+    start_tracing()
+    yield
+    stop_tracing()
+
+
+@traced(attributes=("step", "page"))
+def fetch(step: str, page: int = 0, size: int = 10) -> int:  # pylint: disable=unused-argument
+    with span("parse"):
+        return threading.get_ident()
+
+
+def test_tracing_off():
+    assert not TRACING["enabled"]
+    with span("ignored") as ignored:
+        assert ignored is None
+        assert current_span() is None
+    assert not stop_tracing()
+
+
+def test_traced_attributes(tracing):  # pylint: disable=unused-argument
+    fetch("waiting", page=2, size=50)
+    fetch(step="waiting", page=3)
+
+    traces = stop_tracing()
+    assert len(traces) == 2
+    positional, keyword = traces[0], traces[1]
+    assert positional.name == keyword.name == "fetch"
+    # only listed arguments given by keyword are kept
+    assert positional.attributes == {"page": 2}
+    assert keyword.attributes == {"step": "waiting", "page": 3}
+    assert [child.name for child in keyword.children] == ["parse"]
+
+
+def test_span_error(tracing):  # pylint: disable=unused-argument
+    with pytest.raises(ValueError):
+        with span("failing"):
+            raise ValueError("boom")
+
+    traces = stop_tracing()
+    assert len(traces) == 1
+    failing = traces[0]
+    assert failing.error == "ValueError('boom')"
+    assert failing.end is not None
+
+
+def test_spans_of_worker_threads(tracing):  # pylint: disable=unused-argument
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with span("listing", user="alice") as root:
+            futures = [submit_in_context(executor, fetch, step="waiting", page=page) for page in range(4)]
+            threads = {future.result() for future in futures}
+        # not submitted in context, worker span is a root span
+        executor.submit(fetch, step="orphan").result()
+
+    traces = stop_tracing()
+    assert traces == [root, traces[1]]
+    assert traces[1].attributes == {"step": "orphan"}
+    assert sorted(child.attributes["page"] for child in root.children) == [0, 1, 2, 3]
+    for child in root.children:
+        assert child.parent is root
+        assert child.children[0].parent is child
+    assert {child.thread_id for child in root.children} == threads
+    assert root.thread_id not in threads
+    assert [(item.name, depth) for item, depth in root.walk()][:3] == [("listing", 0), ("fetch", 1), ("parse", 2)]
+
+
+def test_format_waterfall(tracing):  # pylint: disable=unused-argument
+    with span("listing", user="alice"):
+        fetch(step="waiting")
+        with pytest.raises(KeyError), span("failing"):
+            raise KeyError("missing")
+    traces = stop_tracing()
+
+    lines = format_waterfall(traces, width=20).splitlines()
+    assert lines[0].split() == ["start", "ms", "duration", "ms", "span", "timeline"]
+    assert len(lines) == 5
+    assert "listing user=alice" in lines[1]
+    assert "  fetch step=waiting" in lines[2]
+    assert "    parse" in lines[3]
+    assert "  failing !" in lines[4]
+    for line in lines[1:]:
+        timeline = line[line.index("|") :]
+        assert len(timeline) == 22 and timeline.endswith("|")
+    # root span covers the whole timeline
+    assert "#" * 20 in lines[1]
+    assert format_waterfall([]) == "No span recorded"
+
+
+def test_dump_chrome_trace(tracing, tmp_path):  # pylint: disable=unused-argument
+    with pytest.raises(KeyError), span("listing", page=1):
+        fetch(step="waiting")
+        raise KeyError("missing")
+    path = tmp_path / "trace.json"
+    dump_chrome_trace(stop_tracing(), str(path))
+
+    events = json.loads(path.read_text(encoding="utf-8"))["traceEvents"]
+    assert [event["name"] for event in events] == ["listing", "fetch", "parse"]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert events[0]["args"] == {"page": "1", "error": "KeyError('missing')"}
+    assert events[0]["ts"] <= events[1]["ts"] <= events[2]["ts"]
+
+
+def test_profile_run(tmp_path, capsys):
+    output = tmp_path / "profile.json"
+    with profile_run({"profile": True, "profile_output": str(output)}):
+        fetch(step="waiting")
+
+    assert not TRACING["enabled"]
+    assert [event["name"] for event in json.loads(output.read_text(encoding="utf-8"))["traceEvents"]] == [
+        "fetch",
+        "parse",
+    ]
+    stderr = capsys.readouterr().err
+    assert "fetch step=waiting" in stderr
+    assert f"Profile written to {output}" in stderr
+
+
+def test_profile_run_cprofile(tmp_path, capsys):
+    output = tmp_path / "profile.prof"
+    with profile_run({"profile": True, "profile_output": str(output)}):
+        fetch(step="waiting")
+
+    assert pstats.Stats(str(output)).total_calls > 0
+    assert "fetch step=waiting" in capsys.readouterr().err
+
+
+def test_profile_run_disabled(capsys):
+    with profile_run({}):
+        fetch(step="waiting")
+    assert not TRACING["enabled"]
+    assert not capsys.readouterr().err
@@ -0,0 +1,68 @@
+"""
+Tests of moffi_sdk.utils
+"""
+
+import pytest
+
+from moffi_sdk.auth import get_auth_token
+from moffi_sdk.exceptions import RequestException
+from moffi_sdk.utils import configure_session, get_session, prepare_request, query
+
+from .conftest import PASSWORD, USERNAME
+
+
+def test_prepare_request():
+    url, headers = prepare_request(
+        method="GET",
+        url="orders",
+        auth_token="abc",
+        params={"page": 1},
+        headers={"Authorization": "forged", "X-Test": "1"},
+    )
+    assert url.endswith("/orders?page=1")
+    assert headers == {"X-Test": "1", "Accept": "application/json", "Authorization": "Bearer abc"}
+
+
+def test_prepare_request_unknown_method():
+    with pytest.raises(RecursionError):
+        prepare_request(method="FETCH", url="/orders", auth_token="abc")
+
+
+def test_session_is_shared_and_configurable():
+    session = get_session()
+    assert get_session() is session
+
+    new_session = configure_session(pool_maxsize=3, retries=1)
+    assert new_session is not session
+    assert get_session() is new_session
+    adapter = new_session.get_adapter("https://api.moffi.io")
+    assert adapter._pool_maxsize == 3  # pylint: disable=protected-access
+    assert adapter.max_retries.total == 1
+
+
+def test_query_retries_idempotent_requests(serve_mock):
+    server = serve_mock(error_rate=1.0, error_paths="^/users/buildings$")
+    configure_session(retries=2, backoff_factor=0)
+    token = get_auth_token(username=USERNAME, password=PASSWORD, use_cache=False)
+
+    with pytest.raises(RequestException):
+        query(method="GET", url="/users/buildings", auth_token=token)
+    assert server.mock.requests["/users/buildings"] == 3
+
+
+def test_query_never_retries_orders(serve_mock):
+    server = serve_mock(error_rate=1.0, error_paths="^/orders/add$")
+    configure_session(retries=2, backoff_factor=0)
+    token = get_auth_token(username=USERNAME, password=PASSWORD, use_cache=False)
+
+    with pytest.raises(RequestException):
+        query(method="POST", url="/orders/add", data={"bookings": []}, auth_token=token)
+    assert server.mock.requests["/orders/add"] == 1
+
+
+def test_query_keeps_connections_alive(mock_api):
+    token = get_auth_token(username=USERNAME, password=PASSWORD, use_cache=False)
+    for _ in range(3):
+        assert query(method="GET", url="/users/buildings", auth_token=token)
+    adapter = get_session().get_adapter(mock_api.url)
+    assert len(adapter.poolmanager.pools) == 1
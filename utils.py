@@ -5,10 +5,10 @@ Utils functions for main programs
 import argparse
 import logging
 import os
+import sys
 from configparser import ConfigParser
-from typing import Any, Dict, List
-
-from dateutil import parser as dateparser
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
 
 DEFAULT_CONFIG_RESERVATION_TEMPLATE = {
     "verbose": {"section": "Logging", "key": "Verbose", "mandatory": False, "default_value": False},
@@ -18,6 +18,9 @@ DEFAULT_CONFIG_RESERVATION_TEMPLATE = {
     "workspace": {"section": "Reservation", "key": "Workspace", "mandatory": True},
     "desk": {"section": "Reservation", "key": "Desk", "mandatory": True},
     "parking": {"section": "Reservation", "key": "Parking", "mandatory": False},
+    "refresh_metadata": {"mandatory": False, "default_value": False},
+    "profile": {"mandatory": False, "default_value": False},
+    "profile_output": {"mandatory": False, "default_value": None},
 }
 
 
@@ -89,6 +92,25 @@ def setup_reservation_parser() -> argparse.ArgumentParser:
     parser.add_argument("--parking", "-P", help="Parking to book")
     parser.add_argument("--desk", "-d", help="Desk to book")
     parser.add_argument("--config", help="Config file path")
+    parser.add_argument(
+        "--refresh-metadata",
+        dest="refresh_metadata",
+        action="store_true",
+        default=None,
+        help="Ignore cached buildings and workspaces, fetch them again",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=None,
+        help="Print a timing waterfall of SDK steps and API requests at the end",
+    )
+    parser.add_argument(
+        "--profile-output",
+        dest="profile_output",
+        metavar="FILE",
+        help="With --profile, also write a Chrome trace (.json) or cProfile stats (any other extension) file",
+    )
 
     return parser
 
@@ -102,6 +124,46 @@ def setup_logging(conf: Dict[str, str]) -> None:
     logging.basicConfig(level=level)
 
 
+@contextmanager
+def profile_run(conf: Dict[str, Any]) -> Iterator[None]:
+    """
+    Trace SDK steps of the block when profile is enabled in conf
+
+    Waterfall is printed on stderr, profile_output gets a Chrome trace or cProfile stats
+    """
+    if not conf.get("profile"):
+        yield
+        return
+
+    from moffi_sdk.tracing import (  # pylint: disable=import-outside-toplevel
+        dump_chrome_trace,
+        format_waterfall,
+        start_tracing,
+        stop_tracing,
+    )
+
+    output = conf.get("profile_output")
+    profiler = None
+    if output and not output.endswith(".json"):
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start_tracing()
+    try:
+        yield
+    finally:
+        traces = stop_tracing()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output)
+        elif output:
+            dump_chrome_trace(traces, output)
+        sys.stderr.write(format_waterfall(traces) + "\n")
+        if output:
+            sys.stderr.write(f"Profile written to {output}\n")
+
+
 def format_working_days(conf: Any) -> List[int]:
     """Format working_days config to a valid config"""
 
@@ -119,6 +181,8 @@ def format_working_days(conf: Any) -> List[int]:
         logging.warning(f"Working days conf is unknown type {conf}")
         return []
 
+    from dateutil import parser as dateparser  # pylint: disable=import-outside-toplevel
+
     work_days = set()
     for item in conf_list:
         # test conf as int